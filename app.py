@@ -1,192 +1,496 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
+import base64
+from collections import OrderedDict
+from contextlib import nullcontext
+import gzip
+import hashlib
+import os
 import sqlite3
+import threading
 from flask_cors import CORS
 
+try:
+    import brotli
+except ImportError:  # optional: responses fall back to gzip
+    brotli = None
+
+from matching import rank_positions
+from dedupe import DedupeReport
+from listing_store import CandidateSet, ListingStore
+from listings_index import PRICE_PERCENTILES, ListingsIndex
+import db
+import geo
+import metrics
+
 app = Flask(__name__)
 CORS(app)
 
+DATABASE = db.DATABASE
+LISTINGS_BACKEND = os.environ.get("LISTINGS_BACKEND", "index")
+
+db_pool = db.ConnectionPool(DATABASE, size=int(os.environ.get("DB_POOL_SIZE", 8)))
+
 def get_db():
-    return sqlite3.connect("database.db")
+    """Borrow a pooled connection: `with get_db() as conn: ...`."""
+    return db_pool.connection()
 
-def match_score(user_amenities, listing_amenities):
-    return len(set(user_amenities) & set(listing_amenities))
+# Bring older databases up to the current schema and fill derived columns for
+# rows inserted before they existed, so SQL-side filters see every row.
+with get_db() as _conn:
+    db.migrate(_conn)
+    db.backfill(_conn)
+    # campus reference points for `near=<slug>`
+    POIS = db.load_pois(_conn)
 
+# Compact hydrated listings shared by every request; refreshes itself when the DB changes.
+# The SQL backend keeps no index, only the DB's listings watermark.
+listings_index = None
+listings_watermark = None
+if LISTINGS_BACKEND == "sql":
+    listings_watermark = db.ListingsWatermark(DATABASE)
+else:
+    listings_index = ListingsIndex(DATABASE, snapshot_path=db.SNAPSHOT_PATH)
+    listings_index.refresh()
 
-def normalize_amenities_list(amenities):
-    """Return a list of normalized amenity strings (lowercased, trimmed, mapped, spaces -> hyphens)."""
-    AMENITY_ALIASES = {
-        "internet": "wifi",
-        "wi-fi": "wifi",
-        "wi fi": "wifi",
-        "pets": "pet-friendly",
-        "pet friendly": "pet-friendly",
-        "pet-friendly": "pet-friendly",
-    }
-    normalized = []
-    for a in (amenities or []):
-        if not isinstance(a, str):
-            continue
-        a_norm = a.strip().lower()
-        # map common aliases
-        a_mapped = AMENITY_ALIASES.get(a_norm, a_norm)
-        a_mapped = a_mapped.replace(' ', '-')
-        if a_mapped:
-            normalized.append(a_mapped)
-    return normalized
-
-
-def compute_matchability(listings, wanted_norm=None, budget=None, access_filters=None):
-    """Attach a matchability percentage to each listing in-place and return the list.
-    wanted_norm: list of normalized wanted amenities (e.g., ['wifi','gym']) or empty/None
-    budget: integer budget (or None)
-    Algorithm:
-      - amenity_score = matched_count / len(wanted_norm) (0..1). If no wanted_norm, amenity_score = 0.
-      - price_score = normalized where lower price => higher score. If budget available, use budget-range; else use min/max in listings.
-      - combine: if wanted_norm provided, weights amenity=0.6, price=0.4; else 100% price.
-      - Convert to integer percent 0..100 and add as listing['matchability']
+# per-endpoint latency/row histograms for /metrics, plus opt-in cProfile dumps of
+# the slowest requests (PROFILE_SAMPLE_RATE, PROFILE_KEEP, PROFILE_DIR)
+metrics_registry = metrics.Registry()
+profiler = metrics.SlowRequestProfiler.from_env()
+
+
+def stage(name):
+    """Time a block as one Server-Timing stage of the current request."""
+    timings = g.get("timings")
+    return timings.stage(name) if timings is not None else nullcontext()
+
+
+def refresh_listings():
+    """Bring the listings index up to date; returns the version response caches and ETags are keyed by.
+
+    That is the listings watermark (row count, max id, listings_meta.changes)
+    of the data being served, which any process serving the same database
+    state agrees on.
     """
-    if not listings:
-        return listings
-
-    prices = [l.get('price') or 0 for l in listings]
-    min_price = min(prices)
-    max_price = max(prices)
-    # avoid zero division
-    eps = 1e-6
-
-    for l in listings:
-        price = l.get('price') or 0
-
-        # price score: higher for cheaper options relative to range or budget
-        if budget:
-            denom = max(eps, (budget - min_price))
-            # if budget <= min_price then denom small; use fallback to range
-            if denom <= eps and max_price > min_price:
-                denom = max_price - min_price
-            price_score = 1.0 - max(0.0, (price - min_price) / max(denom, eps))
-        else:
-            denom = max(eps, (max_price - min_price))
-            price_score = 1.0 - ((price - min_price) / denom) if denom > eps else 1.0
-        price_score = max(0.0, min(1.0, price_score))
-
-        # amenity score
-        amenity_score = 0.0
-        matched = 0
-        if wanted_norm:
-            listing_amenities = normalize_amenities_list(l.get('amenities') or [])
-            for w in wanted_norm:
-                if w in listing_amenities:
-                    matched += 1
-            amenity_score = matched / len(wanted_norm) if wanted_norm else 0.0
-
-        # accessibility score: average of selected access_scores (normalized 0..1)
-        access_score = 0.0
-        if access_filters:
-            parts = []
-            for f in access_filters:
-                if f == 'walkable':
-                    parts.append((l.get('walkable_score') or 0) / 100.0)
-                elif f == 'transit':
-                    parts.append((l.get('transit_score') or 0) / 100.0)
-                elif f == 'car_friendly':
-                    parts.append((l.get('car_score') or 0) / 100.0)
-            if parts:
-                access_score = sum(parts) / len(parts)
-
-        # Weighting rules
-        # If user requested amenities, keep amenity weight high (0.6). The remaining 0.4
-        # is split between price and accessibility when accessibility filters are present.
-        if wanted_norm:
-            amenity_weight = 0.6
-            remaining = 0.4
-            if access_filters:
-                access_total = remaining * 0.5
-                price_weight = remaining - access_total
-                access_weight = access_total
-            else:
-                price_weight = remaining
-                access_weight = 0.0
-        else:
-            # No amenities requested: use price mostly; if access filters selected, include them.
-            if access_filters:
-                price_weight = 0.6
-                access_weight = 0.4
-            else:
-                price_weight = 1.0
-                access_weight = 0.0
+    with stage("refresh"):
+        if listings_index is None:
+            return listings_watermark.current()
+        listings_index.refresh()
+        return listings_index.version
 
-        score = (amenity_weight * amenity_score if wanted_norm else 0.0) + (price_weight * price_score) + (access_weight * access_score)
 
-        pct = int(round(max(0.0, min(1.0, score)) * 100))
-        l['matchability'] = pct
+def count_rows(kind, n):
+    timings = g.get("timings")
+    if timings is not None:
+        timings.count(kind, n)
 
-    return listings
 
+@app.before_request
+def start_timing():
+    g.timings = metrics.Timings()
+    g.profile = profiler.start()
 
-TRANSIT_CITIES = {c.lower() for c in [
-    "Toronto", "Montreal", "Vancouver", "Calgary", "Edmonton", "Ottawa", "Winnipeg",
-    "Quebec City", "Hamilton", "Mississauga", "Brampton", "Surrey", "Laval", "Halifax",
-    "London", "Markham", "Vaughan", "Gatineau", "Longueuil", "Burnaby"
-]}
 
-WALKABLE_CITIES = {c.lower() for c in ["Toronto", "Montreal", "Vancouver", "Quebec City", "Ottawa", "Halifax", "Winnipeg"]}
+@app.after_request
+def record_timing(resp):
+    timings = g.get("timings")
+    if timings is None:
+        return resp
+    total = timings.total()
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    if g.get("profile") is not None:
+        profiler.finish(g.profile, total, endpoint)
+    resp.headers["Server-Timing"] = timings.server_timing(total)
+    metrics_registry.observe_request(endpoint, request.method, resp.status_code, timings, total)
+    return resp
 
 
-def compute_accessibility_flags(listing):
-    """Return (walkable, transit, car_friendly) booleans for a listing dict."""
-    amenities = normalize_amenities_list(listing.get('amenities') or [])
-    loc = (listing.get('location') or '').strip().lower()
-    # boolean flags (existing behavior)
-    car_friendly = 'parking' in amenities
-    transit_bool = loc in TRANSIT_CITIES
-    walkable_bool = loc in WALKABLE_CITIES or 'walkable' in amenities
+def find_listings(budget=None, location=None, wanted=None, walkable=None, transit=None, car_friendly=None,
+                  near=None, text=None):
+    """Return (store, positions, text_scores) for the listings passing every filter.
 
-    # Heuristic numeric scoring (0..100)
-    # Walkability: high for known walkable cities, slightly boosted by a 'walkable' amenity
-    if loc in WALKABLE_CITIES:
-        walk_score = 80
-    else:
-        walk_score = 35
-    if 'walkable' in amenities:
-        walk_score = min(100, walk_score + 10)
-    if 'parking' in amenities:
-        # presence of parking slightly lowers pure walkability
-        walk_score = max(0, walk_score - 5)
-
-    # Transit accessibility: high for big transit cities; boosted by transit-related amenities
-    if loc in TRANSIT_CITIES:
-        transit_score = 80
-    else:
-        transit_score = 20
-    if 'transit' in amenities or 'near-transit' in amenities:
-        transit_score = min(100, transit_score + 10)
-    if 'bus' in amenities or 'subway' in amenities or 'tram' in amenities:
-        transit_score = min(100, transit_score + 5)
-
-    # Car mobility: high when parking is available or in less transit-focused cities
-    if 'parking' in amenities:
-        car_score = 90
+    Filters run in the in-memory index or, with LISTINGS_BACKEND=sql, as
+    indexed WHERE/JOIN predicates in SQLite instead of keeping the table in
+    memory (the index is then never built); SQL rows are packed into a
+    throwaway ListingStore so both backends feed the same scoring/ranking
+    code. Positions index into the store, in id order. With `text`, only
+    listings whose title matches it (via the FTS5 index) are kept and
+    text_scores maps their ids to BM25 scores; otherwise it is None.
+    """
+    text_scores = None
+    if LISTINGS_BACKEND == "sql":
+        with stage("sql"), get_db() as conn:
+            listings = db.query_listings(conn, budget=budget, location=location, wanted=wanted,
+                                         walkable=walkable, transit=transit, car_friendly=car_friendly,
+                                         near=near, text=text)
+            if text is not None:
+                text_scores = db.text_search(conn, text)
+        with stage("pack"):
+            store = ListingStore.from_listings(listings)
+        positions = range(len(store))
     else:
-        # if city has strong transit, car mobility may be less necessary
-        car_score = 40 if loc in TRANSIT_CITIES else 70
-    if 'garage' in amenities or 'covered-parking' in amenities:
-        car_score = min(100, car_score + 5)
-
-    # Normalize and attach
-    def clamp01(x):
-        return max(0, min(100, int(round(x))))
-
-    listing['walkable'] = bool(walkable_bool)
-    listing['transit'] = bool(transit_bool)
-    listing['car_friendly'] = bool(car_friendly)
-    listing['walkable_score'] = clamp01(walk_score)
-    listing['transit_score'] = clamp01(transit_score)
-    listing['car_score'] = clamp01(car_score)
+        if text is not None:
+            with stage("fts"), get_db() as conn:
+                text_scores = db.text_search(conn, text)
+        with stage("filter"):
+            store, positions = listings_index.search_positions(
+                budget=budget, location=location, wanted=wanted,
+                walkable=walkable, transit=transit, car_friendly=car_friendly, near=near,
+                ids=text_scores.keys() if text_scores is not None else None)
+    count_rows("candidates", len(positions))
+    return store, positions, text_scores
+
+
+def price_range_for(store, filters):
+    """The candidates' (min, max) price straight from the index's price stats, or None.
+
+    Only known when location and budget are the only filters (the candidate
+    set is then exactly a price-index prefix) and `store` is still the
+    index's current snapshot; otherwise scoring takes the min/max itself.
+    """
+    if listings_index is None:
+        return None
+    if filters.get("wanted") or filters.get("text") is not None or filters.get("near") is not None:
+        return None
+    if any(filters.get(key) is not None for key in ("walkable", "transit", "car_friendly")):
+        return None
+    return listings_index.price_range(store, filters.get("location"), filters.get("budget"))
+
+
+def parse_text(value):
+    """Normalize a `q` keyword search; None when it contains no searchable words."""
+    if not value or db.fts_query(value) is None:
+        return None
+    return " ".join(value.split())
+
+
+def text_relevance(store, positions, text_scores):
+    """BM25 scores of the candidates scaled to 0..1, where the best match is 1."""
+    ids = store.ids
+    bm25 = [text_scores[ids[p]] for p in positions]
+    # bm25() is negative, more negative = more relevant
+    best = min(bm25, default=0.0)
+    if best >= 0:
+        return [1.0] * len(bm25)
+    return [b / best for b in bm25]
+
+
+MAX_PAGE_SIZE = 500
+
+# lower bounds of the /api/facets price buckets; the last bucket is open-ended
+PRICE_BUCKETS = [0, 500, 750, 1000, 1250, 1500]
+
+
+def encode_cursor(score, listing_id):
+    return base64.urlsafe_b64encode(f"{score}:{listing_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the (matchability, id) keyset position encoded by encode_cursor."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    score, listing_id = base64.urlsafe_b64decode(padded.encode()).decode().split(":")
+    return int(score), int(listing_id)
+
+
+def parse_page_args(args):
+    """Read limit/offset/cursor from request args or form data.
+
+    Returns (limit, offset, after) or raises ValueError for bad combinations.
+    limit None means "everything" (the original, unpaginated behaviour).
+    """
+    limit = args.get("limit", type=int) if args.get("limit") else None
+    offset = args.get("offset", type=int) if args.get("offset") else None
+    cursor = args.get("cursor") or None
+    if args.get("limit") and limit is None or args.get("offset") and offset is None:
+        raise ValueError("limit and offset must be integers")
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if offset is not None and offset < 0:
+        raise ValueError("offset must be >= 0")
+    if cursor is not None and offset is not None:
+        raise ValueError("use either cursor or offset, not both")
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError("invalid cursor")
+    return limit, offset or 0, after
+
+
+def rank_entries(store, positions, wanted_norm, budget, access_filters, limit=None, offset=0, after=None,
+                 near=None, text_scores=None, price_range=None):
+    """Score candidates and return (ranked, has_more); ranked is [(matchability, store position)].
+
+    With near = (lat, lon, radius_km) distance to the point is part of the
+    score, and with text_scores (from find_listings) so is BM25 relevance.
+    price_range is the candidates' (min, max) price when known up front
+    (see price_range_for).
+    """
+    with stage("score"):
+        distances = store.distances_km(positions, near[0], near[1]) if near else None
+        relevance = text_relevance(store, positions, text_scores) if text_scores is not None else None
+        scores = store.matchability(positions, wanted_norm=wanted_norm, budget=budget,
+                                    access_filters=access_filters,
+                                    distances=distances, radius_km=near[2] if near else None,
+                                    relevance=relevance, price_range=price_range)
+    with stage("rank"):
+        # ask for one extra entry to learn whether another page exists
+        ids = store.ids
+        ranked = rank_positions([ids[p] for p in positions], scores,
+                                limit=None if limit is None else limit + 1, offset=offset, after=after)
+        has_more = limit is not None and len(ranked) > limit
+        if has_more:
+            ranked = ranked[:limit]
+        ranked = [(score, positions[i]) for score, i in ranked]
+    count_rows("returned", len(ranked))
+    return ranked, has_more
+
+
+def listing_result(store, pos, score, near=None):
+    """Serializable dict for one ranked listing."""
+    listing = store.row(pos)
+    listing["matchability"] = score
+    if near:
+        listing["distance_km"] = round(geo.haversine_km(near[0], near[1], listing["lat"], listing["lon"]), 3)
     return listing
 
+
+def rank_page(store, positions, wanted_norm, budget, access_filters, limit=None, offset=0, after=None, near=None,
+              text_scores=None, price_range=None):
+    """Score candidates and return (page, has_more); page items are listing dicts with matchability set."""
+    ranked, has_more = rank_entries(store, positions, wanted_norm, budget, access_filters,
+                                    limit=limit, offset=offset, after=after, near=near, text_scores=text_scores,
+                                    price_range=price_range)
+    return [listing_result(store, pos, score, near) for score, pos in ranked], has_more
+
+
+# streamed responses are flushed in chunks of roughly this many bytes
+STREAM_CHUNK_BYTES = 64 * 1024
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "array": "application/json"}
+
+
+def stream_format(args, accept):
+    """Pick a streaming format from ?format= or the Accept header, or None for the default response."""
+    fmt = args.get("format")
+    if fmt:
+        if fmt == "json":
+            return None
+        if fmt not in STREAM_FORMATS:
+            raise ValueError("format must be one of: json, ndjson, array")
+        return fmt
+    if accept.best == "application/x-ndjson":
+        return "ndjson"
+    return None
+
+
+def stream_ranked(store, ranked, fmt, near=None):
+    """Yield serialized ranked listings a chunk at a time.
+
+    One listing dict is built at a time, so memory stays flat however many
+    rows match; "array" emits the same bytes as the jsonify'd array.
+    """
+    def dumps(obj):
+        # same compact, key-sorted encoding jsonify uses
+        return app.json.dumps(obj, separators=(",", ":"))
+
+    buf = ["["] if fmt == "array" else []
+    size = 0
+    for i, (score, pos) in enumerate(ranked):
+        listing = listing_result(store, pos, score, near)
+        if fmt == "array":
+            text = ("," if i else "") + dumps(listing)
+        else:
+            text = dumps(listing) + "\n"
+        buf.append(text)
+        size += len(text)
+        if size >= STREAM_CHUNK_BYTES:
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if fmt == "array":
+        buf.append("]\n")
+    if buf:
+        yield "".join(buf)
+
+
+class ResponseCache:
+    """Bounded LRU of serialized /api/listings responses.
+
+    Entries are keyed by the canonical query and tagged with the listings
+    version (see refresh_listings; it moves on every DB change), so any
+    insert from generate_listings.py / init_db.py makes older entries
+    unreachable; they are dropped the first time a newer version is seen.
+
+    Bounded by entry count and by max_bytes over the bodies and their
+    compressed variants. An entry over max_entry_bytes (by default an eighth
+    of the budget, e.g. an unpaginated response over a large table) is not
+    kept at all, so one such request cannot flush everything else.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, max_entry_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8 if max_entry_bytes is None else max_entry_bytes
+        # key -> (CachedBody, bytes charged for it)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.oversized = 0
+
+    def _check_version(self, version):
+        if version != self._version:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            stored = self._entries.get(key)
+            if stored is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stored[0]
+
+    def put(self, version, key, entry):
+        """Store (or re-charge, after a hit added a compressed variant) an entry."""
+        if self.max_entries <= 0:
+            return
+        size = entry.nbytes
+        with self._lock:
+            self._check_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_entry_bytes:
+                self.oversized += 1
+                return
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "oversized": self.oversized,
+            }
+
+
+response_cache = ResponseCache(int(os.environ.get("RESPONSE_CACHE_SIZE", 256)),
+                               int(os.environ.get("RESPONSE_CACHE_MB", 64)) * 1024 * 1024)
+
+# bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+# content negotiation inputs: every cached JSON response varies on these
+VARY = "Accept, Accept-Encoding"
+
+
+class CachedBody:
+    """A serialized JSON response plus its compressed variants, each encoded on first use."""
+
+    __slots__ = ("body", "total", "_encoded")
+
+    def __init__(self, body, total=None):
+        self.body = body
+        self.total = total
+        self._encoded = {}
+
+    @property
+    def nbytes(self):
+        """Size of the body plus the compressed variants made so far."""
+        return len(self.body) + sum(len(data) for data in self._encoded.values())
+
+    def encoded(self, encoding):
+        if encoding is None or len(self.body) < COMPRESS_MIN_BYTES:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=5)
+            else:
+                data = gzip.compress(self.body, compresslevel=6)
+            self._encoded[encoding] = data
+        return data
+
+
+def negotiate_encoding(accept_encodings):
+    """'br' (when the brotli module is installed), 'gzip' or None, from the request's Accept-Encoding."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def response_etag(version, key):
+    """Strong ETag for a response: listings version + canonical query.
+
+    Known before any filtering or scoring runs, so conditional requests
+    can be answered up front. The version is read from the database, not
+    kept per process, so a tag issued by one serve.py worker revalidates on
+    any other. Compressed bodies get "-gzip" / "-br" appended.
+    """
+    count, max_id, changes = version
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return f"{count}.{max_id}.{changes}-{digest}"
+
+
+def matching_etag(etag):
+    """The If-None-Match tag naming any encoding of `etag`, or None."""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return etag
+    for tag in if_none_match.as_set(include_weak=True):
+        if tag == etag or tag.startswith(etag + "-"):
+            return tag
+    return None
+
+
+def not_modified(etag):
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    resp.headers["Vary"] = VARY
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+def cached_json_response(entry, encoding, etag):
+    """Serve a CachedBody in the negotiated encoding, tagged for conditional GETs."""
+    body = entry.encoded(encoding)
+    resp = app.response_class(body, mimetype="application/json")
+    if body is not entry.body:
+        resp.headers["Content-Encoding"] = encoding
+        etag = f"{etag}-{encoding}"
+    resp.set_etag(etag)
+    resp.headers["Vary"] = VARY
+    # let browsers keep the body but revalidate it (If-None-Match) every time
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 @app.route("/", methods=["GET", "POST"])
 def home():
     results = []
+    page = None
 
     if request.method == "POST":
         budget = int(request.form["budget"])
@@ -194,158 +498,543 @@ def home():
         amenities = request.form.getlist("amenities")
         # normalize user-provided amenities for matching logic
         user_amenities_norm = [a.strip().lower().replace(' ', '-') for a in amenities if a.strip()]
+        # optional keywords matched against listing titles
+        text = parse_text(request.form.get("q"))
 
-        conn = get_db()
-        c = conn.cursor()
-
-        c.execute("""
-            SELECT title, price, location, amenities
-            FROM listings
-            WHERE price <= ? AND LOWER(location) = ?
-        """, (budget, location))
-
-        rows = c.fetchall()
-        conn.close()
-
-        listings = []
-        for r in rows:
-            listings.append({
-                "title": r[0],
-                "price": r[1],
-                "location": r[2],
-                "amenities": normalize_amenities_list(r[3].split(",")) if r[3] else []
-            })
-        # compute accessibility scores/flags for each listing so matchability can use them
-        for l in listings:
-            compute_accessibility_flags(l)
         # If the user requested any amenities, require listings to include ALL requested amenities (strict AND filter)
-        if user_amenities_norm:
-            def has_all_wanted(listing):
-                listing_amenities = listing.get("amenities") or []
-                return all(w in listing_amenities for w in user_amenities_norm)
-
-            filtered = [l for l in listings if has_all_wanted(l)]
-            if not filtered:
-                results = []
-            else:
-                # compute matchability and sort by it (include selected access filters from form)
-                access_filters = []
-                if request.form.get('walkable'):
-                    access_filters.append('walkable')
-                if request.form.get('transit'):
-                    access_filters.append('transit')
-                if request.form.get('car_friendly'):
-                    access_filters.append('car_friendly')
-                compute_matchability(filtered, wanted_norm=user_amenities_norm, budget=budget, access_filters=access_filters)
-                results = sorted(filtered, key=lambda l: l.get('matchability', 0), reverse=True)
-        else:
-            access_filters = []
-            if request.form.get('walkable'):
-                access_filters.append('walkable')
-            if request.form.get('transit'):
-                access_filters.append('transit')
-            if request.form.get('car_friendly'):
-                access_filters.append('car_friendly')
-            compute_matchability(listings, wanted_norm=user_amenities_norm, budget=budget, access_filters=access_filters)
-            results = sorted(listings, key=lambda l: l.get('matchability', 0), reverse=True)
+        refresh_listings()
+        try:
+            limit, offset, after = parse_page_args(request.form)
+            store, positions, text_scores = find_listings(budget=budget, location=location,
+                                                          wanted=user_amenities_norm, text=text)
+        except ValueError as e:
+            return render_template("index.html", results=[], error=str(e)), 400
 
-    return render_template("index.html", results=results)
+        # compute matchability and rank by it (include selected access filters from form)
+        access_filters = []
+        if request.form.get('walkable'):
+            access_filters.append('walkable')
+        if request.form.get('transit'):
+            access_filters.append('transit')
+        if request.form.get('car_friendly'):
+            access_filters.append('car_friendly')
+        price_range = price_range_for(store, {"budget": budget, "location": location,
+                                              "wanted": user_amenities_norm, "text": text})
+        results, has_more = rank_page(store, positions, user_amenities_norm, budget, access_filters,
+                                      limit=limit, offset=offset, after=after, text_scores=text_scores,
+                                      price_range=price_range)
+        if limit is not None:
+            page = {
+                "total": len(positions),
+                "limit": limit,
+                "offset": offset,
+                "next_offset": offset + limit if has_more and after is None else None,
+                "prev_offset": max(0, offset - limit) if offset and after is None else None,
+                "form": request.form,
+            }
 
+    with stage("render"):
+        return render_template("index.html", results=results, page=page)
 
-@app.route("/api/listings", methods=["GET"])
-def api_listings():
-    # optional query params: budget, location, amenities (comma-separated)
-    budget = request.args.get("budget", type=int)
-    location = request.args.get("location", default=None, type=str)
-    amenities_q = request.args.get("amenities", default=None, type=str)
-
-    params = []
-    where = []
-
-    if budget is not None:
-        where.append("price <= ?")
-        params.append(budget)
-    if location:
-        where.append("LOWER(location) = ?")
-        params.append(location.lower())
-
-    q = "SELECT title, price, location, amenities FROM listings"
-    if where:
-        q += " WHERE " + " AND ".join(where)
-
-    conn = get_db()
-    c = conn.cursor()
-    c.execute(q, tuple(params))
-    rows = c.fetchall()
-    conn.close()
-
-    listings = []
-    for r in rows:
-        listings.append({
-            "title": r[0],
-            "price": r[1],
-            "location": r[2],
-            "amenities": normalize_amenities_list(r[3].split(",")) if r[3] else []
-        })
-
-    # compute accessibility flags for each listing
-    for l in listings:
-        compute_accessibility_flags(l)
-
-    # support additional boolean query params: walkable, transit, car_friendly
-    walkable_q = request.args.get('walkable')
-    transit_q = request.args.get('transit')
-    car_q = request.args.get('car_friendly')
-
-    def parse_bool(v):
-        if v is None:
-            return None
-        return v.lower() in ('1', 'true', 'yes', 'on')
 
-    walkable_filter = parse_bool(walkable_q)
-    transit_filter = parse_bool(transit_q)
-    car_filter = parse_bool(car_q)
+def parse_bool(v):
+    if v is None:
+        return None
+    return v.lower() in ('1', 'true', 'yes', 'on')
+
 
-    if walkable_filter is not None:
-        listings = [l for l in listings if l.get('walkable') == walkable_filter]
-    if transit_filter is not None:
-        listings = [l for l in listings if l.get('transit') == transit_filter]
-    if car_filter is not None:
-        listings = [l for l in listings if l.get('car_friendly') == car_filter]
+def parse_listing_filters(args):
+    """Read the /api/listings filter params into find_listings keyword arguments.
 
+    Shared by /api/listings and /api/facets. Raises ValueError for a bad
+    near/radius_km.
+    """
+    # optional query params: budget, location, amenities (comma-separated)
+    amenities_q = args.get("amenities", default=None, type=str)
     # If amenities query present, handle pet-friendly as a strict filter
     wanted_norm = None
     if amenities_q:
         wanted = [a.strip() for a in amenities_q.split(",") if a.strip()]
         wanted_norm = [a.strip().lower().replace(' ', '-') for a in wanted]
+    # optional radius search: near=lat,lon (or a campus slug) with radius_km
+    near = None
+    if args.get("near"):
+        near = geo.parse_near(args["near"], args.get("radius_km"), POIS)
+    return {
+        "budget": args.get("budget", type=int),
+        "location": args.get("location", default=None, type=str),
+        "wanted": wanted_norm,
+        # support additional boolean query params: walkable, transit, car_friendly
+        "walkable": parse_bool(args.get('walkable')),
+        "transit": parse_bool(args.get('transit')),
+        "car_friendly": parse_bool(args.get('car_friendly')),
+        "near": near,
+        # optional keyword search over titles (FTS5), blended into the ranking
+        "text": parse_text(args.get("q")),
+    }
+
+
+def access_filters_for(filters):
+    """Access filters (in walkable, transit, car_friendly order) that feed the matchability score."""
+    return [key for key in ("walkable", "transit", "car_friendly") if filters[key]]
+
+
+def filters_key(filters):
+    """Canonical cache key for parsed filters.
 
-        def has_all_wanted_api(listing):
-            listing_amenities = listing.get("amenities") or []
-            return all(w in listing_amenities for w in wanted_norm)
+    Identical queries (same filters in any spelling/order) share one key;
+    amenities stay a multiset since repeats affect the score.
+    """
+    return (
+        LISTINGS_BACKEND,
+        filters["budget"],
+        filters["location"].lower() if filters["location"] else None,
+        tuple(sorted(filters["wanted"] or [])),
+        filters["walkable"], filters["transit"], filters["car_friendly"],
+        filters["near"],
+        db.fts_query(filters["text"]) if filters["text"] else None,
+    )
+
+
+@app.route("/api/listings", methods=["GET"])
+def api_listings():
+    # optional paging: limit plus either offset or an opaque cursor from a previous page
+    # opt-in streaming: ?format=ndjson (or Accept: application/x-ndjson) / ?format=array
+    try:
+        filters = parse_listing_filters(request.args)
+        limit, offset, after = parse_page_args(request.args)
+        streaming = stream_format(request.args, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    wanted_norm = filters["wanted"]
+    budget = filters["budget"]
+    near = filters["near"]
+    # Always compute matchability and rank by it before returning
+    access_filters = access_filters_for(filters)
+
+    cache_key = filters_key(filters) + (limit, offset, after)
+    version = refresh_listings()
+
+    # conditional GET: the tag is known before any filtering/scoring, so a match costs nothing more
+    etag = response_etag(version, cache_key + (streaming,))
+    matched = matching_etag(etag)
+    if matched is not None:
+        return not_modified(matched)
+
+    if streaming:
+        # streamed bodies are never materialized, so they bypass the response cache;
+        # paging metadata travels in headers instead of an envelope
+        try:
+            store, positions, text_scores = find_listings(**filters)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        ranked, has_more = rank_entries(store, positions, wanted_norm, budget, access_filters,
+                                        limit=limit, offset=offset, after=after, near=near, text_scores=text_scores,
+                                        price_range=price_range_for(store, filters))
+        resp = app.response_class(stream_ranked(store, ranked, streaming, near), mimetype=STREAM_FORMATS[streaming])
+        resp.set_etag(etag)
+        resp.headers["Vary"] = VARY
+        resp.headers["X-Total-Count"] = str(len(positions))
+        if has_more:
+            score, pos = ranked[-1]
+            resp.headers["X-Next-Cursor"] = encode_cursor(score, store.ids[pos])
+        return resp
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    with stage("cache"):
+        cached = response_cache.get(version, cache_key)
+    if cached is not None:
+        size = cached.nbytes
+        with stage("compress"):
+            resp = cached_json_response(cached, encoding, etag)
+        if cached.nbytes != size:
+            # a compressed variant was just added; charge it to the cache's byte budget
+            response_cache.put(version, cache_key, cached)
+        resp.headers["X-Total-Count"] = str(cached.total)
+        resp.headers["X-Cache"] = "HIT"
+        return resp
+
+    try:
+        store, positions, text_scores = find_listings(**filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        filtered = [l for l in listings if has_all_wanted_api(l)]
-        if not filtered:
-            listings = []
+    items, has_more = rank_page(store, positions, wanted_norm, budget, access_filters,
+                                limit=limit, offset=offset, after=after, near=near, text_scores=text_scores,
+                                price_range=price_range_for(store, filters))
+
+    with stage("serialize"):
+        if limit is None and not offset and after is None:
+            # unpaginated requests keep the original plain-array response
+            resp = jsonify(items)
         else:
-            listings = filtered
+            last = items[-1] if items else None
+            resp = jsonify({
+                "items": items,
+                "total": len(positions),
+                "limit": limit,
+                "offset": offset if after is None else None,
+                "next_cursor": encode_cursor(last["matchability"], last["id"]) if has_more else None,
+            })
+    entry = CachedBody(resp.get_data(), len(positions))
+    with stage("compress"):
+        resp = cached_json_response(entry, encoding, etag)
+    # stored with whichever compressed variant was just made, so hits can reuse it
+    response_cache.put(version, cache_key, entry)
+    resp.headers["X-Total-Count"] = str(len(positions))
+    resp.headers["X-Cache"] = "MISS"
+    return resp
+
+
+@app.route("/api/facets", methods=["GET"])
+def api_facets():
+    """Counts per city, amenity, access flag and price bucket for the /api/listings filter context."""
+    try:
+        filters = parse_listing_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    cache_key = ("facets",) + filters_key(filters)
+    version = refresh_listings()
+    etag = response_etag(version, cache_key)
+    matched = matching_etag(etag)
+    if matched is not None:
+        return not_modified(matched)
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    with stage("cache"):
+        cached = response_cache.get(version, cache_key)
+    if cached is not None:
+        size = cached.nbytes
+        resp = cached_json_response(cached, encoding, etag)
+        if cached.nbytes != size:
+            response_cache.put(version, cache_key, cached)
+        resp.headers["X-Cache"] = "HIT"
+        return resp
+
+    try:
+        store, positions, _ = find_listings(**filters)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with stage("facets"):
+        counts = store.facet_counts(positions, PRICE_BUCKETS)
+    with stage("serialize"):
+        entry = CachedBody(jsonify(counts).get_data(), counts["total"])
+    resp = cached_json_response(entry, encoding, etag)
+    response_cache.put(version, cache_key, entry)
+    resp.headers["X-Cache"] = "MISS"
+    return resp
+
+
+# /api/match/batch limits
+MAX_BATCH_PROFILES = 1000
+DEFAULT_TOP_K = 10
+
+
+def parse_profile(profile):
+    """Read one /api/match/batch preference profile (a JSON object) into find_listings keyword arguments.
+
+    Accepts the /api/listings filters as JSON values: amenities may be a
+    list or a comma-separated string, the access flags booleans or strings.
+    Raises ValueError for malformed fields.
+    """
+    if not isinstance(profile, dict):
+        raise ValueError("profile must be an object")
+    budget = profile.get("budget")
+    if budget in (None, ""):
+        budget = None
+    else:
+        try:
+            budget = int(budget)
+        except (TypeError, ValueError):
+            raise ValueError("budget must be an integer")
+    amenities = profile.get("amenities") or []
+    if isinstance(amenities, str):
+        amenities = amenities.split(",")
+    wanted_norm = [str(a).strip().lower().replace(' ', '-') for a in amenities if str(a).strip()] or None
+    near = profile.get("near")
+    if isinstance(near, (list, tuple)):
+        near = ",".join(str(part) for part in near)
+    near = geo.parse_near(str(near), profile.get("radius_km"), POIS) if near else None
+
+    def flag(key):
+        value = profile.get(key)
+        return value if value is None or isinstance(value, bool) else parse_bool(str(value))
+
+    return {
+        "budget": budget,
+        "location": profile.get("location") or None,
+        "wanted": wanted_norm,
+        "walkable": flag("walkable"),
+        "transit": flag("transit"),
+        "car_friendly": flag("car_friendly"),
+        "near": near,
+        "text": parse_text(profile.get("q")),
+    }
+
+
+@app.route("/api/match/batch", methods=["POST"])
+def api_match_batch():
+    """Top-K listings for many preference profiles in one request.
+
+    Body: {"profiles": [{"id", "budget", "location", "amenities", "walkable", "transit",
+    "car_friendly", "near", "radius_km", "q"}, ...], "top_k": 10}. Profiles are grouped
+    by location so each city's candidates are looked up once; every profile is then
+    filtered and scored against its group, and identical profiles share one result.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get("profiles"), list):
+        return jsonify({"error": "expected a JSON object with a 'profiles' list"}), 400
+    profiles = body["profiles"]
+    if len(profiles) > MAX_BATCH_PROFILES:
+        return jsonify({"error": f"at most {MAX_BATCH_PROFILES} profiles per batch"}), 400
+    top_k = body.get("top_k", DEFAULT_TOP_K)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"top_k must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    parsed = []
+    for i, profile in enumerate(profiles):
+        try:
+            parsed.append(parse_profile(profile))
+        except ValueError as e:
+            return jsonify({"error": f"profile {i}: {e}"}), 400
+
+    groups = {}
+    for i, filters in enumerate(parsed):
+        groups.setdefault(filters["location"].lower() if filters["location"] else None, []).append(i)
+
+    refresh_listings()
+    results = [None] * len(parsed)
+    for location, members in groups.items():
+        try:
+            store, base, _ = find_listings(location=location)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        candidates = CandidateSet(store, base)
+        done = {}
+        for i in members:
+            filters = parsed[i]
+            key = filters_key(filters)
+            if key not in done:
+                with stage("filter"):
+                    positions = candidates.filter(
+                        budget=filters["budget"], wanted=filters["wanted"], walkable=filters["walkable"],
+                        transit=filters["transit"], car_friendly=filters["car_friendly"], near=filters["near"])
+                text_scores = None
+                if filters["text"] is not None:
+                    try:
+                        with stage("fts"), get_db() as conn:
+                            text_scores = db.text_search(conn, filters["text"])
+                    except ValueError as e:
+                        return jsonify({"error": f"profile {i}: {e}"}), 400
+                    matched = set(store.positions_of(text_scores.keys()))
+                    positions = [p for p in positions if p in matched]
+                items, _ = rank_page(store, positions, filters["wanted"], filters["budget"],
+                                     access_filters_for(filters), limit=top_k, near=filters["near"],
+                                     text_scores=text_scores, price_range=price_range_for(store, filters))
+                done[key] = {"total": len(positions), "items": items}
+            results[i] = {"id": profiles[i].get("id"), **done[key]}
+    count_rows("profiles", len(parsed))
+    with stage("serialize"):
+        return jsonify({"results": results})
+
+
+def parse_new_listing(body):
+    """Validate a POST /api/listings body into a listing dict for db.insert_listings; raises ValueError."""
+    if not isinstance(body, dict):
+        raise ValueError("expected a JSON object")
+    title, location = body.get("title"), body.get("location")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("title is required")
+    if not isinstance(location, str) or not location.strip():
+        raise ValueError("location is required")
+    price = body.get("price")
+    if price is not None and (isinstance(price, bool) or not isinstance(price, int) or price < 0):
+        raise ValueError("price must be a non-negative integer")
+    amenities = body.get("amenities") or []
+    if isinstance(amenities, str):
+        amenities = amenities.split(",")
+    if not isinstance(amenities, list) or not all(isinstance(a, str) for a in amenities):
+        raise ValueError("amenities must be a list of strings")
+    listing = {"title": title.strip(), "price": price, "location": location.strip(), "amenities": amenities}
+    lat, lon = body.get("lat"), body.get("lon")
+    if lat is not None or lon is not None:
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            raise ValueError("lat and lon must both be numbers")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("lat/lon is out of range")
+        listing["lat"], listing["lon"] = lat, lon
+    return listing
+
+
+@app.route("/api/listings", methods=["POST"])
+def api_create_listing():
+    """Insert one listing; saved searches it satisfies pick it up in their match feeds.
+
+    A duplicate of a stored listing is not inserted: the response is 200 with
+    that listing's id and "duplicate": "exact" or "near".
+    """
+    try:
+        listing = parse_new_listing(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ids = []
+    report = DedupeReport()
+    with stage("insert"), get_db() as conn:
+        db.insert_listings(conn, [listing], on_batch=lambda batch_ids, batch: ids.extend(batch_ids), report=report)
+        conn.commit()
+    if not ids:
+        # merged into an existing listing rather than inserted
+        kind, _, duplicate_of = report.examples[0]
+        return jsonify({"id": duplicate_of, "duplicate": kind}), 200
+    return jsonify({"id": ids[0]}), 201
+
+
+# longest saved-search name accepted
+MAX_SAVED_SEARCH_NAME = 200
+
+
+@app.route("/api/saved-searches", methods=["POST"])
+def api_create_saved_search():
+    """Save a search (a /api/match/batch-style profile plus an optional name).
+
+    Listings inserted from now on are matched against it as they are written;
+    read them from /api/saved-searches/<id>/matches.
+    """
+    body = request.get_json(silent=True)
+    try:
+        filters = parse_profile(body)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if filters.pop("text") is not None:
+        return jsonify({"error": "saved searches do not support q"}), 400
+    name = body.get("name")
+    if name is not None and (not isinstance(name, str) or len(name) > MAX_SAVED_SEARCH_NAME):
+        return jsonify({"error": f"name must be a string of at most {MAX_SAVED_SEARCH_NAME} characters"}), 400
+    with get_db() as conn:
+        search_id = db.create_saved_search(conn, name=name, **filters)
+        conn.commit()
+    return jsonify({"id": search_id, "since": 0}), 201
+
+
+@app.route("/api/saved-searches/<int:search_id>", methods=["GET", "DELETE"])
+def api_saved_search(search_id):
+    with get_db() as conn:
+        if request.method == "DELETE":
+            deleted = db.delete_saved_search(conn, search_id)
+            conn.commit()
+            return ("", 204) if deleted else (jsonify({"error": "no such saved search"}), 404)
+        search = db.get_saved_search(conn, search_id)
+    if search is None:
+        return jsonify({"error": "no such saved search"}), 404
+    return jsonify(search)
+
+
+@app.route("/api/saved-searches/<int:search_id>/matches", methods=["GET"])
+def api_saved_search_matches(search_id):
+    """Listings matched to a saved search since the `since` cursor, oldest first.
+
+    Each item carries its `cursor`; pass next_since back as `since` to poll
+    for newer matches. Listings are scored against the saved criteria.
+    """
+    since = request.args.get("since", type=int) if request.args.get("since") else 0
+    limit = request.args.get("limit", type=int) if request.args.get("limit") else 100
+    if since is None or limit is None or since < 0:
+        return jsonify({"error": "since and limit must be non-negative integers"}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    with get_db() as conn:
+        search = db.get_saved_search(conn, search_id)
+        if search is None:
+            return jsonify({"error": "no such saved search"}), 404
+        with stage("sql"):
+            matches = db.saved_search_matches(conn, search_id, since=since, limit=limit)
+
+    with stage("score"):
+        store = ListingStore.from_listings(listing for _, listing in matches)
+        positions = list(range(len(store)))
+        near = search["near"]
+        scores = store.matchability(positions, wanted_norm=search["wanted"], budget=search["budget"],
+                                    access_filters=access_filters_for(search),
+                                    distances=store.distances_km(positions, near[0], near[1]) if near else None,
+                                    radius_km=near[2] if near else None)
+    items = []
+    for pos, (cursor, _) in enumerate(matches):
+        item = listing_result(store, pos, scores[pos], near)
+        item["cursor"] = cursor
+        items.append(item)
+    count_rows("returned", len(items))
+    return jsonify({
+        "items": items,
+        "since": since,
+        "next_since": matches[-1][0] if matches else since,
+        "has_more": len(matches) == limit,
+    })
+
+
+@app.route("/api/price-stats", methods=["GET"])
+def api_price_stats():
+    """Precomputed price stats (count, unpriced, min/max, p25/p50/p75) for ?location= (default: all listings)."""
+    location = request.args.get("location") or None
+    refresh_listings()
+    if listings_index is None:
+        with stage("sql"), get_db() as conn:
+            stats = db.price_stats(conn, location, PRICE_PERCENTILES)
+    else:
+        stats = listings_index.price_stats(location)
+    if stats is None:
+        return jsonify({"error": "no listings for that location"}), 404
+    return jsonify(stats)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: the database answers and the listings index is loaded and current."""
+    try:
+        with get_db() as conn:
+            conn.execute("SELECT 1 FROM listings LIMIT 1")
+        refresh_listings()
+    except sqlite3.Error as e:
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    if listings_index is None:
+        return jsonify({"status": "ready", "pid": os.getpid(), "index_rows": None, "index_generation": None})
+    return jsonify({"status": "ready", "pid": os.getpid(), "index_rows": len(listings_index.store),
+                    "index_generation": listings_index.generation})
 
-    # Always compute matchability and sort by it before returning
-    access_filters = []
-    if walkable_filter:
-        access_filters.append('walkable')
-    if transit_filter:
-        access_filters.append('transit')
-    if car_filter:
-        access_filters.append('car_friendly')
 
-    compute_matchability(listings, wanted_norm=wanted_norm, budget=budget, access_filters=access_filters)
-    listings = sorted(listings, key=lambda l: l.get('matchability', 0), reverse=True)
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus text exposition of request/stage histograms and cache/index state."""
+    cache = response_cache.stats()
+    samples = [
+        ("response_cache_hits_total", "counter", (), cache["hits"]),
+        ("response_cache_misses_total", "counter", (), cache["misses"]),
+        ("response_cache_evictions_total", "counter", (), cache["evictions"]),
+        ("response_cache_invalidations_total", "counter", (), cache["invalidations"]),
+        ("response_cache_oversized_total", "counter", (), cache["oversized"]),
+        ("response_cache_entries", "gauge", (), cache["entries"]),
+        ("response_cache_bytes", "gauge", (), cache["bytes"]),
+    ]
+    if listings_index is not None:
+        samples += [
+            ("index_generation", "gauge", (), listings_index.generation),
+            ("index_rows", "gauge", (), len(listings_index.store)),
+        ]
+    return app.response_class(metrics_registry.render(samples), mimetype="text/plain; version=0.0.4")
 
-    return jsonify(listings)
 
 if __name__ == "__main__":
-    import os
     port = int(os.environ.get('PORT', 5001))
     host = os.environ.get('HOST', '127.0.0.1')
+    # development server; use serve.py for a multi-worker production server
     print(f"Starting Flask app on {host}:{port}")
     app.run(debug=True, host=host, port=port)
@@ -0,0 +1,318 @@
+"""Benchmarks for the matching backend.
+
+Usage:
+    python benchmark.py seed --size 100k              # build bench/listings-100k.db
+    python benchmark.py micro --size 100k             # normalize / accessibility / matchability
+    python benchmark.py load --size 100k --requests 2000 --concurrency 8
+    python benchmark.py load --url http://127.0.0.1:5001 --requests 2000
+    python benchmark.py all --sizes 1k,100k --out bench_results.json
+
+Every command prints one JSON report (throughput, p50/p95/p99 latency in ms,
+peak RSS in MB) so runs can be diffed or plotted.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import db
+
+SIZES = {"1k": 1000, "10k": 10000, "100k": 100000, "1m": 1000000}
+
+BENCH_DIR = "bench"
+
+
+def parse_size(size):
+    return SIZES.get(str(size).lower()) or int(size)
+
+
+def db_path_for(size):
+    return os.path.join(BENCH_DIR, f"listings-{size}.db")
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (ms) for a list of per-call seconds."""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "throughput_per_s": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p50_ms": round(pct(50), 4),
+        "p95_ms": round(pct(95), 4),
+        "p99_ms": round(pct(99), 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def seed(size, path=None, force=False):
+    """Create a benchmark database of `size` synthetic listings (reused if it exists).
+
+    Seeded with exact dedupe only (near_duplicates=False): MinHash would about
+    halve the load rate, and synthetic rows have no near-duplicates to find.
+    """
+    import generate_listings
+
+    n = parse_size(size)
+    path = path or db_path_for(size)
+    if os.path.exists(path) and not force:
+        conn = db.connect(path)
+        rows = conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+        conn.close()
+        return {"path": path, "rows": rows, "reused": True}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    random.seed(n)
+    started = time.perf_counter()
+    conn = db.connect(path)
+    db.migrate(conn)
+    rows = db.insert_listings(conn, generate_listings.generate_listing_stream((), n),
+                              batch_size=generate_listings.BATCH_SIZE, near_duplicates=False)
+    conn.commit()
+    conn.close()
+    elapsed = time.perf_counter() - started
+    return {"path": path, "rows": rows, "seconds": round(elapsed, 3), "rows_per_s": round(rows / elapsed)}
+
+
+def load_rows(path, limit=None):
+    conn = db.connect(path)
+    q = "SELECT " + ", ".join(db.LISTING_COLUMNS) + " FROM listings ORDER BY id"
+    if limit:
+        q += f" LIMIT {int(limit)}"
+    rows = conn.execute(q).fetchall()
+    conn.close()
+    return rows
+
+
+def time_calls(fn, args_list, repeat=1):
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for args in args_list:
+            t = time.perf_counter()
+            fn(*args)
+            latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def micro(size, candidates=50000):
+    """Micro-benchmarks for the per-row helpers and the two matchability paths."""
+    from matching import (
+        normalize_amenities_list, compute_accessibility_flags, compute_matchability,
+        score_matchability, AMENITIES,
+    )
+
+    path = db_path_for(size)
+    seed(size, path)
+    rows = load_rows(path, limit=candidates)
+    listings = [db.hydrate_row(r) for r in rows]
+    raw_amenities = [(r[4].replace("wifi", "Wi-Fi").split(","),) for r in rows[:20000]]
+    access_inputs = [({"location": l["location"], "amenities": l["amenities"]},) for l in listings[:20000]]
+    masks = [AMENITIES.mask(l["amenities"]) for l in listings]
+
+    cases = [
+        ("price_only", None, 900, None),
+        ("amenities", ["wifi", "gym"], 900, None),
+        ("amenities_access", ["wifi", "pool"], 1000, ["walkable", "transit"]),
+    ]
+    report = {
+        "normalize_amenities_list": time_calls(normalize_amenities_list, raw_amenities),
+        "compute_accessibility_flags": time_calls(compute_accessibility_flags, access_inputs),
+    }
+    for name, wanted, budget, access in cases:
+        for fn in (compute_matchability, score_matchability):
+            batch = [dict(l) for l in listings]
+            report[f"{fn.__name__}[{name}, n={len(batch)}]"] = time_calls(
+                lambda: fn(batch, wanted_norm=wanted, budget=budget, access_filters=access, amenity_masks=masks),
+                [()], repeat=5)
+    return report
+
+
+def random_query(rng, cities):
+    """One /api/listings query string dict drawn from a realistic mix."""
+    q = {}
+    if rng.random() < 0.7:
+        q["budget"] = rng.choice([600, 800, 1000, 1200])
+    if rng.random() < 0.6:
+        q["location"] = rng.choice(cities)
+    if rng.random() < 0.5:
+        q["amenities"] = ",".join(rng.sample(["wifi", "gym", "pool", "parking", "pet-friendly"], rng.randint(1, 2)))
+    for flag in ("walkable", "transit", "car_friendly"):
+        if rng.random() < 0.15:
+            q[flag] = "true"
+    if rng.random() < 0.5:
+        q["limit"] = 24
+    return q
+
+
+def load(size=None, url=None, requests=1000, concurrency=4, form_share=0.1, seed_value=1):
+    """End-to-end load: /api/listings GETs plus a share of `/` form POSTs.
+
+    Runs in-process through Flask's test client (after pointing the app at
+    the benchmark DB) unless `url` names a running server.
+    """
+    from generate_listings import CITIES
+
+    if url is None:
+        path = db_path_for(size)
+        seeded = seed(size, path)
+        # app.py takes its database (and snapshot) path from db when it is imported,
+        # and db was imported above, so DATABASE_PATH would no longer be read
+        db.DATABASE = path
+        db.SNAPSHOT_PATH = path + ".snap"
+        import app as flask_app
+        if flask_app.DATABASE != path:
+            raise RuntimeError(f"app was already imported with {flask_app.DATABASE}")
+        if flask_app.listings_index is not None and len(flask_app.listings_index.store) != seeded["rows"]:
+            raise RuntimeError(f"app indexed {len(flask_app.listings_index.store)} listings, "
+                               f"expected the {seeded['rows']} in {path}")
+        client_factory = flask_app.app.test_client
+
+        def do_get(client, q):
+            resp = client.get("/api/listings", query_string=q)
+            return resp.status_code, len(resp.get_data())
+
+        def do_post(client, form):
+            resp = client.post("/", data=form)
+            return resp.status_code, len(resp.get_data())
+    else:
+        client_factory = lambda: None
+
+        def do_get(client, q):
+            with urllib.request.urlopen(url + "/api/listings?" + urllib.parse.urlencode(q)) as resp:
+                return resp.status, len(resp.read())
+
+        def do_post(client, form):
+            data = urllib.parse.urlencode(form, doseq=True).encode()
+            with urllib.request.urlopen(url + "/", data=data) as resp:
+                return resp.status, len(resp.read())
+
+    rng = random.Random(seed_value)
+    plan = []
+    for _ in range(requests):
+        q = random_query(rng, CITIES)
+        if rng.random() < form_share:
+            form = {"budget": str(q.get("budget", 1200)), "location": rng.choice(CITIES),
+                    "amenities": q.get("amenities", "").split(",") if q.get("amenities") else [], "limit": "25"}
+            plan.append(("POST /", form))
+        else:
+            plan.append(("GET /api/listings", q))
+
+    latencies = {"GET /api/listings": [], "POST /": []}
+    errors = []
+    bytes_out = [0]
+    lock = threading.Lock()
+    cursor = iter(plan)
+
+    def worker():
+        client = client_factory()
+        while True:
+            with lock:
+                item = next(cursor, None)
+            if item is None:
+                return
+            kind, params = item
+            t = time.perf_counter()
+            try:
+                status, size_bytes = (do_post if kind == "POST /" else do_get)(client, params)
+            except Exception as e:
+                status, size_bytes = repr(e), 0
+            elapsed = time.perf_counter() - t
+            with lock:
+                latencies[kind].append(elapsed)
+                bytes_out[0] += size_bytes
+                if status != 200:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "target": url or db_path_for(size),
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "overall": summarize(latencies["GET /api/listings"] + latencies["POST /"], elapsed),
+        "endpoints": {k: summarize(v, elapsed) for k, v in latencies.items()},
+        "errors": len(errors),
+        "bytes_out": bytes_out[0],
+    }
+
+
+def run_all(sizes, requests, concurrency):
+    """Seed + micro + load for each size, each in a fresh process so RSS is per size."""
+    results = {}
+    for size in sizes:
+        results[size] = {}
+        for command in (["seed"], ["micro"], ["load", "--requests", str(requests), "--concurrency", str(concurrency)]):
+            out = subprocess.run([sys.executable, __file__, *command, "--size", size],
+                                 check=True, capture_output=True, text=True).stdout
+            results[size][command[0]] = json.loads(out)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the listings backend")
+    parser.add_argument("command", choices=["seed", "micro", "load", "all"])
+    parser.add_argument("--size", default="1k", help="Dataset size: 1k, 10k, 100k, 1m or a row count")
+    parser.add_argument("--sizes", default="1k,100k", help="Comma-separated sizes for `all`")
+    parser.add_argument("--force", action="store_true", help="Re-seed even if the benchmark DB exists")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process test client")
+    parser.add_argument("--out", help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "seed":
+        result = seed(args.size, force=args.force)
+    elif args.command == "micro":
+        result = micro(args.size)
+    elif args.command == "load":
+        result = load(args.size, url=args.url, requests=args.requests, concurrency=args.concurrency)
+    else:
+        result = run_all(args.sizes.split(","), args.requests, args.concurrency)
+
+    report = {
+        "command": args.command,
+        "size": args.size,
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "result": result,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,916 @@
+"""SQLite schema, write-time derivation of listing columns, and pushed-down listing queries.
+
+Usage:
+    python db.py migrate    # create/upgrade the schema in database.db
+    python db.py backfill   # fill derived columns + listing_amenities for existing rows
+    python db.py snapshot   # write the listings index snapshot (database.db.snap) for fast worker startup
+    python db.py dedupe     # hash rows stored before dedupe keys existed, merging duplicates (--dry-run to only report)
+
+The database path defaults to database.db and can be overridden with DATABASE_PATH.
+"""
+from contextlib import contextmanager
+import math
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+
+from dedupe import DedupeReport, DuplicateIndex, ListingKeys, title_shingles
+from geo import CAMPUSES, bounding_box, haversine_km
+from matching import normalize_amenities_list, compute_accessibility_flags
+from saved_searches import SAVED_SEARCH_COLUMNS, SavedSearchIndex
+
+DATABASE = os.environ.get("DATABASE_PATH", "database.db")
+# precomputed listings index written by `python db.py snapshot`, mapped by each app worker at startup
+SNAPSHOT_PATH = os.environ.get("LISTINGS_SNAPSHOT", DATABASE + ".snap")
+
+# applied to every connection opened through connect()
+PRAGMAS = {
+    # readers never block on generate_listings.py's writer (and vice versa)
+    "journal_mode": "WAL",
+    # durable enough with WAL; avoids an fsync per commit
+    "synchronous": "NORMAL",
+    # negative = KiB, so ~20 MB of page cache per connection
+    "cache_size": -20000,
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+    # off by default in SQLite; the ON DELETE CASCADE clauses in the schema depend on it
+    "foreign_keys": "ON",
+}
+
+# prepared statements kept per connection, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+
+
+def connect(path=None, check_same_thread=True):
+    """Open a tuned SQLite connection (WAL, PRAGMAS, statement cache)."""
+    conn = sqlite3.connect(path or DATABASE, check_same_thread=check_same_thread,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """A bounded pool of tuned connections shared by request threads.
+
+    Connections are opened lazily up to `size`; a borrower waits (up to
+    `timeout` seconds) when all of them are in use. Connections go back to the
+    pool with any open transaction rolled back.
+    """
+
+    def __init__(self, path=None, size=8, timeout=10.0):
+        self.path = path or DATABASE
+        self.size = size
+        self.timeout = timeout
+        # LIFO so the most recently used (warm cache) connection is reused first
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return connect(self.path, check_same_thread=False)
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"no database connection available after {self.timeout}s")
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        """Close idle connections (e.g. before forking or at shutdown)."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+def listings_watermark(c):
+    """(row count, max id, listings_meta.changes); changes is None on databases without it."""
+    c.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM listings")
+    count, max_id = c.fetchone()
+    try:
+        changes = c.execute("SELECT changes FROM listings_meta").fetchone()[0]
+    except (sqlite3.OperationalError, TypeError):
+        changes = None
+    return count, max_id, changes
+
+
+class ListingsWatermark:
+    """The current listings_watermark() of a database, re-read only after a commit.
+
+    Like ListingsIndex it watches `PRAGMA data_version` on its own
+    connection, so checking an unchanged database is one PRAGMA. Used as the
+    cache/ETag version by LISTINGS_BACKEND=sql, which keeps no index.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DATABASE
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._value = (0, 0, None)
+
+    def close(self):
+        """Close the connection, e.g. before forking; the next current() reopens it."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+
+    def current(self):
+        with self._lock:
+            if self._conn is None:
+                self._conn = connect(self.path, check_same_thread=False)
+            c = self._conn.cursor()
+            version = c.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version:
+                try:
+                    self._value = listings_watermark(c)
+                except sqlite3.OperationalError:
+                    # listings table not created yet
+                    self._value = (0, 0, None)
+                self._data_version = version
+            return self._value
+
+
+SCHEMA_VERSION = 8
+
+# columns derived from (location, amenities) by compute_accessibility_flags
+DERIVED_COLUMNS = ["walkable", "transit", "car_friendly", "walkable_score", "transit_score", "car_score"]
+
+# optional coordinates (NULL when unknown), mirrored into listings_rtree
+GEO_COLUMNS = ["lat", "lon"]
+
+LISTING_COLUMNS = ["id", "title", "price", "location", "amenities"] + DERIVED_COLUMNS + GEO_COLUMNS
+
+
+def has_rtree(conn):
+    """True when the listings_rtree spatial index exists (SQLite built with R*Tree)."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_rtree'"
+    ).fetchone() is not None
+
+
+RTREE_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS listings_rtree_insert AFTER INSERT ON listings
+WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+BEGIN
+    INSERT INTO listings_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+END
+"""
+
+
+def _create_rtree(c):
+    created = not has_rtree(c.connection)
+    try:
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite without the R*Tree module: radius queries fall back to idx_listings_lat_lon
+        return False
+    # kept in sync by triggers, so every writer (and raw SQL) maintains it
+    # (bulk inserts swap the insert trigger for one fill afterwards, see insert_listings)
+    c.execute(RTREE_INSERT_TRIGGER)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS listings_rtree_update AFTER UPDATE OF lat, lon ON listings
+    BEGIN
+        DELETE FROM listings_rtree WHERE id = OLD.id;
+        INSERT INTO listings_rtree SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+        WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS listings_rtree_delete AFTER DELETE ON listings
+    BEGIN
+        DELETE FROM listings_rtree WHERE id = OLD.id;
+    END
+    """)
+    if created:
+        # index rows written before the table existed (not on every migrate(): that is a full scan)
+        c.execute("""
+        INSERT INTO listings_rtree
+        SELECT id, lat, lat, lon, lon FROM listings WHERE lat IS NOT NULL AND lon IS NOT NULL
+        """)
+    return True
+
+
+def has_fts(conn):
+    """True when the listings_fts full-text index exists (SQLite built with FTS5)."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'listings_fts'"
+    ).fetchone() is not None
+
+
+FTS_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS listings_fts_insert AFTER INSERT ON listings
+BEGIN
+    INSERT INTO listings_fts (rowid, title) VALUES (NEW.id, NEW.title);
+END
+"""
+
+
+def _create_fts(c):
+    created = not has_fts(c.connection)
+    try:
+        # external-content table: the text lives in listings, FTS5 keeps only the index
+        c.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, content='listings', content_rowid='id', tokenize='porter unicode61'
+        )
+        """)
+    except sqlite3.OperationalError:
+        # SQLite without FTS5: `q` searches report that text search is unavailable
+        return False
+    # like the R*Tree, batched inserts swap the insert trigger for one fill (see insert_listings)
+    c.execute(FTS_INSERT_TRIGGER)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS listings_fts_update AFTER UPDATE OF title ON listings
+    BEGIN
+        INSERT INTO listings_fts (listings_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+        INSERT INTO listings_fts (rowid, title) VALUES (NEW.id, NEW.title);
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER IF NOT EXISTS listings_fts_delete AFTER DELETE ON listings
+    BEGIN
+        INSERT INTO listings_fts (listings_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+    END
+    """)
+    if created:
+        # index rows written before the table existed
+        c.execute("INSERT INTO listings_fts (listings_fts) VALUES ('rebuild')")
+    return True
+
+
+def migrate(conn):
+    """Create or upgrade the schema in-place. Safe to run repeatedly."""
+    c = conn.cursor()
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS listings (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        price INTEGER,
+        location TEXT,
+        amenities TEXT
+    )
+    """)
+    existing = {r[1] for r in c.execute("PRAGMA table_info(listings)")}
+    for col in DERIVED_COLUMNS:
+        if col not in existing:
+            c.execute(f"ALTER TABLE listings ADD COLUMN {col} INTEGER")
+    for col in GEO_COLUMNS:
+        if col not in existing:
+            c.execute(f"ALTER TABLE listings ADD COLUMN {col} REAL")
+    if "content_hash" not in existing:
+        # dedupe.content_hash of the row; NULL for rows stored before it existed (see dedupe_listings)
+        c.execute("ALTER TABLE listings ADD COLUMN content_hash BLOB")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_listings_content_hash ON listings(content_hash)")
+    # MinHash/LSH band buckets of listing titles, probed for near-duplicates at insert.
+    # Rows of deleted listings are left behind; if the id is reused they only add a
+    # candidate, which is still compared against the listing actually stored.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS listing_lsh (
+        bucket INTEGER NOT NULL,
+        listing_id INTEGER NOT NULL,
+        PRIMARY KEY (bucket, listing_id)
+    ) WITHOUT ROWID
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS listing_amenities (
+        listing_id INTEGER NOT NULL REFERENCES listings(id) ON DELETE CASCADE,
+        amenity TEXT NOT NULL,
+        PRIMARY KEY (amenity, listing_id)
+    ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_listing_amenities_listing ON listing_amenities(listing_id)")
+    # matches the `LOWER(location) = ?` predicate used by every location query
+    c.execute("CREATE INDEX IF NOT EXISTS idx_listings_location_price ON listings(LOWER(location), price)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_listings_access ON listings(walkable, transit, car_friendly, price)")
+    # keeps the startup backfill check from scanning every row
+    c.execute("CREATE INDEX IF NOT EXISTS idx_listings_unscored ON listings(id) WHERE walkable_score IS NULL")
+    # bumped on every UPDATE/DELETE of listings, so a loaded snapshot or index can tell
+    # "only new rows since" (apply a delta) from "rows changed" (rebuild)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS listings_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        changes INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO listings_meta (id, changes) VALUES (1, 0)")
+    for event in ("UPDATE", "DELETE"):
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS listings_meta_{event.lower()} AFTER {event} ON listings
+        BEGIN
+            UPDATE listings_meta SET changes = changes + 1 WHERE id = 1;
+        END
+        """)
+
+    if not _create_rtree(c):
+        c.execute("CREATE INDEX IF NOT EXISTS idx_listings_lat_lon ON listings(lat, lon)")
+    _create_fts(c)
+    # campus / point-of-interest reference points for `near=<slug>`
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS pois (
+        slug TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        kind TEXT NOT NULL DEFAULT 'campus',
+        city TEXT,
+        lat REAL NOT NULL,
+        lon REAL NOT NULL
+    )
+    """)
+    c.executemany(
+        "INSERT OR IGNORE INTO pois (slug, name, kind, city, lat, lon) VALUES (?, ?, 'campus', ?, ?, ?)",
+        CAMPUSES
+    )
+    # saved searches (the /api/listings filters, minus `q`) and the new listings
+    # matched against them at insert time; saved_search_matches.id is the feed cursor
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS saved_searches (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        budget INTEGER,
+        location TEXT,
+        amenities TEXT,
+        walkable INTEGER,
+        transit INTEGER,
+        car_friendly INTEGER,
+        lat REAL,
+        lon REAL,
+        radius_km REAL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS saved_search_matches (
+        id INTEGER PRIMARY KEY,
+        search_id INTEGER NOT NULL REFERENCES saved_searches(id) ON DELETE CASCADE,
+        listing_id INTEGER NOT NULL REFERENCES listings(id) ON DELETE CASCADE
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_saved_search_matches_feed ON saved_search_matches(search_id, id)")
+    # lets the ON DELETE CASCADE from listings find a listing's matches without a full scan
+    c.execute("CREATE INDEX IF NOT EXISTS idx_saved_search_matches_listing ON saved_search_matches(listing_id)")
+    # bumped by every change to saved_searches; load_saved_searches rebuilds its cache when it moves
+    # (ids alone can't tell: deleting the newest search and saving another reuses its id)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS saved_searches_meta (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    c.execute("INSERT OR IGNORE INTO saved_searches_meta (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS saved_searches_meta_{event.lower()} AFTER {event} ON saved_searches
+        BEGIN
+            UPDATE saved_searches_meta SET version = version + 1 WHERE id = 1;
+        END
+        """)
+    if 0 < version < 8:
+        # written while foreign_keys was off, so deletes never cascaded; without this a
+        # listing that reuses a deleted id would inherit its amenities and matches
+        for table in ("listing_amenities", "saved_search_matches"):
+            c.execute(f"DELETE FROM {table} WHERE listing_id NOT IN (SELECT id FROM listings)")
+    c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+def derive_listing(listing):
+    """Return (amenities, derived column values) for a raw listing dict."""
+    amenities = normalize_amenities_list(listing.get("amenities") or [])
+    scored = compute_accessibility_flags({"location": listing.get("location"), "amenities": amenities})
+    derived = tuple(int(scored[col]) for col in DERIVED_COLUMNS)
+    return amenities, derived
+
+
+INSERT_LISTING_SQL = (
+    "INSERT INTO listings (id, title, price, location, amenities, " + ", ".join(DERIVED_COLUMNS + GEO_COLUMNS)
+    + ", content_hash) VALUES (" + ", ".join("?" * (len(LISTING_COLUMNS) + 1)) + ")"
+)
+INSERT_LSH_SQL = "INSERT OR IGNORE INTO listing_lsh (bucket, listing_id) VALUES (?, ?)"
+# stays under SQLite's default bound-parameter limit
+IN_CHUNK = 500
+INSERT_AMENITY_SQL = "INSERT OR IGNORE INTO listing_amenities (listing_id, amenity) VALUES (?, ?)"
+INSERT_MATCH_SQL = "INSERT INTO saved_search_matches (search_id, listing_id) VALUES (?, ?)"
+
+# database file -> SavedSearchIndex last loaded from it
+_saved_search_indexes = {}
+
+
+def load_saved_searches(conn):
+    """Return a SavedSearchIndex over every saved search in the database.
+
+    The index is cached per database file and only rebuilt when searches were
+    added, changed or deleted since (saved_searches_meta.version moved), so
+    writers can call this on every insert. Empty before migrate() has run.
+    """
+    try:
+        version = conn.execute("SELECT version FROM saved_searches_meta").fetchone()[0]
+    except sqlite3.OperationalError:
+        return SavedSearchIndex()
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    index = _saved_search_indexes.get(path)
+    if index is None or index.version != version:
+        index = SavedSearchIndex(version)
+        for row in conn.execute("SELECT " + ", ".join(SAVED_SEARCH_COLUMNS) + " FROM saved_searches"):
+            index.add(*row)
+        _saved_search_indexes[path] = index
+    return index
+
+
+def _chunks(values, size=IN_CHUNK):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def duplicate_index(c, keyed):
+    """A DuplicateIndex seeded with the stored listings that share a digest or LSH bucket with `keyed` ListingKeys."""
+    index = DuplicateIndex()
+    digests = list({keys.digest for keys in keyed})
+    for chunk in _chunks(digests):
+        q = f"SELECT content_hash, id FROM listings WHERE content_hash IN ({','.join('?' * len(chunk))})"
+        for digest, listing_id in c.execute(q, chunk):
+            index.add_digest(digest, listing_id)
+    buckets = list({bucket for keys in keyed for bucket in keys.buckets})
+    stored = {}
+    for chunk in _chunks(buckets):
+        q = ("SELECT b.bucket, l.id, l.title, l.price, l.amenities FROM listing_lsh b"
+             f" JOIN listings l ON l.id = b.listing_id WHERE b.bucket IN ({','.join('?' * len(chunk))})")
+        for bucket, listing_id, title, price, amenities_csv in c.execute(q, chunk):
+            if listing_id not in stored:
+                stored[listing_id] = (title_shingles(title), price,
+                                      frozenset(amenities_csv.split(",") if amenities_csv else ()))
+            index.add_bucket(bucket, listing_id, *stored[listing_id])
+    return index
+
+
+# batches at least this large swap the per-row index triggers below for one
+# fill of the batch's rows (see insert_listings)
+BULK_INDEX_MIN = 256
+# trigger name -> (CREATE TRIGGER statement, fill statement taking the batch's first id)
+BULK_INDEX_TRIGGERS = {
+    "listings_rtree_insert": (
+        RTREE_INSERT_TRIGGER,
+        "INSERT INTO listings_rtree SELECT id, lat, lat, lon, lon FROM listings"
+        " WHERE id >= ? AND lat IS NOT NULL AND lon IS NOT NULL",
+    ),
+    "listings_fts_insert": (
+        FTS_INSERT_TRIGGER,
+        "INSERT INTO listings_fts (rowid, title) SELECT id, title FROM listings WHERE id >= ?",
+    ),
+}
+
+
+def _suspend_index_triggers(c):
+    """Drop the BULK_INDEX_TRIGGERS this database has; returns their names."""
+    names = [name for (name,) in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ("
+        + ", ".join("?" * len(BULK_INDEX_TRIGGERS)) + ")", list(BULK_INDEX_TRIGGERS))]
+    for name in names:
+        c.execute(f"DROP TRIGGER {name}")
+    return names
+
+
+def _restore_index_triggers(c, names, first_id):
+    """Index the rows from first_id on in one statement per dropped trigger, then re-create it."""
+    for name in names:
+        create, fill = BULK_INDEX_TRIGGERS[name]
+        c.execute(fill, (first_id,))
+        c.execute(create)
+
+
+def insert_listings(conn, listings, batch_size=1000, on_batch=None, report=None, near_duplicates=True):
+    """Insert listing dicts ({title, price, location, amenities: [...], optional lat/lon}) with derived columns filled in.
+
+    `listings` may be any iterable (e.g. a generator); rows are written with
+    one executemany per batch. Ids are assigned explicitly from MAX(id), so
+    the write lock is taken up front (BEGIN IMMEDIATE) unless the caller
+    already opened a transaction. Does not commit. on_batch(ids, batch) is
+    called with the rows written from each batch; it may commit, in which
+    case the next batch starts a new transaction. Each new row is also
+    matched against the saved searches (see load_saved_searches) and recorded
+    in saved_search_matches in the same transaction.
+
+    Duplicates are merged into the listing already stored (or written
+    earlier in the same call) instead of being inserted: exact ones by
+    content hash, near-duplicates (a similar title in the same city, found
+    by MinHash/LSH, with a close price and overlapping amenities; see
+    dedupe.py). `report`, a dedupe.DedupeReport, counts both. Returns the
+    number of rows inserted.
+
+    With near_duplicates=False only exact duplicates are merged and no
+    MinHash is computed, which roughly halves a bulk load (~16s -> ~8s per
+    100k synthetic rows). The rows then get no LSH buckets either,
+    so later inserts only catch exact copies of them.
+
+    For batches of BULK_INDEX_MIN rows or more, the per-row listings_rtree
+    and listings_fts insert triggers are dropped while the rows are written,
+    and each index is filled from them in one statement (for 100k rows the
+    R*Tree trigger costs ~2.7s and its fills ~1.9s; FTS5 ~4.2s and ~0.5s). The
+    triggers are back before on_batch runs, so a commit there never loses them.
+    """
+    c = conn.cursor()
+    next_id = None
+    total = 0
+    batch = []
+    report = report if report is not None else DedupeReport()
+
+    def flush():
+        nonlocal next_id
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+            next_id = None
+        if next_id is None:
+            next_id = c.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM listings").fetchone()[0]
+        searches = load_saved_searches(conn)
+        derived_rows = [derive_listing(l) for l in batch]
+        keyed = ListingKeys.many([(l["title"], l["price"], l["location"], amenities)
+                                  for l, (amenities, _) in zip(batch, derived_rows)], near=near_duplicates)
+        duplicates = duplicate_index(c, keyed)
+        ids = []
+        written = []
+        rows = []
+        amenity_rows = []
+        lsh_rows = []
+        match_rows = []
+        for l, (amenities, derived), keys in zip(batch, derived_rows, keyed):
+            duplicate = duplicates.check(keys)
+            if duplicate is not None:
+                report.record(duplicate[0], l["title"], duplicate[1])
+                continue
+            listing_id = next_id + len(ids)
+            ids.append(listing_id)
+            written.append(l)
+            duplicates.add(listing_id, keys)
+            rows.append((listing_id, l["title"], l["price"], l["location"], ",".join(amenities)) + derived
+                        + (l.get("lat"), l.get("lon"), keys.digest))
+            amenity_rows.extend((listing_id, a) for a in amenities)
+            lsh_rows.extend((bucket, listing_id) for bucket in keys.buckets)
+            if searches:
+                listing = dict(zip(DERIVED_COLUMNS, derived), price=l["price"], location=l["location"],
+                               amenities=amenities, lat=l.get("lat"), lon=l.get("lon"))
+                match_rows.extend((search_id, listing_id) for search_id in searches.match(listing))
+        if len(rows) >= BULK_INDEX_MIN:
+            suspended = _suspend_index_triggers(c)
+            c.executemany(INSERT_LISTING_SQL, rows)
+            _restore_index_triggers(c, suspended, next_id)
+        else:
+            c.executemany(INSERT_LISTING_SQL, rows)
+        c.executemany(INSERT_AMENITY_SQL, amenity_rows)
+        # in key order, so the b-tree is appended to page by page rather than at random
+        lsh_rows.sort()
+        c.executemany(INSERT_LSH_SQL, lsh_rows)
+        if match_rows:
+            c.executemany(INSERT_MATCH_SQL, match_rows)
+        next_id += len(ids)
+        report.inserted += len(ids)
+        if on_batch and ids:
+            on_batch(ids, written)
+        return len(ids)
+
+    for l in listings:
+        batch.append(l)
+        if len(batch) >= batch_size:
+            total += flush()
+            batch = []
+    if batch:
+        total += flush()
+    return total
+
+
+def dedupe_listings(conn, dry_run=False, batch_size=1000):
+    """Hash rows stored before dedupe keys existed (content_hash IS NULL), oldest first, merging duplicates.
+
+    A row that duplicates an earlier one (exactly or as a near-duplicate, see
+    insert_listings) is deleted along with its amenity and saved
+    search match rows; the others get their content hash and LSH buckets.
+    Each chunk is committed; with dry_run everything is rolled back at the
+    end instead. Returns a DedupeReport (inserted = rows kept).
+    """
+    report = DedupeReport()
+    c = conn.cursor()
+    last_id = 0
+    while True:
+        rows = c.execute(
+            "SELECT id, title, price, location, amenities FROM listings"
+            " WHERE content_hash IS NULL AND id > ? ORDER BY id LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        keyed = ListingKeys.many([(title, price, location, amenities_csv.split(",") if amenities_csv else [])
+                                  for _, title, price, location, amenities_csv in rows])
+        duplicates = duplicate_index(c, keyed)
+        hashed = []
+        merged = []
+        lsh_rows = []
+        for (listing_id, title, *_), keys in zip(rows, keyed):
+            duplicate = duplicates.check(keys)
+            if duplicate is not None:
+                report.record(duplicate[0], title, duplicate[1])
+                merged.append((listing_id,))
+                continue
+            report.inserted += 1
+            duplicates.add(listing_id, keys)
+            hashed.append((keys.digest, listing_id))
+            lsh_rows.extend((bucket, listing_id) for bucket in keys.buckets)
+        c.executemany("DELETE FROM listing_amenities WHERE listing_id = ?", merged)
+        c.executemany("DELETE FROM saved_search_matches WHERE listing_id = ?", merged)
+        c.executemany("DELETE FROM listings WHERE id = ?", merged)
+        c.executemany("UPDATE listings SET content_hash = ? WHERE id = ?", hashed)
+        lsh_rows.sort()
+        c.executemany(INSERT_LSH_SQL, lsh_rows)
+        if not dry_run:
+            conn.commit()
+    if dry_run:
+        conn.rollback()
+    return report
+
+
+def backfill(conn, all_rows=False):
+    """Fill derived columns and listing_amenities for rows written before the migration.
+
+    Only rows with missing scores are touched unless all_rows is set (e.g. after
+    changing the accessibility heuristics). Returns the number of rows updated.
+    """
+    c = conn.cursor()
+    q = "SELECT id, location, amenities FROM listings"
+    if not all_rows:
+        q += " WHERE walkable_score IS NULL"
+    rows = c.execute(q).fetchall()
+    for listing_id, location, amenities_csv in rows:
+        amenities, derived = derive_listing({
+            "location": location,
+            "amenities": amenities_csv.split(",") if amenities_csv else [],
+        })
+        c.execute(
+            "UPDATE listings SET amenities = ?, "
+            + ", ".join(f"{col} = ?" for col in DERIVED_COLUMNS) + " WHERE id = ?",
+            (",".join(amenities),) + derived + (listing_id,)
+        )
+        c.execute("DELETE FROM listing_amenities WHERE listing_id = ?", (listing_id,))
+        c.executemany(INSERT_AMENITY_SQL, [(listing_id, a) for a in amenities])
+    conn.commit()
+    return len(rows)
+
+
+def hydrate_row(row):
+    """Turn a LISTING_COLUMNS row into a listing dict.
+
+    Rows written through insert_listings/backfill already carry normalized
+    amenities and scores; older rows are normalized and scored on the fly.
+    """
+    listing = {
+        "id": row[0],
+        "title": row[1],
+        "price": row[2],
+        "location": row[3],
+        "lat": row[11],
+        "lon": row[12],
+    }
+    if row[8] is None:
+        listing["amenities"] = normalize_amenities_list(row[4].split(",")) if row[4] else []
+        return compute_accessibility_flags(listing)
+    listing["amenities"] = row[4].split(",") if row[4] else []
+    listing["walkable"] = bool(row[5])
+    listing["transit"] = bool(row[6])
+    listing["car_friendly"] = bool(row[7])
+    listing["walkable_score"] = row[8]
+    listing["transit_score"] = row[9]
+    listing["car_score"] = row[10]
+    return listing
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that requires every word (None if there are no words).
+
+    Each word is quoted, so FTS5 operators and punctuation in user input are
+    matched literally instead of being parsed as query syntax.
+    """
+    words = re.findall(r"\w+", text.lower())
+    return " ".join(f'"{w}"' for w in words) if words else None
+
+
+def text_search(conn, text):
+    """Return {listing id: bm25} for listings whose title matches every word of `text`.
+
+    Lower (more negative) bm25 means more relevant. Raises ValueError when the
+    database has no FTS5 index.
+    """
+    query = fts_query(text)
+    if query is None:
+        return {}
+    if not has_fts(conn):
+        raise ValueError("full-text search is not available (SQLite without FTS5)")
+    return dict(conn.execute(
+        "SELECT rowid, bm25(listings_fts) FROM listings_fts WHERE listings_fts MATCH ?", (query,)
+    ))
+
+
+def load_pois(conn):
+    """Return {slug: (lat, lon)} for every reference point in the pois table."""
+    return {slug: (lat, lon) for slug, lat, lon in conn.execute("SELECT slug, lat, lon FROM pois")}
+
+
+def create_saved_search(conn, name=None, budget=None, location=None, wanted=None, walkable=None, transit=None,
+                        car_friendly=None, near=None):
+    """Store a saved search (the query_listings filters, minus text) and return its id. Does not commit.
+
+    Only listings inserted afterwards are matched against it; existing ones
+    are what /api/listings returns for the same filters.
+    """
+    lat, lon, radius_km = near if near is not None else (None, None, None)
+    c = conn.execute(
+        "INSERT INTO saved_searches (name, budget, location, amenities, walkable, transit, car_friendly,"
+        " lat, lon, radius_km) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, budget, location.lower() if location else None, ",".join(wanted) if wanted else None,
+         *(None if v is None else int(v) for v in (walkable, transit, car_friendly)), lat, lon, radius_km)
+    )
+    return c.lastrowid
+
+
+def get_saved_search(conn, search_id):
+    """Return a saved search as a dict in create_saved_search's terms, or None."""
+    row = conn.execute(
+        "SELECT name, " + ", ".join(SAVED_SEARCH_COLUMNS) + " FROM saved_searches WHERE id = ?", (search_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    name, search_id, budget, location, amenities, walkable, transit, car_friendly, lat, lon, radius_km = row
+    return {
+        "id": search_id,
+        "name": name,
+        "budget": budget,
+        "location": location,
+        "wanted": amenities.split(",") if amenities else None,
+        "walkable": None if walkable is None else bool(walkable),
+        "transit": None if transit is None else bool(transit),
+        "car_friendly": None if car_friendly is None else bool(car_friendly),
+        "near": (lat, lon, radius_km) if radius_km is not None else None,
+    }
+
+
+def delete_saved_search(conn, search_id):
+    """Delete a saved search and its matches; returns False if it did not exist. Does not commit."""
+    conn.execute("DELETE FROM saved_search_matches WHERE search_id = ?", (search_id,))
+    return conn.execute("DELETE FROM saved_searches WHERE id = ?", (search_id,)).rowcount > 0
+
+
+def saved_search_matches(conn, search_id, since=0, limit=100):
+    """Return [(cursor, hydrated listing)] matched to a saved search after `since`, oldest first.
+
+    The cursor is the saved_search_matches id; pass the last one back as
+    `since` to read only newer matches. Deleting a listing deletes its
+    matches (foreign keys cascade), so a later listing that reuses the id
+    never shows up in feeds it did not match.
+    """
+    c = conn.execute(
+        "SELECT m.id, " + ", ".join(f"l.{col}" for col in LISTING_COLUMNS)
+        + " FROM saved_search_matches m JOIN listings l ON l.id = m.listing_id"
+        + " WHERE m.search_id = ? AND m.id > ? ORDER BY m.id LIMIT ?",
+        (search_id, since, limit)
+    )
+    return [(r[0], hydrate_row(r[1:])) for r in c.fetchall()]
+
+
+def price_stats(conn, location=None, percentiles=(25, 50, 75)):
+    """PriceIndex.stats() computed in SQL: count, unpriced, min/max and nearest-rank percentile prices.
+
+    For `location` (None = all listings); None when there are no listings there.
+    """
+    where, params = ("WHERE LOWER(location) = ?", [location.lower()]) if location else ("", [])
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(price), COUNT(*) - COUNT(price), MIN(price), MAX(price) FROM listings {where}", params)
+    n, unpriced, low, high = c.fetchone()
+    if not n and not unpriced:
+        return None
+    stats = {"count": n, "unpriced": unpriced, "min": low, "max": high}
+    priced = f"{where} AND price IS NOT NULL" if where else "WHERE price IS NOT NULL"
+    for q in percentiles:
+        stats[f"p{q}"] = None
+        if n:
+            c.execute(f"SELECT price FROM listings {priced} ORDER BY price LIMIT 1 OFFSET ?",
+                      params + [max(0, math.ceil(q * n / 100) - 1)])
+            stats[f"p{q}"] = c.fetchone()[0]
+    return stats
+
+
+def query_listings(conn, budget=None, location=None, wanted=None, walkable=None, transit=None, car_friendly=None,
+                   near=None, text=None):
+    """Return hydrated listings matching every given filter, evaluated by SQLite.
+
+    wanted is a list of normalized amenities that must ALL be present; the
+    access flags are tri-state (None means don't filter). near is an optional
+    (lat, lon, radius_km): the R*Tree prunes to the bounding box and the
+    exact great-circle check runs on what is left. text restricts to titles
+    matching every word, through the listings_fts index.
+    """
+    joins = []
+    where = []
+    params = []
+    box = bounding_box(*near) if near is not None else None
+    rtree = box is not None and has_rtree(conn)
+    if rtree:
+        joins.append("JOIN listings_rtree r ON r.id = l.id AND r.max_lat >= ? AND r.min_lat <= ?"
+                     " AND r.max_lon >= ? AND r.min_lon <= ?")
+        params.extend(box)
+    if text is not None:
+        query = fts_query(text)
+        if query is None:
+            return []
+        if not has_fts(conn):
+            raise ValueError("full-text search is not available (SQLite without FTS5)")
+        joins.append("JOIN listings_fts f ON f.rowid = l.id AND listings_fts MATCH ?")
+        params.append(query)
+    for i, amenity in enumerate(dict.fromkeys(wanted or [])):
+        joins.append(f"JOIN listing_amenities a{i} ON a{i}.listing_id = l.id AND a{i}.amenity = ?")
+        params.append(amenity)
+    if box is not None and not rtree:
+        where.append("l.lat BETWEEN ? AND ? AND l.lon BETWEEN ? AND ?")
+        params.extend(box)
+    if budget is not None:
+        where.append("l.price <= ?")
+        params.append(budget)
+    if location:
+        where.append("LOWER(l.location) = ?")
+        params.append(location.lower())
+    for col, value in (("walkable", walkable), ("transit", transit), ("car_friendly", car_friendly)):
+        if value is not None:
+            where.append(f"l.{col} = ?")
+            params.append(int(value))
+
+    q = "SELECT " + ", ".join(f"l.{col}" for col in LISTING_COLUMNS) + " FROM listings l"
+    if joins:
+        q += " " + " ".join(joins)
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += " ORDER BY l.id"
+
+    c = conn.cursor()
+    c.execute(q, tuple(params))
+    listings = [hydrate_row(r) for r in c.fetchall()]
+    if near is not None:
+        lat, lon, radius_km = near
+        listings = [l for l in listings if l["lat"] is not None and l["lon"] is not None
+                    and haversine_km(lat, lon, l["lat"], l["lon"]) <= radius_km]
+    return listings
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    conn = connect()
+    migrate(conn)
+    if command == "backfill":
+        n = backfill(conn, all_rows="--all" in sys.argv)
+        print(f"Backfilled {n} listings.")
+    elif command == "migrate":
+        print(f"Schema at version {SCHEMA_VERSION}.")
+    elif command == "dedupe":
+        dry_run = "--dry-run" in sys.argv
+        report = dedupe_listings(conn, dry_run=dry_run)
+        print(f"{'Would keep' if dry_run else 'Kept'} {report.inserted:,} listings; {report.summary()}.")
+        for kind, title, duplicate_of in report.examples:
+            print(f"  {kind}: {title!r} -> listing {duplicate_of}")
+    elif command == "snapshot":
+        from listings_index import ListingsIndex
+        path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+        n = ListingsIndex(DATABASE).export_snapshot(path)
+        print(f"Wrote {n} listings to {path}.")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
+    conn.close()
@@ -0,0 +1,242 @@
+"""Duplicate and near-duplicate detection for listings at ingest (content hashes + MinHash/LSH over titles)."""
+from collections import defaultdict
+import hashlib
+from itertools import chain
+import random
+import re
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # optional: signatures fall back to pure Python
+    np = None
+
+# title similarity (Jaccard over character shingles) at or above which two
+# listings in the same city are near-duplicates, provided their prices and
+# amenities are close as well (see near_duplicate)
+NEAR_DUP_THRESHOLD = 0.8
+# prices may differ by at most this fraction of the higher one
+NEAR_DUP_PRICE_RATIO = 0.1
+# minimum Jaccard similarity of the amenity sets (two empty sets match)
+NEAR_DUP_AMENITY_OVERLAP = 0.5
+SHINGLE_SIZE = 3
+# LSH: BANDS bands of ROWS MinHash values; titles at the threshold share a band with
+# probability 1 - (1 - 0.8**3)**5 ~ 0.97 (0.998 at 0.9), unrelated titles (~0.1) with ~0.005
+BANDS = 5
+ROWS = 3
+NUM_PERM = BANDS * ROWS
+# multiply-shift hash family: h_i(x) = ((a_i * x + b_i) mod 2**64) >> 32 over 32-bit shingle hashes
+MASK64 = (1 << 64) - 1
+_rng = random.Random(20240611)
+PERM_A = [_rng.getrandbits(64) | 1 for _ in range(NUM_PERM)]
+PERM_B = [_rng.getrandbits(64) for _ in range(NUM_PERM)]
+# band keys fold a band's values into a 64-bit hash of (city, title numbers, band)
+MIX = 0x9E3779B97F4A7C15
+BAND_SALTS = [(band + 1) * MIX & MASK64 for band in range(BANDS)]
+if np is not None:
+    # (NUM_PERM, 1), so a batch's shingle hashes broadcast along the contiguous axis
+    _A = np.array(PERM_A, dtype=np.uint64)[:, None]
+    _B = np.array(PERM_B, dtype=np.uint64)[:, None]
+    _BAND_SALTS = np.array(BAND_SALTS, dtype=np.uint64)
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_DIGITS_RE = re.compile(r"\d+")
+# shown in DedupeReport.examples
+MAX_EXAMPLES = 10
+
+# shingle -> stable 32-bit hash; the trigram vocabulary stays small
+_shingle_hashes = {}
+
+
+def normalize_title(title):
+    """Lowercase words of the title, punctuation dropped: "Cozy  Studio!" -> "cozy studio"."""
+    return " ".join(_WORD_RE.findall((title or "").lower()))
+
+
+def content_hash(title, price, location, amenities, normalized=None):
+    """16-byte digest of a listing's normalized title/price/location/amenities (exact-duplicate key)."""
+    key = "\x1f".join([
+        normalized if normalized is not None else normalize_title(title),
+        "" if price is None else str(price),
+        (location or "").strip().lower(),
+        ",".join(sorted(set(amenities))),
+    ])
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def title_shingles(title, normalized=None):
+    """Character shingles of the normalized title with digits removed (numbers are compared separately)."""
+    text = " ".join(_DIGITS_RE.sub(" ", normalized if normalized is not None else normalize_title(title)).split())
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def prices_close(a, b):
+    """Both unknown, or within NEAR_DUP_PRICE_RATIO of the higher price."""
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(a - b) <= NEAR_DUP_PRICE_RATIO * max(abs(a), abs(b))
+
+
+def near_duplicate(keys, shingles, price, amenities):
+    """Whether a stored listing (title shingles, price, amenity set) is a near-duplicate of `keys`."""
+    if not prices_close(keys.price, price):
+        return False
+    if (keys.amenities or amenities) and jaccard(keys.amenities, amenities) < NEAR_DUP_AMENITY_OVERLAP:
+        return False
+    return jaccard(keys.shingles, shingles) >= NEAR_DUP_THRESHOLD
+
+
+def _hash_shingles(shingle_sets):
+    """Make sure every shingle in the sets has an entry in _shingle_hashes."""
+    for shingle in set().union(*shingle_sets).difference(_shingle_hashes):
+        _shingle_hashes[shingle] = zlib.crc32(shingle.encode())
+
+
+def _prefix_hash(location, normalized):
+    """64-bit hash of the city and the numbers in the title (part of every bucket key)."""
+    key = f"{(location or '').strip().lower()}\x1f{','.join(_DIGITS_RE.findall(normalized))}"
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+
+
+def minhash(shingles):
+    """NUM_PERM-value MinHash signature of a non-empty shingle set."""
+    _hash_shingles([shingles])
+    hashes = [_shingle_hashes[s] for s in shingles]
+    return [min(((a * h + b) & MASK64) >> 32 for h in hashes) for a, b in zip(PERM_A, PERM_B)]
+
+
+def band_buckets(prefix, signature):
+    """One signed 64-bit bucket key per LSH band of a signature."""
+    buckets = []
+    for band in range(BANDS):
+        h = prefix ^ BAND_SALTS[band]
+        for value in signature[band * ROWS:(band + 1) * ROWS]:
+            h = (h ^ value) * MIX & MASK64
+        buckets.append(h - (1 << 64) if h >= 1 << 63 else h)
+    return buckets
+
+
+def _buckets_numpy(prefixes, shingle_sets):
+    """band_buckets(prefix, minhash(shingles)) for many non-empty sets at once."""
+    _hash_shingles(shingle_sets)
+    counts = [len(shingles) for shingles in shingle_sets]
+    hashes = np.fromiter(map(_shingle_hashes.__getitem__, chain.from_iterable(shingle_sets)),
+                         dtype=np.uint64, count=sum(counts))
+    starts = np.zeros(len(counts), dtype=np.intp)
+    np.cumsum(counts[:-1], out=starts[1:])
+    # uint64 arithmetic wraps, i.e. is already mod 2**64
+    permuted = (hashes * _A + _B) >> np.uint64(32)
+    bands = np.minimum.reduceat(permuted, starts, axis=1).T.reshape(len(counts), BANDS, ROWS)
+    h = np.array(prefixes, dtype=np.uint64)[:, None] ^ _BAND_SALTS
+    mix = np.uint64(MIX)
+    for row in range(ROWS):
+        h = (h ^ bands[:, :, row]) * mix
+    return h.view(np.int64).tolist()
+
+
+class ListingKeys:
+    """The dedupe keys of one listing: content digest, title shingles and LSH buckets, plus its price and amenities.
+
+    Titles with no letters get no buckets (they are only checked for exact
+    duplicates), and neither does any listing keyed with near=False.
+    """
+
+    __slots__ = ("digest", "shingles", "buckets", "price", "amenities", "_prefix")
+
+    def __init__(self, title, price, location, amenities, near=True):
+        normalized = normalize_title(title)
+        self.digest = content_hash(title, price, location, amenities, normalized)
+        self.price = price
+        self.amenities = frozenset(amenities)
+        self.shingles = title_shingles(title, normalized) if near else set()
+        self.buckets = []
+        self._prefix = _prefix_hash(location, normalized) if self.shingles else None
+
+    @classmethod
+    def many(cls, entries, near=True):
+        """ListingKeys for [(title, price, location, amenities)]; with numpy, MinHash runs once per call."""
+        keyed = [cls(*entry, near=near) for entry in entries]
+        hashed = [keys for keys in keyed if keys.shingles]
+        if np is not None and hashed:
+            buckets = _buckets_numpy([keys._prefix for keys in hashed], [keys.shingles for keys in hashed])
+            for keys, keys_buckets in zip(hashed, buckets):
+                keys.buckets = keys_buckets
+        else:
+            for keys in hashed:
+                keys.buckets = band_buckets(keys._prefix, minhash(keys.shingles))
+        return keyed
+
+
+class DuplicateIndex:
+    """Content digests and LSH buckets of stored listings, checked before each insert.
+
+    Seeded with the stored rows that share a digest or a bucket with the
+    batch being written (see db.insert_listings), then grows with each
+    accepted row so duplicates within the batch are caught as well.
+    """
+
+    def __init__(self):
+        self._digests = {}
+        # bucket -> [(listing id, title shingles, price, amenity set)]
+        self._buckets = defaultdict(list)
+
+    def add_digest(self, digest, listing_id):
+        self._digests.setdefault(digest, listing_id)
+
+    def add_bucket(self, bucket, listing_id, shingles, price, amenities):
+        self._buckets[bucket].append((listing_id, shingles, price, amenities))
+
+    def add(self, listing_id, keys):
+        self._digests.setdefault(keys.digest, listing_id)
+        entry = (listing_id, keys.shingles, keys.price, keys.amenities)
+        buckets = self._buckets
+        for bucket in keys.buckets:
+            buckets[bucket].append(entry)
+
+    def check(self, keys):
+        """("exact" | "near", id of the listing it duplicates), or None for a new listing."""
+        listing_id = self._digests.get(keys.digest)
+        if listing_id is not None:
+            return "exact", listing_id
+        seen = set()
+        for bucket in keys.buckets:
+            for listing_id, *stored in self._buckets.get(bucket, ()):
+                if listing_id not in seen:
+                    seen.add(listing_id)
+                    if near_duplicate(keys, *stored):
+                        return "near", listing_id
+        return None
+
+
+class DedupeReport:
+    """Counts of listings written and merged into existing ones, plus a few examples."""
+
+    def __init__(self):
+        self.inserted = 0
+        self.exact = 0
+        self.near = 0
+        # (kind, title, id of the listing kept)
+        self.examples = []
+
+    @property
+    def merged(self):
+        return self.exact + self.near
+
+    def record(self, kind, title, duplicate_of):
+        if kind == "exact":
+            self.exact += 1
+        else:
+            self.near += 1
+        if len(self.examples) < MAX_EXAMPLES:
+            self.examples.append((kind, title, duplicate_of))
+
+    def summary(self):
+        return f"{self.merged:,} duplicates merged ({self.exact:,} exact, {self.near:,} near-duplicates)"
@@ -1,6 +1,7 @@
 import { useEffect, useState, useMemo } from 'react'
 
 const AMENITY_OPTIONS = ['wifi', 'parking', 'pool', 'gym', 'pet-friendly']
+const PAGE_SIZE = 24
 
 function Header() {
   return (
@@ -161,31 +162,71 @@ export default function Home() {
   const [walkable, setWalkable] = useState(false)
   const [transit, setTransit] = useState(false)
   const [carFriendly, setCarFriendly] = useState(false)
+  const [total, setTotal] = useState(0)
+  const [nextCursor, setNextCursor] = useState(null)
+  const [lastParams, setLastParams] = useState({})
+  const [loadingMore, setLoadingMore] = useState(false)
+  const [facets, setFacets] = useState(null)
 
   useEffect(() => {
     fetchListings()
   }, [])
 
-  async function fetchListings(params = {}) {
-    setLoading(true)
+  const base = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:5001'
+
+  function buildQuery(params) {
+    const qs = new URLSearchParams()
+    if (params.budget) qs.set('budget', params.budget)
+    if (params.location) qs.set('location', params.location)
+    if (params.amenities) qs.set('amenities', params.amenities.join(','))
+    if (params.walkable) qs.set('walkable', params.walkable)
+    if (params.transit) qs.set('transit', params.transit)
+    if (params.car_friendly) qs.set('car_friendly', params.car_friendly)
+    return qs
+  }
+
+  // per-amenity / per-flag counts for the current filters, shown next to each option
+  async function fetchFacets(params = {}) {
     try {
-      const base = process.env.NEXT_PUBLIC_BACKEND_URL || 'http://localhost:5001'
-      const qs = new URLSearchParams()
-      if (params.budget) qs.set('budget', params.budget)
-      if (params.location) qs.set('location', params.location)
-      if (params.amenities) qs.set('amenities', params.amenities.join(','))
-      if (params.walkable) qs.set('walkable', params.walkable)
-      if (params.transit) qs.set('transit', params.transit)
-      if (params.car_friendly) qs.set('car_friendly', params.car_friendly)
+      const qs = buildQuery(params)
+      const res = await fetch(base + '/api/facets' + (qs.toString() ? `?${qs.toString()}` : ''))
+      setFacets(await res.json())
+    } catch (err) {
+      console.error('fetchFacets error', err)
+    }
+  }
+
+  function facetCount(value) {
+    if (!facets) return null
+    if (facets.access && value in facets.access) return facets.access[value]
+    const hit = (facets.amenities || []).find(f => f.value === value)
+    return hit ? hit.count : 0
+  }
+
+  // params: search filters; cursor: next_cursor from the previous page (appends instead of replacing)
+  async function fetchListings(params = {}, cursor = null) {
+    if (cursor) setLoadingMore(true)
+    else {
+      setLoading(true)
+      fetchFacets(params)
+    }
+    try {
+      const qs = buildQuery(params)
+      qs.set('limit', PAGE_SIZE)
+      if (cursor) qs.set('cursor', cursor)
 
       const url = base + '/api/listings' + (qs.toString() ? `?${qs.toString()}` : '')
       const res = await fetch(url)
       const data = await res.json()
-      setListings(data)
+      setListings(prev => cursor ? [...prev, ...data.items] : data.items)
+      setTotal(data.total)
+      setNextCursor(data.next_cursor)
+      setLastParams(params)
     } catch (err) {
       console.error('fetchListings error', err)
     } finally {
       setLoading(false)
+      setLoadingMore(false)
     }
   }
 
@@ -246,6 +287,7 @@ export default function Home() {
                 <label key={a} className={`inline-flex items-center px-2 py-1 border rounded ${amenities.includes(a) ? 'bg-blue-50 border-blue-200' : 'bg-gray-50'}`}>
                   <input type="checkbox" checked={amenities.includes(a)} onChange={() => toggleAmenity(a)} className="mr-2" />
                   <span className="text-sm">{a}</span>
+                  {facetCount(a) !== null && <span className="ml-1 text-xs text-gray-500">({facetCount(a)})</span>}
                 </label>
               ))}
             </div>
@@ -257,14 +299,17 @@ export default function Home() {
               <label className={`inline-flex items-center px-2 py-1 border rounded ${walkable ? 'bg-green-50 border-green-200' : 'bg-gray-50'}`}>
                 <input type="checkbox" checked={walkable} onChange={() => setWalkable(v => !v)} className="mr-2" />
                 <span className="text-sm">Walkable</span>
+                {facetCount('walkable') !== null && <span className="ml-1 text-xs text-gray-500">({facetCount('walkable')})</span>}
               </label>
               <label className={`inline-flex items-center px-2 py-1 border rounded ${transit ? 'bg-blue-50 border-blue-200' : 'bg-gray-50'}`}>
                 <input type="checkbox" checked={transit} onChange={() => setTransit(v => !v)} className="mr-2" />
                 <span className="text-sm">Transit</span>
+                {facetCount('transit') !== null && <span className="ml-1 text-xs text-gray-500">({facetCount('transit')})</span>}
               </label>
               <label className={`inline-flex items-center px-2 py-1 border rounded ${carFriendly ? 'bg-gray-50 border-gray-200' : 'bg-gray-50'}`}>
                 <input type="checkbox" checked={carFriendly} onChange={() => setCarFriendly(v => !v)} className="mr-2" />
                 <span className="text-sm">Car-friendly</span>
+                {facetCount('car_friendly') !== null && <span className="ml-1 text-xs text-gray-500">({facetCount('car_friendly')})</span>}
               </label>
             </div>
           </div>
@@ -303,13 +348,24 @@ export default function Home() {
               )}
               {sortedListings.map((l, i) => (
                 <ListingCard
-                  key={i}
+                  key={l.id ?? i}
                   l={l}
                   accessFilters={[walkable ? 'walkable' : null, transit ? 'transit' : null, carFriendly ? 'car_friendly' : null].filter(Boolean)}
                   hasAmenityFilters={amenities.length > 0}
                 />
               ))}
             </div>
+
+            {listings.length > 0 && (
+              <div className="mt-6 mb-10 flex flex-col items-center gap-2">
+                <div className="text-sm text-gray-500">Showing {listings.length} of {total}</div>
+                {nextCursor && (
+                  <button type="button" onClick={() => fetchListings(lastParams, nextCursor)} disabled={loadingMore} className="px-4 py-2 border rounded">
+                    {loadingMore ? 'Loading…' : 'Load more'}
+                  </button>
+                )}
+              </div>
+            )}
           </div>
         )}
       </main>
@@ -1,20 +1,19 @@
-import sqlite3
 import json
-from dotenv import load_dotenv
 import os
-import google.genai as genai
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import importlib
+import itertools
+import random
+import re
+import sys
+import threading
+import time
 
-# --- Load API key ---
-load_dotenv()
-API_KEY = os.getenv("API_KEY")
-
-if not API_KEY:
-    print("Warning: API_KEY not found in .env — will use synthetic generation fallback")
-    API_KEY = None
+import db
+from dedupe import DedupeReport
 
-# --- Configure Gemini (only if API key available) ---
-client = genai.Client(api_key=API_KEY) if API_KEY else None
+MODEL = "gemini-3-flash-preview"
 
 PROMPT = """
 Generate realistic student sublet listings across the following major Canadian cities.
@@ -27,14 +26,24 @@ Rules:
 - realistic student-style titles (mention neighbourhoods or proximity to universities when appropriate)
 - amenities chosen from: wifi, parking, pool, gym, pet-friendly
 - when appropriate, include accessibility hints in the amenities such as 'walkable', 'near-transit', 'parking' so the backend accessibility heuristics can pick them up
+- include approximate "lat" and "lon" (decimal degrees) for the listing's neighbourhood
 
-Return ONLY valid JSON: an array of objects like {"title":..., "price":..., "location":..., "amenities": [...]}
+Return ONLY valid JSON: an array of objects like {"title":..., "price":..., "location":..., "amenities": [...], "lat":..., "lon":...}
 """
 
-# --- CLI / dry-run support ---
-parser = argparse.ArgumentParser(description="Generate sample listings (optionally dry-run)")
-parser.add_argument("--dry-run", action="store_true", help="Don't call the API or write to the DB; print sanitized listings")
-args = parser.parse_args()
+# Smaller prompt used by the concurrent mode: one request per city
+CITY_PROMPT = """
+Generate {n} realistic student sublet listings in {city}, Canada.
+
+Rules:
+- price between 500 and 1200 (CAD)
+- realistic student-style titles (mention neighbourhoods or proximity to universities when appropriate)
+- amenities chosen from: wifi, parking, pool, gym, pet-friendly
+- when appropriate, include accessibility hints in the amenities such as 'walkable', 'near-transit', 'parking'
+- include approximate "lat" and "lon" (decimal degrees) for the listing's neighbourhood
+
+Return ONLY valid JSON: an array of objects like {{"title":..., "price":..., "location": "{city}", "amenities": [...], "lat":..., "lon":...}}
+"""
 
 SAMPLE_JSON = json.dumps([
     {"title": "Cozy room near campus", "price": 750, "location": "Toronto", "amenities": ["Wi-Fi", "parking", "pets"]},
@@ -42,39 +51,11 @@ SAMPLE_JSON = json.dumps([
     {"title": "Furnished studio by campus", "price": 1200, "location": "Calgary", "amenities": ["Gym", "pet friendly"]}
 ], indent=2)
 
-print("Generating listings... (AI if available; otherwise synthetic)")
-
-if args.dry_run:
-    print("Dry-run mode: skipping AI call and using sample JSON.")
-    ai_text = SAMPLE_JSON
-else:
-    if client:
-        try:
-            response = client.models.generate_content(model="gemini-3-flash-preview", contents=PROMPT)
-            ai_text = response.text.strip()
-            print("AI Response received")
-        except Exception as e:
-            print("AI call failed — falling back to synthetic sample:", e)
-            ai_text = SAMPLE_JSON
-    else:
-        ai_text = SAMPLE_JSON
-
-# --- Convert AI output to Python list ---
-try:
-    listings = json.loads(ai_text)
-except json.JSONDecodeError:
-    print("Gemini returned bad JSON:")
-    print(ai_text)
-    exit()
-
-# Ensure we work with the expected number of listings from the model
+# Number of listings written per run unless --count says otherwise
 DESIRED_COUNT = 200
-if isinstance(listings, list):
-    if len(listings) > DESIRED_COUNT:
-        print(f"Gemini returned {len(listings)} listings; trimming to {DESIRED_COUNT}.")
-        listings = listings[:DESIRED_COUNT]
-    elif len(listings) < DESIRED_COUNT:
-        print(f"Warning: Gemini returned only {len(listings)} listings; expected {DESIRED_COUNT}.")
+
+# Rows per executemany when writing to the DB
+BATCH_SIZE = 5000
 
 # --- sanitize amenities to allowed set ---
 ALLOWED_AMENITIES = {"wifi", "parking", "pool", "gym", "pet-friendly"}
@@ -88,11 +69,6 @@ AMENITY_ALIASES = {
     "pet-friendly": "pet-friendly",
 }
 
-# ensure we actually have a list
-if not isinstance(listings, list):
-    print("Expected a JSON array of listings, got:")
-    print(type(listings), listings)
-    exit(1)
 # Allow extra hint tokens to survive sanitization (walkable, near-transit)
 EXTRA_HINTS = {"walkable", "near-transit"}
 
@@ -103,10 +79,21 @@ CITIES = [
     "London", "Markham", "Vaughan", "Gatineau", "Longueuil", "Burnaby"
 ]
 
+# approximate city centres; synthesized listings are scattered a few km around them
+CITY_COORDS = {
+    "Toronto": (43.6532, -79.3832), "Montreal": (45.5019, -73.5674), "Vancouver": (49.2827, -123.1207),
+    "Calgary": (51.0447, -114.0719), "Edmonton": (53.5461, -113.4938), "Ottawa": (45.4215, -75.6972),
+    "Winnipeg": (49.8951, -97.1384), "Quebec City": (46.8139, -71.2080), "Hamilton": (43.2557, -79.8711),
+    "Mississauga": (43.5890, -79.6441), "Brampton": (43.7315, -79.7624), "Surrey": (49.1913, -122.8490),
+    "Laval": (45.6066, -73.7124), "Halifax": (44.6488, -63.5752), "London": (42.9849, -81.2453),
+    "Markham": (43.8561, -79.3370), "Vaughan": (43.8361, -79.4983), "Gatineau": (45.4765, -75.7013),
+    "Longueuil": (45.5312, -73.5181), "Burnaby": (49.2488, -122.9805),
+    "Waterloo": (43.4643, -80.5204), "Kitchener": (43.4516, -80.4925),
+}
+
 # Accessibility combinations to cover (walkable, transit, car_friendly)
 ACCESS_COMBOS = [(w, t, c) for w in (False, True) for t in (False, True) for c in (False, True)]
 
-import random
 
 def synthesize_listing(city, combo, idx):
     w, t, cflag = combo
@@ -127,85 +114,409 @@ def synthesize_listing(city, combo, idx):
     extra = random.choice(possible_extras)
     if extra not in amenities:
         amenities.append(extra)
-    return {"title": title, "price": price, "location": city, "amenities": amenities}
+    listing = {"title": title, "price": price, "location": city, "amenities": amenities}
+    if city in CITY_COORDS:
+        lat, lon = CITY_COORDS[city]
+        # roughly within 8 km of the centre
+        listing["lat"] = round(lat + random.uniform(-0.07, 0.07), 6)
+        listing["lon"] = round(lon + random.uniform(-0.09, 0.09), 6)
+    return listing
+
 
-# First sanitize whatever we got from AI so far, but allow extra hints
-for l in listings:
+def sanitize_listing(l):
+    """Keep only allowed amenity tokens and hints (aliases mapped); returns the listing."""
     raw = l.get("amenities") or []
     sanitized = []
     for a in raw:
+        if not isinstance(a, str):
+            continue
         a_norm = a.strip().lower()
         a_mapped = AMENITY_ALIASES.get(a_norm, a_norm)
         a_mapped = a_mapped.replace(' ', '-')
         if a_mapped in ALLOWED_AMENITIES or a_mapped in EXTRA_HINTS:
             sanitized.append(a_mapped)
     l["amenities"] = sanitized
+    # coordinates are optional; drop anything that isn't a plausible lat/lon pair
+    try:
+        lat, lon = float(l["lat"]), float(l["lon"])
+        valid = -90 <= lat <= 90 and -180 <= lon <= 180
+    except (KeyError, TypeError, ValueError):
+        valid = False
+    if valid:
+        l["lat"], l["lon"] = lat, lon
+    else:
+        l.pop("lat", None)
+        l.pop("lon", None)
+    return l
 
 
-# Build a guaranteed-coverage list: one synth per city × access-combo
-final_listings = []
-idx = 0
-for city in CITIES:
-    for combo in ACCESS_COMBOS:
-        idx += 1
-        final_listings.append(synthesize_listing(city, combo, idx))
-
-# Append AI-provided listings if they don't duplicate the same city/combo
 def combo_key_from_listing(l):
     a = set(l.get('amenities', []))
     return (l.get('location'), 'walkable' in a, 'near-transit' in a, 'parking' in a)
 
-existing_keys = {combo_key_from_listing(l) for l in final_listings}
-for l in listings:
-    key = combo_key_from_listing(l)
-    if key not in existing_keys:
-        idx += 1
-        final_listings.append(l)
-        existing_keys.add(key)
-
-# Pad with random synthesized listings until DESIRED_COUNT
-while len(final_listings) < DESIRED_COUNT:
-    idx += 1
-    city = random.choice(CITIES)
-    combo = random.choice(ACCESS_COMBOS)
-    final_listings.append(synthesize_listing(city, combo, idx))
-
-# Trim to desired count
-if len(final_listings) > DESIRED_COUNT:
-    final_listings = final_listings[:DESIRED_COUNT]
-
-# Replace listings with the final set
-listings = final_listings
-
-# Final sanitize pass (ensure only allowed tokens and hints remain)
-for l in listings:
-    raw = l.get("amenities") or []
-    sanitized = []
-    for a in raw:
-        a_norm = a.strip().lower()
-        a_mapped = AMENITY_ALIASES.get(a_norm, a_norm)
-        a_mapped = a_mapped.replace(' ', '-')
-        if a_mapped in ALLOWED_AMENITIES or a_mapped in EXTRA_HINTS:
-            sanitized.append(a_mapped)
-    l["amenities"] = sanitized
 
-# After sanitizing all listings, either print (dry-run) or write to DB
-if args.dry_run:
-    print("Sanitized listings (dry-run):")
-    print(json.dumps(listings, indent=2))
-else:
-    # --- Insert into SQLite DB ---
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-
-    for l in listings:
-        amenities_str = ",".join(l["amenities"])
-        c.execute(
-            "INSERT INTO listings (title, price, location, amenities) VALUES (?, ?, ?, ?)",
-            (l["title"], l["price"], l["location"], amenities_str)
-        )
-
-    conn.commit()
-    conn.close()
-
-    print(f"Inserted {len(listings)} generated listings!")
+class StubClient:
+    """Offline stand-in for genai.Client: answers per-city prompts with synthesized listings.
+
+    Exposes the same `client.models.generate_content(model=..., contents=...)`
+    call and `.text` response. `latency` (seconds) and `failure_rate` make it
+    useful for exercising the concurrent mode in tests and benchmarks.
+    """
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, latency=0.0, failure_rate=0.0, bad_json_rate=0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.bad_json_rate = bad_json_rate
+        self.models = self
+
+    def generate_content(self, model=None, contents=""):
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise RuntimeError("stub client: simulated API failure")
+        if random.random() < self.bad_json_rate:
+            return self._Response("Sure! Here are some listings: [{")
+        city_match = re.search(r"listings in (.+?), Canada", contents)
+        count_match = re.search(r"Generate (\d+)", contents)
+        cities = [city_match.group(1)] if city_match else CITIES
+        n = int(count_match.group(1)) if count_match else DESIRED_COUNT
+        listings = []
+        for i in range(n):
+            l = synthesize_listing(random.choice(cities), random.choice(ACCESS_COMBOS), i + 1)
+            l["title"] = f"Stub sublet #{random.randint(1, 10**9)} in {l['location']}"
+            listings.append(l)
+        return self._Response(json.dumps(listings))
+
+
+def make_client(name=None):
+    """Build the generation client.
+
+    name: "gemini" (needs API_KEY in the environment / .env), "stub", or
+    "module:factory" for any object with a compatible models.generate_content.
+    Defaults to Gemini when an API key is available, otherwise None (synthetic
+    fallback).
+    """
+    if name == "stub":
+        return StubClient()
+    if name and ":" in name:
+        module, factory = name.split(":", 1)
+        return getattr(importlib.import_module(module), factory)()
+
+    # --- Load API key ---
+    from dotenv import load_dotenv
+    load_dotenv()
+    api_key = os.getenv("API_KEY")
+    if not api_key:
+        print("Warning: API_KEY not found in .env — will use synthetic generation fallback")
+        return None
+    # --- Configure Gemini (only if API key available) ---
+    import google.genai as genai
+    return genai.Client(api_key=api_key)
+
+
+def parse_listings_json(text):
+    """Parse a model response into a list of listing dicts; raises ValueError on anything else."""
+    text = (text or "").strip()
+    # models like to wrap JSON in ```json fences
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    listings = json.loads(text)
+    if not isinstance(listings, list):
+        raise ValueError(f"expected a JSON array of listings, got {type(listings).__name__}")
+    return [l for l in listings if isinstance(l, dict)]
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second with bursts up to `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def generate_city_listings(client, city, n, bucket, retries=3, backoff=1.0):
+    """Request n listings for one city, retrying failures and bad JSON with exponential backoff.
+
+    Returns (sanitized listings, attempts used); listings is empty if every attempt failed.
+    """
+    prompt = CITY_PROMPT.format(n=n, city=city)
+    for attempt in range(1, retries + 2):
+        bucket.acquire()
+        try:
+            response = client.models.generate_content(model=MODEL, contents=prompt)
+            listings = parse_listings_json(response.text)
+        except Exception as e:
+            if attempt > retries:
+                print(f"  {city}: giving up after {attempt} attempts ({e})")
+                return [], attempt
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"  {city}: attempt {attempt} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        for l in listings:
+            l.setdefault("location", city)
+        return [sanitize_listing(l) for l in listings], attempt
+    return [], retries + 1
+
+
+def iter_ai_listings_concurrent(client, cities, per_city, concurrency=4, rate=2.0, burst=None,
+                                retries=3, backoff=1.0, stats=None):
+    """Fan out one prompt per city over a thread pool and yield listings as responses arrive.
+
+    At most `concurrency` requests are in flight and the token bucket caps
+    the request rate (retries included). `stats`, if given, collects
+    prompts/failed/attempts/listings counts.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(prompts=len(cities), failed=0, attempts=0, listings=0)
+    bucket = TokenBucket(rate, burst or concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(generate_city_listings, client, city, per_city, bucket, retries, backoff): city
+                   for city in cities}
+        for future in as_completed(futures):
+            listings, attempts = future.result()
+            stats["attempts"] += attempts
+            if not listings:
+                stats["failed"] += 1
+            stats["listings"] += len(listings)
+            yield from listings
+
+
+def fetch_ai_listings(client, dry_run=False):
+    """Ask the model for listings in one prompt (sample JSON on dry-run / no client / failure); returns sanitized dicts."""
+    if dry_run:
+        print("Dry-run mode: skipping AI call and using sample JSON.")
+        ai_text = SAMPLE_JSON
+    elif client:
+        try:
+            response = client.models.generate_content(model=MODEL, contents=PROMPT)
+            ai_text = response.text.strip()
+            print("AI Response received")
+        except Exception as e:
+            print("AI call failed — falling back to synthetic sample:", e)
+            ai_text = SAMPLE_JSON
+    else:
+        ai_text = SAMPLE_JSON
+
+    # --- Convert AI output to Python list ---
+    try:
+        listings = json.loads(ai_text)
+    except json.JSONDecodeError:
+        print("Gemini returned bad JSON:")
+        print(ai_text)
+        sys.exit(1)
+
+    # ensure we actually have a list
+    if not isinstance(listings, list):
+        print("Expected a JSON array of listings, got:")
+        print(type(listings), listings)
+        sys.exit(1)
+
+    if len(listings) < DESIRED_COUNT:
+        print(f"Warning: Gemini returned only {len(listings)} listings; expected {DESIRED_COUNT}.")
+    return [sanitize_listing(l) for l in listings if isinstance(l, dict)]
+
+
+def generate_listing_stream(ai_listings=(), count=DESIRED_COUNT, dedupe_ai=True, stats=None):
+    """Yield `count` listings: one synth per city × access-combo, then AI listings, then random synths.
+
+    With dedupe_ai, AI listings are skipped when they duplicate a city/combo
+    already emitted. Nothing is materialized, so count can be in the millions.
+    `stats`, if given, counts how many rows came from each source.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(coverage=0, ai=0, padding=0)
+
+    def stream():
+        idx = 0
+        existing_keys = set()
+        # Build a guaranteed-coverage list: one synth per city × access-combo
+        for city in CITIES:
+            for combo in ACCESS_COMBOS:
+                idx += 1
+                l = synthesize_listing(city, combo, idx)
+                existing_keys.add(combo_key_from_listing(l))
+                stats["coverage"] += 1
+                yield l
+        # Append AI-provided listings if they don't duplicate the same city/combo
+        for l in ai_listings:
+            key = combo_key_from_listing(l)
+            if not dedupe_ai or key not in existing_keys:
+                idx += 1
+                existing_keys.add(key)
+                stats["ai"] += 1
+                yield l
+        # Pad with random synthesized listings
+        while True:
+            idx += 1
+            stats["padding"] += 1
+            yield synthesize_listing(random.choice(CITIES), random.choice(ACCESS_COMBOS), idx)
+
+    return itertools.islice(stream(), count)
+
+
+def iter_listings_file(path, chunk_size=1 << 16):
+    """Incrementally parse listings from a JSON array or NDJSON file without loading it whole."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buf = f.read(chunk_size)
+        if not buf.lstrip().startswith("["):
+            # NDJSON: one object per line
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        # JSON array: decode one element at a time from a sliding buffer
+        pos = buf.index("[") + 1
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # element spans the chunk boundary (or the file is truncated)
+                more = f.read(chunk_size)
+                if not more:
+                    raise
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield obj
+            pos = end
+
+
+class Progress:
+    """Prints rows written and throughput every `every` rows."""
+
+    def __init__(self, every=50000):
+        self.every = every
+        self.count = 0
+        self.started = time.perf_counter()
+        self._next = every
+
+    def __call__(self, ids, batch):
+        self.count += len(batch)
+        if self.count >= self._next:
+            self._next += self.every
+            elapsed = time.perf_counter() - self.started
+            print(f"  {self.count:,} listings written ({self.count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return f"{self.count:,} listings in {elapsed:.2f}s ({self.count / max(elapsed, 1e-9):,.0f} rows/s)"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate sample listings (optionally dry-run)")
+    parser.add_argument("--dry-run", action="store_true", help="Don't call the API or write to the DB; print sanitized listings")
+    parser.add_argument("--count", type=int, help=f"Number of listings to write (default {DESIRED_COUNT}; with --concurrent, enough for every AI listing)")
+    parser.add_argument("--synthetic", action="store_true", help="Skip the AI call and only synthesize listings (fast reseeding)")
+    parser.add_argument("--from-file", metavar="PATH", help="Ingest listings from a JSON array or NDJSON file instead of generating them")
+    parser.add_argument("--batch-size", type=int,
+                        help=f"Rows per executemany batch (default {BATCH_SIZE}; with --concurrent, --per-city)")
+    parser.add_argument("--exact-dedupe-only", action="store_true",
+                        help="Only merge exact duplicates, skipping the near-duplicate check (faster bulk loads)")
+    parser.add_argument("--client", help="Generation client: gemini (default when API_KEY is set), stub, or module:factory")
+    parser.add_argument("--concurrent", action="store_true", help="Fan out one smaller prompt per city in parallel and stream results into the DB")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max AI requests in flight (--concurrent)")
+    parser.add_argument("--per-city", type=int, default=10, help="Listings requested per city prompt (--concurrent)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Max AI requests per second, retries included (--concurrent)")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per city prompt on failure or bad JSON (--concurrent)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    sources = {}
+    ai_stats = {}
+    if args.from_file:
+        print(f"Ingesting listings from {args.from_file}...")
+        listings = (sanitize_listing(l) for l in iter_listings_file(args.from_file) if isinstance(l, dict))
+    else:
+        print("Generating listings... (AI if available; otherwise synthetic)")
+        client = None if args.synthetic or (args.dry_run and not args.client) else make_client(args.client)
+        if args.concurrent and client:
+            # AI listings are the point here, so keep them even when their coarse
+            # city/combo key is already covered by a synth
+            if args.count is None:
+                args.count = len(CITIES) * len(ACCESS_COMBOS) + len(CITIES) * args.per_city
+            ai_listings = iter_ai_listings_concurrent(client, CITIES, args.per_city, concurrency=args.concurrency,
+                                                      rate=args.rate, retries=args.retries, stats=ai_stats)
+            listings = generate_listing_stream(ai_listings, args.count, dedupe_ai=False, stats=sources)
+        else:
+            ai_listings = [] if args.synthetic else fetch_ai_listings(client, dry_run=args.dry_run)
+            if args.count is None:
+                args.count = DESIRED_COUNT
+            listings = generate_listing_stream(ai_listings, args.count, stats=sources)
+
+    # After sanitizing all listings, either print (dry-run) or write to DB
+    if args.dry_run:
+        print("Sanitized listings (dry-run):")
+        print(json.dumps(list(listings), indent=2))
+        return
+
+    # --- Insert into SQLite DB: batched executemany inside one transaction ---
+    conn = db.connect()
+    db.migrate(conn)
+    progress = Progress()
+    report = DedupeReport()
+    on_batch = progress
+    if args.batch_size is None:
+        # with --concurrent a batch is about one city's response, committed as soon as it is written
+        args.batch_size = args.per_city if args.concurrent else BATCH_SIZE
+    if args.concurrent:
+        # commit each batch so AI results become visible while generation continues
+        def on_batch(ids, batch):
+            progress(ids, batch)
+            conn.commit()
+    try:
+        db.insert_listings(conn, listings, batch_size=args.batch_size, on_batch=on_batch, report=report,
+                           near_duplicates=not args.exact_dedupe_only)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    print(f"Inserted {progress.summary()}!")
+    print(f"Dedupe: {report.summary()}")
+    for kind, title, duplicate_of in report.examples:
+        print(f"  {kind}: {title!r} -> listing {duplicate_of}")
+    if ai_stats:
+        print(f"AI: {ai_stats['listings']} listings from {ai_stats['prompts'] - ai_stats['failed']}/{ai_stats['prompts']} "
+              f"city prompts ({ai_stats['attempts']} requests)")
+    if sources:
+        print(f"Sources: {sources['coverage']} coverage synths, {sources['ai']} AI, {sources['padding']} synthetic padding")
+
+
+if __name__ == "__main__":
+    main()
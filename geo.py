@@ -0,0 +1,168 @@
+"""Geo helpers: great-circle distances, bounding boxes, campus reference points and a grid index."""
+from array import array
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+# radius used when `near` is given without radius_km
+DEFAULT_RADIUS_KM = 5.0
+MAX_RADIUS_KM = 200.0
+
+# seeded into the pois table by db.migrate; `near=<slug>` resolves to these
+CAMPUSES = [
+    ("uwaterloo", "University of Waterloo", "Waterloo", 43.4723, -80.5449),
+    ("laurier", "Wilfrid Laurier University", "Waterloo", 43.4738, -80.5275),
+    ("conestoga", "Conestoga College Kitchener", "Kitchener", 43.3890, -80.4040),
+    ("uoft", "University of Toronto St. George", "Toronto", 43.6629, -79.3957),
+    ("tmu", "Toronto Metropolitan University", "Toronto", 43.6577, -79.3788),
+    ("yorku", "York University", "Toronto", 43.7735, -79.5019),
+    ("mcgill", "McGill University", "Montreal", 45.5048, -73.5772),
+    ("concordia", "Concordia University", "Montreal", 45.4972, -73.5790),
+    ("ubc", "University of British Columbia", "Vancouver", 49.2606, -123.2460),
+    ("sfu", "Simon Fraser University", "Burnaby", 49.2781, -122.9199),
+    ("ucalgary", "University of Calgary", "Calgary", 51.0777, -114.1300),
+    ("ualberta", "University of Alberta", "Edmonton", 53.5232, -113.5263),
+    ("uottawa", "University of Ottawa", "Ottawa", 45.4231, -75.6831),
+    ("carleton", "Carleton University", "Ottawa", 45.3876, -75.6960),
+    ("umanitoba", "University of Manitoba", "Winnipeg", 49.8075, -97.1366),
+    ("laval", "Universite Laval", "Quebec City", 46.7817, -71.2747),
+    ("mcmaster", "McMaster University", "Hamilton", 43.2609, -79.9192),
+    ("dalhousie", "Dalhousie University", "Halifax", 44.6366, -63.5917),
+    ("western", "Western University", "London", 43.0096, -81.2737),
+]
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km."""
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing every point within radius_km of (lat, lon)."""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, lat - dlat)
+    max_lat = min(90.0, lat + dlat)
+    # widest longitude span is at the edge closest to a pole
+    edge = max(abs(min_lat), abs(max_lat))
+    if edge >= 89.9:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(edge))))
+    return min_lat, max_lat, max(-180.0, lon - dlon), min(180.0, lon + dlon)
+
+
+def parse_near(near, radius_km=None, pois=None):
+    """Parse `near` ("lat,lon" or a POI slug from `pois`) and radius_km into (lat, lon, radius_km).
+
+    Raises ValueError for unparseable or out-of-range input.
+    """
+    pois = pois or {}
+    key = near.strip().lower()
+    if key in pois:
+        lat, lon = pois[key]
+    else:
+        try:
+            lat, lon = (float(part) for part in near.split(","))
+        except ValueError:
+            raise ValueError("near must be 'lat,lon' or a known campus")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("near is out of range")
+    if radius_km in (None, ""):
+        radius = DEFAULT_RADIUS_KM
+    else:
+        try:
+            radius = float(radius_km)
+        except ValueError:
+            raise ValueError("radius_km must be a number")
+    if not 0 < radius <= MAX_RADIUS_KM:
+        raise ValueError(f"radius_km must be between 0 and {MAX_RADIUS_KM:g}")
+    return lat, lon, radius
+
+
+def proximity_score(distance_km, radius_km):
+    """1.0 at the search point, falling linearly to 0.0 at the radius."""
+    return max(0.0, min(1.0, 1.0 - distance_km / radius_km))
+
+
+class GridIndex:
+    """Positions bucketed into fixed-size lat/lon cells.
+
+    A radius query only visits the cells overlapping its bounding box, so
+    its cost depends on how many listings are nearby, not on the table size.
+    Like ListingStore it is never mutated once built: extended() copies.
+    """
+
+    def __init__(self, cell_deg=0.05):
+        self.cell_deg = cell_deg
+        self._cells = {}
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _add_all(self, lats, lons, start):
+        touched = {}
+        for pos in range(start, len(lats)):
+            lat = lats[pos]
+            if lat != lat:  # NaN: no coordinates
+                continue
+            touched.setdefault(self._cell(lat, lons[pos]), array("I")).append(pos)
+        for cell, positions in touched.items():
+            # cells loaded from a snapshot are memoryviews; array() copies them
+            self._cells[cell] = array("I", self._cells.get(cell, ())) + positions
+
+    @classmethod
+    def build(cls, lats, lons, cell_deg=0.05):
+        grid = cls(cell_deg)
+        grid._add_all(lats, lons, 0)
+        return grid
+
+    def extended(self, lats, lons, start):
+        """Return a copy that also indexes positions start..len(lats)."""
+        grid = GridIndex(self.cell_deg)
+        grid._cells = dict(self._cells)
+        grid._add_all(lats, lons, start)
+        return grid
+
+    def snapshot_sections(self):
+        """(header fields, {section: (typecode, buffer)}) for snapshot.write; see from_snapshot."""
+        cell_lats, cell_lons = array("i"), array("i")
+        offsets = array("Q", [0])
+        positions = array("I")
+        for (i, j), cell in self._cells.items():
+            cell_lats.append(i)
+            cell_lons.append(j)
+            positions.extend(cell)
+            offsets.append(len(positions))
+        return {"cell_deg": self.cell_deg}, {
+            "grid_lats": ("i", cell_lats),
+            "grid_lons": ("i", cell_lons),
+            "grid_offsets": ("Q", offsets),
+            "grid_positions": ("I", positions),
+        }
+
+    @classmethod
+    def from_snapshot(cls, header, sections):
+        """A grid whose cells are slices of the snapshot's position section."""
+        grid = cls(header["cell_deg"])
+        offsets, positions = sections["grid_offsets"], sections["grid_positions"]
+        for k, cell in enumerate(zip(sections["grid_lats"], sections["grid_lons"])):
+            grid._cells[cell] = positions[offsets[k]:offsets[k + 1]]
+        return grid
+
+    def candidates(self, lat, lon, radius_km):
+        """Positions in the cells overlapping the query's bounding box (a superset of the matches)."""
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        lat0, lon0 = self._cell(min_lat, min_lon)
+        lat1, lon1 = self._cell(max_lat, max_lon)
+        found = []
+        cells = self._cells
+        for i in range(lat0, lat1 + 1):
+            for j in range(lon0, lon1 + 1):
+                positions = cells.get((i, j))
+                if positions:
+                    found.extend(positions)
+        return found
@@ -1,32 +1,25 @@
-import sqlite3
+import db
+from dedupe import DedupeReport
 
-conn = sqlite3.connect("database.db")
-c = conn.cursor()
-
-c.execute("""
-CREATE TABLE IF NOT EXISTS listings (
-    id INTEGER PRIMARY KEY,
-    title TEXT,
-    price INTEGER,
-    location TEXT,
-    amenities TEXT
-)
-""")
+conn = db.connect()
+# creates the listings table (plus derived columns / listing_amenities) if needed
+db.migrate(conn)
 
 sample_data = [
-    ("Furnished room near campus", 700, "Waterloo", "wifi,laundry,furnished"),
-    ("Studio downtown", 950, "Kitchener", "wifi,gym"),
-    ("Shared apartment close to UW", 650, "Waterloo", "wifi,laundry"),
-    ("Luxury condo", 1200, "Waterloo", "wifi,gym,furnished")
+    ("Furnished room near campus", 700, "Waterloo", "wifi,laundry,furnished", 43.4705, -80.5380),
+    ("Studio downtown", 950, "Kitchener", "wifi,gym", 43.4509, -80.4890),
+    ("Shared apartment close to UW", 650, "Waterloo", "wifi,laundry", 43.4760, -80.5300),
+    ("Luxury condo", 1200, "Waterloo", "wifi,gym,furnished", 43.4650, -80.5220)
 ]
 
-c.executemany(
-    "INSERT INTO listings (title, price, location, amenities) VALUES (?, ?, ?, ?)",
-    sample_data
-)
+# re-running is safe: sample rows already in the database are merged, not appended again
+report = DedupeReport()
+db.insert_listings(conn, [
+    {"title": title, "price": price, "location": location, "amenities": amenities.split(","), "lat": lat, "lon": lon}
+    for title, price, location, amenities, lat, lon in sample_data
+], report=report)
 
 conn.commit()
 conn.close()
 
-print("Database created!")
-
+print(f"Database created! {report.inserted} listings added, {report.summary()}.")
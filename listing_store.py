@@ -0,0 +1,468 @@
+"""Compact struct-of-arrays storage for hydrated listings.
+
+A dict per listing costs several hundred bytes before any data; here each
+numeric field is one typed array, and locations and amenity lists are
+interned so every distinct value is stored once. Listing dicts are only
+built (row()) when a result is serialized.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+from geo import bounding_box, haversine_km
+from matching import (
+    ACCESS_SCORE_KEYS,
+    AMENITIES,
+    VECTORIZE_MIN,
+    amenity_match_counter,
+    compute_matchability,
+    matchability_scores,
+    np,
+)
+
+# stored in place of a NULL price
+NO_PRICE = -(1 << 63)
+
+# stored in place of NULL coordinates
+NAN = float("nan")
+
+# access flags packed into one byte per listing
+FLAG_BITS = {"walkable": 1, "transit": 2, "car_friendly": 4}
+
+SCORE_KEYS = ("walkable_score", "transit_score", "car_score")
+
+
+def copy_column(typecode, column):
+    """A mutable array copy of a typed column (an array or a memoryview over a snapshot)."""
+    copied = array(typecode)
+    copied.frombytes(memoryview(column).cast("B"))
+    return copied
+
+
+class TitleColumn:
+    """Read-only titles kept as one UTF-8 blob plus offsets (snapshot-backed stores)."""
+
+    __slots__ = ("_offsets", "_blob", "_nulls")
+
+    def __init__(self, offsets, blob, nulls=()):
+        self._offsets = offsets
+        self._blob = blob
+        self._nulls = frozenset(nulls)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, pos):
+        if pos in self._nulls:
+            return None
+        return str(self._blob[self._offsets[pos]:self._offsets[pos + 1]], "utf-8")
+
+    def __iter__(self):
+        return (self[pos] for pos in range(len(self)))
+
+
+def flag_filter(walkable=None, transit=None, car_friendly=None):
+    """(mask, want) such that a listing passes the tri-state access filters when flags & mask == want."""
+    mask = want = 0
+    for key, value in (("walkable", walkable), ("transit", transit), ("car_friendly", car_friendly)):
+        if value is not None:
+            mask |= FLAG_BITS[key]
+            if value:
+                want |= FLAG_BITS[key]
+    return mask, want
+
+
+class ListingStore:
+    """Hydrated listings as parallel columns, addressed by position.
+
+    Never mutated once built: extended() returns a new store, so request
+    threads can keep reading (or holding numpy views of) the one they started
+    with while the index swaps in a newer one. A store loaded with
+    from_snapshot() reads its columns straight from the mapped file.
+    """
+
+    __slots__ = (
+        "ids", "prices", "titles", "location_codes", "locations", "location_keys",
+        "flags", "scores", "amenity_codes", "amenity_lists", "amenity_masks", "lats", "lons",
+        "_location_code", "_amenity_code",
+    )
+
+    def __init__(self):
+        self.ids = array("q")
+        self.prices = array("q")
+        self.titles = []
+        # location code -> location string as stored, and its lowercased lookup key
+        self.location_codes = array("I")
+        self.locations = []
+        self.location_keys = []
+        self.flags = array("B")
+        self.scores = {key: array("B") for key in SCORE_KEYS}
+        # amenity-list code -> (amenities tuple, AMENITIES mask)
+        self.amenity_codes = array("I")
+        self.amenity_lists = []
+        self.amenity_masks = []
+        # NaN where a listing has no coordinates
+        self.lats = array("d")
+        self.lons = array("d")
+        self._location_code = {}
+        self._amenity_code = {}
+
+    @classmethod
+    def from_listings(cls, listings):
+        """Build a store from hydrated listing dicts (db.hydrate_row output)."""
+        store = cls()
+        for listing in listings:
+            store._add(listing)
+        return store
+
+    def extended(self, listings):
+        """Return a new store holding these listings followed by `listings`."""
+        store = ListingStore()
+        store.ids = copy_column("q", self.ids)
+        store.prices = copy_column("q", self.prices)
+        store.titles = list(self.titles)
+        store.location_codes = copy_column("I", self.location_codes)
+        store.locations = list(self.locations)
+        store.location_keys = list(self.location_keys)
+        store.flags = copy_column("B", self.flags)
+        store.scores = {key: copy_column("B", col) for key, col in self.scores.items()}
+        store.amenity_codes = copy_column("I", self.amenity_codes)
+        store.amenity_lists = list(self.amenity_lists)
+        store.amenity_masks = list(self.amenity_masks)
+        store.lats = copy_column("d", self.lats)
+        store.lons = copy_column("d", self.lons)
+        store._location_code = dict(self._location_code)
+        store._amenity_code = dict(self._amenity_code)
+        for listing in listings:
+            store._add(listing)
+        return store
+
+    def snapshot_sections(self):
+        """(header fields, {section: (typecode, buffer)}) for snapshot.write; see from_snapshot."""
+        blob = bytearray()
+        offsets = array("Q", [0])
+        nulls = []
+        for pos, title in enumerate(self.titles):
+            if title is None:
+                nulls.append(pos)
+            else:
+                blob += title.encode("utf-8")
+            offsets.append(len(blob))
+        header = {
+            "locations": self.locations,
+            "amenity_lists": [list(amenities) for amenities in self.amenity_lists],
+            "null_titles": nulls,
+        }
+        sections = {
+            "ids": ("q", self.ids),
+            "prices": ("q", self.prices),
+            "location_codes": ("I", self.location_codes),
+            "flags": ("B", self.flags),
+            "amenity_codes": ("I", self.amenity_codes),
+            "lats": ("d", self.lats),
+            "lons": ("d", self.lons),
+            "title_offsets": ("Q", offsets),
+            "titles": ("B", bytes(blob)),
+        }
+        for key in SCORE_KEYS:
+            sections[key] = ("B", self.scores[key])
+        return header, sections
+
+    @classmethod
+    def from_snapshot(cls, header, sections):
+        """A store whose columns are the snapshot's memoryviews (no per-row work or copies)."""
+        store = cls()
+        store.ids = sections["ids"]
+        store.prices = sections["prices"]
+        store.titles = TitleColumn(sections["title_offsets"], sections["titles"], header["null_titles"])
+        store.location_codes = sections["location_codes"]
+        store.flags = sections["flags"]
+        store.scores = {key: sections[key] for key in SCORE_KEYS}
+        store.amenity_codes = sections["amenity_codes"]
+        store.lats = sections["lats"]
+        store.lons = sections["lons"]
+        for location in header["locations"]:
+            store._location_code[location] = len(store.locations)
+            store.locations.append(location)
+            store.location_keys.append((location or "").lower())
+        for amenities in header["amenity_lists"]:
+            amenities = tuple(amenities)
+            store._amenity_code[amenities] = len(store.amenity_lists)
+            store.amenity_lists.append(amenities)
+            # masks depend on this process's AMENITIES bits, so they are rebuilt (once per distinct list)
+            store.amenity_masks.append(AMENITIES.mask(amenities))
+        return store
+
+    def _add(self, listing):
+        location = listing["location"]
+        code = self._location_code.get(location)
+        if code is None:
+            code = self._location_code[location] = len(self.locations)
+            self.locations.append(location)
+            self.location_keys.append((location or "").lower())
+        amenities = tuple(listing["amenities"])
+        acode = self._amenity_code.get(amenities)
+        if acode is None:
+            acode = self._amenity_code[amenities] = len(self.amenity_lists)
+            self.amenity_lists.append(amenities)
+            self.amenity_masks.append(AMENITIES.mask(amenities))
+
+        self.ids.append(listing["id"])
+        self.prices.append(NO_PRICE if listing["price"] is None else listing["price"])
+        self.titles.append(listing["title"])
+        self.location_codes.append(code)
+        self.flags.append(sum(bit for key, bit in FLAG_BITS.items() if listing[key]))
+        for key in SCORE_KEYS:
+            self.scores[key].append(listing[key])
+        self.amenity_codes.append(acode)
+        lat, lon = listing.get("lat"), listing.get("lon")
+        if lat is None or lon is None:
+            lat = lon = NAN
+        self.lats.append(lat)
+        self.lons.append(lon)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def price(self, pos):
+        p = self.prices[pos]
+        return None if p == NO_PRICE else p
+
+    def location_key(self, pos):
+        return self.location_keys[self.location_codes[pos]]
+
+    def mask(self, pos):
+        return self.amenity_masks[self.amenity_codes[pos]]
+
+    def flag(self, pos, key):
+        return bool(self.flags[pos] & FLAG_BITS[key])
+
+    def positions_of(self, ids):
+        """Ascending positions of the given listing ids; ids not in the store are skipped."""
+        store_ids = self.ids
+        n = len(store_ids)
+        found = []
+        for listing_id in ids:
+            # ids are appended in increasing order, so the column is sorted
+            pos = bisect_left(store_ids, listing_id)
+            if pos < n and store_ids[pos] == listing_id:
+                found.append(pos)
+        found.sort()
+        return found
+
+    def filter_positions(self, positions, budget=None, location=None, wanted=None, walkable=None, transit=None,
+                         car_friendly=None, near=None):
+        """Keep the positions whose listing passes every given filter, checking row by row.
+
+        Meant for candidate sets that are already narrowed down (one city, a
+        radius, full-text matches); takes the same filters as
+        ListingsIndex.search_positions.
+        """
+        checks = []
+        if location:
+            loc = location.lower()
+            checks.append(lambda i: self.location_key(i) == loc)
+        if wanted:
+            want = AMENITIES.want_mask(wanted)
+            if want is None:
+                # some wanted amenity appears on no listing
+                return []
+            checks.append(lambda i: self.mask(i) & want == want)
+        if near is not None:
+            lat, lon, radius_km = near
+            lats, lons = self.lats, self.lons
+            checks.append(lambda i: lats[i] == lats[i] and haversine_km(lat, lon, lats[i], lons[i]) <= radius_km)
+        if budget is not None:
+            prices = self.prices
+            checks.append(lambda i: NO_PRICE != prices[i] <= budget)
+        flag_mask, flag_want = flag_filter(walkable, transit, car_friendly)
+        if flag_mask:
+            flags = self.flags
+            checks.append(lambda i: flags[i] & flag_mask == flag_want)
+        if not checks:
+            return list(positions)
+        return [i for i in positions if all(check(i) for check in checks)]
+
+    def coords(self, pos):
+        lat = self.lats[pos]
+        return None if lat != lat else (lat, self.lons[pos])
+
+    def distances_km(self, positions, lat, lon):
+        """Great-circle km from (lat, lon) to each listing at `positions` (None without coordinates)."""
+        lats, lons = self.lats, self.lons
+        return [None if lats[p] != lats[p] else haversine_km(lat, lon, lats[p], lons[p]) for p in positions]
+
+    def row(self, pos):
+        """The listing at `pos` as a fresh dict, shaped like db.hydrate_row output."""
+        flags = self.flags[pos]
+        coords = self.coords(pos)
+        return {
+            "id": self.ids[pos],
+            "title": self.titles[pos],
+            "price": self.price(pos),
+            "location": self.locations[self.location_codes[pos]],
+            "amenities": list(self.amenity_lists[self.amenity_codes[pos]]),
+            "walkable": bool(flags & 1),
+            "transit": bool(flags & 2),
+            "car_friendly": bool(flags & 4),
+            "walkable_score": self.scores["walkable_score"][pos],
+            "transit_score": self.scores["transit_score"][pos],
+            "car_score": self.scores["car_score"][pos],
+            "lat": coords[0] if coords else None,
+            "lon": coords[1] if coords else None,
+        }
+
+    def facet_counts(self, positions, price_bounds):
+        """Counts per city, amenity, access flag and price bucket for the listings at `positions`.
+
+        Everything is tallied in one pass over the candidates, keyed by the
+        interned codes; the codes are expanded to names only at the end.
+        price_bounds are ascending bucket lower bounds (the last bucket is
+        open-ended); missing prices are counted as price_unknown.
+        """
+        location_codes, amenity_codes, flags, prices = self.location_codes, self.amenity_codes, self.flags, self.prices
+        by_location = [0] * len(self.locations)
+        by_amenity_list = {}
+        by_flags = [0] * 8
+        by_bucket = [0] * (len(price_bounds) + 1)  # slot 0: missing or below the first bound
+        for pos in positions:
+            by_location[location_codes[pos]] += 1
+            code = amenity_codes[pos]
+            by_amenity_list[code] = by_amenity_list.get(code, 0) + 1
+            by_flags[flags[pos]] += 1
+            price = prices[pos]
+            by_bucket[0 if price == NO_PRICE else bisect_right(price_bounds, price)] += 1
+
+        cities = {}
+        labels = {}
+        for code, count in enumerate(by_location):
+            if count:
+                key = self.location_keys[code]
+                cities[key] = cities.get(key, 0) + count
+                labels.setdefault(key, self.locations[code])
+        amenities = {}
+        for code, count in by_amenity_list.items():
+            for amenity in set(self.amenity_lists[code]):
+                amenities[amenity] = amenities.get(amenity, 0) + count
+
+        def ranked(counts, label=lambda k: k):
+            return [{"value": label(k), "count": c}
+                    for k, c in sorted(counts.items(), key=lambda kc: (-kc[1], str(kc[0])))]
+
+        return {
+            "total": len(positions),
+            "cities": ranked(cities, lambda k: labels[k]),
+            "amenities": ranked(amenities),
+            "access": {key: sum(c for packed, c in enumerate(by_flags) if packed & bit)
+                       for key, bit in FLAG_BITS.items()},
+            "price": [
+                {"min": low, "max": price_bounds[i + 1] - 1 if i + 1 < len(price_bounds) else None,
+                 "count": by_bucket[i + 1]}
+                for i, low in enumerate(price_bounds)
+            ],
+            "price_unknown": by_bucket[0],
+        }
+
+    def matchability(self, positions, wanted_norm=None, budget=None, access_filters=None, distances=None,
+                     radius_km=None, relevance=None, price_range=None):
+        """Matchability percentages for the listings at `positions` (same values as compute_matchability).
+
+        Large candidate sets are scored straight from the columns (numpy views
+        of the typed arrays); small ones, or installs without numpy, run the
+        reference compute_matchability on minimal per-candidate dicts.
+        price_range, when known (ListingsIndex.price_range), skips the min/max pass.
+        """
+        n = len(positions)
+        count_matched = amenity_match_counter(wanted_norm) if wanted_norm else None
+        if np is None or n < VECTORIZE_MIN:
+            candidates = []
+            for pos in positions:
+                c = {"price": self.price(pos)}
+                for key in SCORE_KEYS:
+                    c[key] = self.scores[key][pos]
+                candidates.append(c)
+            masks = [self.mask(pos) for pos in positions] if wanted_norm else None
+            compute_matchability(candidates, wanted_norm=wanted_norm, budget=budget,
+                                 access_filters=access_filters, amenity_masks=masks,
+                                 distances=distances, radius_km=radius_km, relevance=relevance,
+                                 price_range=price_range)
+            return [c["matchability"] for c in candidates]
+
+        index = np.asarray(positions, dtype=np.intp)
+        prices = np.frombuffer(self.prices, dtype=np.int64)[index]
+        prices[prices == NO_PRICE] = 0
+        access_columns = {}
+        for f in set(access_filters or []):
+            key = ACCESS_SCORE_KEYS.get(f)
+            if key:
+                access_columns[f] = np.frombuffer(self.scores[key], dtype=np.uint8)[index]
+        matched = None
+        if wanted_norm:
+            # one popcount per distinct amenity list among the candidates, not per listing
+            codes, inverse = np.unique(np.frombuffer(self.amenity_codes, dtype=np.uint32)[index],
+                                       return_inverse=True)
+            per_list = np.fromiter((count_matched(self.amenity_masks[c]) for c in codes.tolist()),
+                                   dtype=np.int64, count=len(codes))
+            matched = per_list[inverse]
+        return matchability_scores(prices, access_columns, matched, len(wanted_norm or []),
+                                   budget=budget, access_filters=access_filters,
+                                   distances=distances, radius_km=radius_km, relevance=relevance,
+                                   price_range=price_range).tolist()
+
+
+class CandidateSet:
+    """One candidate set's filter columns, gathered once and filtered many times.
+
+    Batch matching filters many profiles against the same city's listings;
+    with numpy the price/flag/amenity/coordinate columns are pulled out once
+    here and each profile's filter is a few vectorized comparisons instead of
+    a Python loop over every candidate. Without numpy (or for small sets) it
+    falls back to ListingStore.filter_positions.
+    """
+
+    def __init__(self, store, positions):
+        self.store = store
+        self.positions = positions
+        self._columns = None
+        if np is not None and len(positions) >= VECTORIZE_MIN:
+            index = np.asarray(positions, dtype=np.intp)
+            codes, inverse = np.unique(np.frombuffer(store.amenity_codes, dtype=np.uint32)[index],
+                                       return_inverse=True)
+            self._columns = (
+                index,
+                np.frombuffer(store.prices, dtype=np.int64)[index],
+                np.frombuffer(store.flags, dtype=np.uint8)[index],
+                codes.tolist(),
+                inverse,
+                np.frombuffer(store.lats, dtype=np.float64)[index],
+                np.frombuffer(store.lons, dtype=np.float64)[index],
+            )
+
+    def filter(self, budget=None, wanted=None, walkable=None, transit=None, car_friendly=None, near=None):
+        """Positions of the candidates passing every given filter, in the order they were given."""
+        if self._columns is None:
+            return self.store.filter_positions(self.positions, budget=budget, wanted=wanted, walkable=walkable,
+                                               transit=transit, car_friendly=car_friendly, near=near)
+        index, prices, flags, codes, inverse, lats, lons = self._columns
+        keep = np.ones(len(index), dtype=bool)
+        if wanted:
+            want = AMENITIES.want_mask(wanted)
+            if want is None:
+                return []
+            # one mask test per distinct amenity list, broadcast to the candidates
+            masks = self.store.amenity_masks
+            keep &= np.fromiter((masks[c] & want == want for c in codes), dtype=bool, count=len(codes))[inverse]
+        if budget is not None:
+            keep &= (prices != NO_PRICE) & (prices <= budget)
+        flag_mask, flag_want = flag_filter(walkable, transit, car_friendly)
+        if flag_mask:
+            keep &= (flags & flag_mask) == flag_want
+        if near is None:
+            return index[keep].tolist()
+        # vectorized bounding box first (NaN coordinates fail it), then the exact
+        # distance check on what is left so the cut-off matches filter_positions
+        lat, lon, radius_km = near
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+        keep &= (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        store_lats, store_lons = self.store.lats, self.store.lons
+        return [p for p in index[keep].tolist()
+                if haversine_km(lat, lon, store_lats[p], store_lons[p]) <= radius_km]
@@ -0,0 +1,458 @@
+from array import array
+from bisect import bisect_right
+import heapq
+import math
+import os
+import sqlite3
+import threading
+
+from db import LISTING_COLUMNS, connect, hydrate_row, listings_watermark
+from geo import GridIndex, haversine_km
+from listing_store import NO_PRICE, ListingStore, copy_column
+from matching import AMENITIES, bitset_from_positions, iter_positions
+import snapshot
+
+
+# percentiles precomputed for every PriceIndex bucket
+PRICE_PERCENTILES = (25, 50, 75)
+
+# appends larger than this are merged into a bucket instead of insorted one by one
+PRICE_INSORT_MAX = 32
+
+# bumped when the snapshot layout written by ListingsIndex.export_snapshot changes
+SNAPSHOT_FORMAT = 1
+
+class PriceIndex:
+    """Priced listings' positions sorted by (price, position), per location and overall.
+
+    A budget filter is a bisect for the cut-off followed by a slice, so it
+    only touches the qualifying prefix. Every bucket also carries its price
+    stats (count, min/max, percentiles), computed when the bucket changes.
+    Like GridIndex it is never mutated once built: extended() copies only the
+    buckets that gain listings.
+    """
+
+    def __init__(self):
+        # location key (None = every listing) -> (prices array('q'), positions array('I'), unpriced count, stats)
+        self._buckets = {}
+
+    @staticmethod
+    def _bucket(prices, positions, unpriced):
+        n = len(prices)
+        stats = {"count": n, "unpriced": unpriced, "min": None, "max": None}
+        for q in PRICE_PERCENTILES:
+            # nearest-rank percentile
+            stats[f"p{q}"] = prices[max(0, math.ceil(q * n / 100) - 1)] if n else None
+        if n:
+            stats["min"], stats["max"] = prices[0], prices[-1]
+        return prices, positions, unpriced, stats
+
+    @staticmethod
+    def _entries(store, start):
+        """(location key, price, position) for positions start..len(store); price is NO_PRICE when missing."""
+        prices = store.prices
+        return [(store.location_key(pos), prices[pos], pos) for pos in range(start, len(store))]
+
+    @classmethod
+    def build(cls, store):
+        index = cls()
+        index._add(cls._entries(store, 0))
+        return index
+
+    def extended(self, store, start):
+        """Return a copy that also indexes positions start..len(store)."""
+        index = PriceIndex()
+        index._buckets = dict(self._buckets)
+        index._add(self._entries(store, start))
+        return index
+
+    def _add(self, entries):
+        grouped = {}
+        for loc, price, pos in entries:
+            grouped.setdefault(loc, []).append((price, pos))
+        grouped[None] = [(price, pos) for _, price, pos in entries]
+        for loc, pairs in grouped.items():
+            priced = sorted(pair for pair in pairs if pair[0] != NO_PRICE)
+            unpriced = len(pairs) - len(priced)
+            old = self._buckets.get(loc)
+            if old is None:
+                prices = array("q", (price for price, _ in priced))
+                positions = array("I", (pos for _, pos in priced))
+            elif len(priced) <= PRICE_INSORT_MAX:
+                prices, positions = copy_column("q", old[0]), copy_column("I", old[1])
+                for price, pos in priced:
+                    # positions only grow, so equal prices stay in position order
+                    i = bisect_right(prices, price)
+                    prices.insert(i, price)
+                    positions.insert(i, pos)
+                unpriced += old[2]
+            else:
+                merged = list(heapq.merge(zip(old[0], old[1]), priced))
+                prices = array("q", (price for price, _ in merged))
+                positions = array("I", (pos for _, pos in merged))
+                unpriced += old[2]
+            self._buckets[loc] = self._bucket(prices, positions, unpriced)
+
+    def snapshot_sections(self):
+        """(header fields, {section: (typecode, buffer)}) for snapshot.write; see from_snapshot."""
+        buckets = []
+        prices, positions = array("q"), array("I")
+        for loc, (bucket_prices, bucket_positions, unpriced, _) in self._buckets.items():
+            buckets.append([loc, len(prices), len(bucket_prices), unpriced])
+            prices.extend(bucket_prices)
+            positions.extend(bucket_positions)
+        return {"buckets": buckets}, {"price_prices": ("q", prices), "price_positions": ("I", positions)}
+
+    @classmethod
+    def from_snapshot(cls, header, sections):
+        index = cls()
+        prices, positions = sections["price_prices"], sections["price_positions"]
+        for loc, start, count, unpriced in header["buckets"]:
+            index._buckets[loc] = cls._bucket(prices[start:start + count], positions[start:start + count], unpriced)
+        return index
+
+    def within(self, location, budget):
+        """Positions (in price order) of the listings in `location` (None = all) priced at most `budget`."""
+        bucket = self._buckets.get(location)
+        if bucket is None:
+            return []
+        return bucket[1][:bisect_right(bucket[0], budget)]
+
+    def stats(self, location):
+        bucket = self._buckets.get(location)
+        return dict(bucket[3]) if bucket is not None else None
+
+    def price_range(self, location, budget=None):
+        """(min, max) of the prices compute_matchability would see for `location` within `budget`.
+
+        Missing prices count as 0 and are only candidates without a budget.
+        None when there are no such listings.
+        """
+        bucket = self._buckets.get(location)
+        if bucket is None:
+            return None
+        prices, _, unpriced, _ = bucket
+        if budget is None:
+            if not prices:
+                return (0, 0) if unpriced else None
+            return (0 if unpriced else prices[0]), prices[-1]
+        k = bisect_right(prices, budget)
+        return (prices[0], prices[k - 1]) if k else None
+
+
+class ListingsIndex:
+    """Process-wide, pre-hydrated copy of the listings table.
+
+    Every row is hydrated once when it is loaded (from the write-time columns,
+    or normalized and scored in Python for rows that predate them) into a
+    compact ListingStore; request handlers filter by position and only build
+    listing dicts for the rows they return.
+
+    The index keeps inverted postings (one int bitset over row positions per
+    amenity and per location), so the strict amenity filter is a handful of
+    big-int ANDs, a lat/lon grid so radius searches only look at nearby
+    listings, and a PriceIndex so budget filters only visit listings within
+    budget.
+
+    The index watches SQLite's `PRAGMA data_version` on its own connection, so
+    any commit made by another connection (init_db.py, generate_listings.py, the
+    app itself) is noticed on the next lookup. Pure appends are loaded as a
+    delta above the current max id; anything else (an update or delete bumps
+    listings_meta.changes) triggers a full reload. Either way a new state is
+    built and swapped in, so readers keep a consistent snapshot.
+
+    With snapshot_path, the state is first loaded from a snapshot file
+    (`python db.py snapshot`) by mapping it, which takes milliseconds
+    regardless of size and shares the pages between worker processes; rows
+    added since the export are applied as a delta. A newly published
+    snapshot is picked up on the next refresh().
+    """
+
+    def __init__(self, db_path, snapshot_path=None):
+        self.db_path = db_path
+        self.snapshot_path = snapshot_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        # True once _state reflects the rows counted by _count/_max_id/_changes
+        self._loaded = False
+        self._count = 0
+        self._max_id = 0
+        self._changes = None
+        self._snapshot_file = None
+        # bumped on every change picked up by refresh(); used to version caches
+        self.generation = 0
+        # swapped as one tuple so readers never see a mix of old and new
+        self._state = self._empty_state()
+
+    @staticmethod
+    def _empty_state():
+        # store, by_location (positions), location_bits, amenity postings (bit -> bitset), grid, prices
+        return (ListingStore(), {}, {}, {}, GridIndex(), PriceIndex())
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = connect(self.db_path, check_same_thread=False)
+        return self._conn
+
+    def close(self):
+        """Close the SQLite connection, e.g. before forking; the next refresh() reopens it.
+
+        data_version is per-connection, so the watermark is re-checked then too.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._data_version = None
+
+    def _fetch(self, c, min_id=0):
+        c.execute(
+            "SELECT " + ", ".join(LISTING_COLUMNS) + " FROM listings WHERE id > ? ORDER BY id",
+            (min_id,)
+        )
+        return c
+
+    @staticmethod
+    def _index_rows(store, start, by_location, amenity_positions):
+        for pos in range(start, len(store)):
+            by_location.setdefault(store.location_key(pos), array("I")).append(pos)
+            mask = store.mask(pos)
+            while mask:
+                low = mask & -mask
+                amenity_positions.setdefault(low.bit_length() - 1, []).append(pos)
+                mask ^= low
+
+    def _build(self, rows):
+        store = ListingStore.from_listings(hydrate_row(r) for r in rows)
+        by_location = {}
+        amenity_positions = {}
+        self._index_rows(store, 0, by_location, amenity_positions)
+        n = len(store)
+        location_bits = {loc: bitset_from_positions(positions, n) for loc, positions in by_location.items()}
+        postings = {bit: bitset_from_positions(positions, n) for bit, positions in amenity_positions.items()}
+        return (store, by_location, location_bits, postings, GridIndex.build(store.lats, store.lons),
+                PriceIndex.build(store))
+
+    def _append(self, rows):
+        old_store, old_by_location, location_bits, postings, grid, prices = self._state
+        start = len(old_store)
+        store = old_store.extended(hydrate_row(r) for r in rows)
+        added = {}
+        amenity_positions = {}
+        self._index_rows(store, start, added, amenity_positions)
+        # copy only what changes; untouched position lists are shared with the old state
+        by_location = dict(old_by_location)
+        location_bits = dict(location_bits)
+        for loc, positions in added.items():
+            by_location[loc] = copy_column("I", by_location.get(loc, array("I"))) + positions
+            location_bits[loc] = location_bits.get(loc, 0) | bitset_from_positions(positions, len(store))
+        postings = dict(postings)
+        for bit, positions in amenity_positions.items():
+            postings[bit] = postings.get(bit, 0) | bitset_from_positions(positions, len(store))
+        return (store, by_location, location_bits, postings, grid.extended(store.lats, store.lons, start),
+                prices.extended(store, start))
+
+    def _snapshot_state(self, header, sections):
+        store = ListingStore.from_snapshot(header["store"], sections)
+        by_location = {}
+        location_bits = {}
+        positions = sections["location_positions"]
+        for loc, start, count, bits_start, bits_len in header["locations"]:
+            by_location[loc] = positions[start:start + count]
+            location_bits[loc] = int.from_bytes(sections["location_bitsets"][bits_start:bits_start + bits_len], "little")
+        postings = {}
+        for amenity, start, length in header["postings"]:
+            # keyed by name in the file; bits are this process's AMENITIES positions
+            postings[AMENITIES.bit(amenity)] = int.from_bytes(sections["posting_bitsets"][start:start + length], "little")
+        return (store, by_location, location_bits, postings, GridIndex.from_snapshot(header["grid"], sections),
+                PriceIndex.from_snapshot(header["prices"], sections))
+
+    def _check_snapshot(self):
+        """Load the snapshot file if a different one was published since the last check; True if loaded."""
+        if not self.snapshot_path:
+            return False
+        try:
+            st = os.stat(self.snapshot_path)
+        except OSError:
+            return False
+        file_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if file_id == self._snapshot_file:
+            return False
+        self._snapshot_file = file_id
+        try:
+            header, sections = snapshot.read(self.snapshot_path)
+            if header.get("format") != SNAPSHOT_FORMAT:
+                raise ValueError(f"unsupported snapshot format {header.get('format')}")
+            state = self._snapshot_state(header, sections)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring listings snapshot {self.snapshot_path}: {e}")
+            return False
+        self._state = state
+        self._count, self._max_id, self._changes = header["watermark"]
+        self._loaded = True
+        return True
+
+    def refresh(self):
+        """Reload whatever changed since the last call; cheap when nothing did."""
+        with self._lock:
+            loaded_snapshot = self._check_snapshot()
+            c = self._connection().cursor()
+            c.execute("PRAGMA data_version")
+            version = c.fetchone()[0]
+            if version == self._data_version and not loaded_snapshot:
+                return
+            self.generation += 1
+            try:
+                count, max_id, changes = listings_watermark(c)
+            except sqlite3.OperationalError:
+                # listings table not created yet (init_db.py not run)
+                self._state = self._empty_state()
+                self._count, self._max_id, self._changes = 0, 0, None
+                self._loaded = False
+                self._data_version = version
+                return
+
+            # without the listings_meta counter, updates can only be told apart by a rebuild
+            appendable = self._loaded and (changes is None or changes == self._changes)
+            if appendable and changes is not None and (count, max_id) == (self._count, self._max_id):
+                # nothing to load (e.g. a snapshot that is still current)
+                self._data_version = version
+                return
+            if appendable and max_id > self._max_id:
+                delta = self._fetch(c, self._max_id).fetchall()
+                if self._count + len(delta) == count:
+                    # pure append: extend a copy of the current state
+                    self._state = self._append(delta)
+                    self._count, self._max_id = count, max_id
+                    self._data_version = version
+                    return
+
+            # updates/deletes (or first load): rebuild off to the side, then swap
+            self._state = self._build(self._fetch(c))
+            self._count, self._max_id, self._changes = count, max_id, changes
+            self._loaded = True
+            self._data_version = version
+
+    def export_snapshot(self, path):
+        """Write the current state to `path` as a snapshot file (atomically replacing it).
+
+        Returns the number of listings written.
+        """
+        self.refresh()
+        with self._lock:
+            store, by_location, location_bits, postings, grid, prices = self._state
+            watermark = [self._count, self._max_id, self._changes]
+        n = len(store)
+        nbytes = (n + 7) // 8
+        store_header, sections = store.snapshot_sections()
+        locations = []
+        positions = array("I")
+        location_bitsets = bytearray()
+        for loc, loc_positions in by_location.items():
+            bits = location_bits[loc].to_bytes(nbytes, "little")
+            locations.append([loc, len(positions), len(loc_positions), len(location_bitsets), len(bits)])
+            positions.extend(loc_positions)
+            location_bitsets += bits
+        posting_header = []
+        posting_bitsets = bytearray()
+        names = AMENITIES.names()
+        for bit, bitset in postings.items():
+            bits = bitset.to_bytes(nbytes, "little")
+            posting_header.append([names[bit], len(posting_bitsets), len(bits)])
+            posting_bitsets += bits
+        grid_header, grid_sections = grid.snapshot_sections()
+        price_header, price_sections = prices.snapshot_sections()
+        sections.update(grid_sections)
+        sections.update(price_sections)
+        sections["location_positions"] = ("I", positions)
+        sections["location_bitsets"] = ("B", bytes(location_bitsets))
+        sections["posting_bitsets"] = ("B", bytes(posting_bitsets))
+        snapshot.write(path, {
+            "format": SNAPSHOT_FORMAT,
+            "rows": n,
+            "watermark": watermark,
+            "store": store_header,
+            "locations": locations,
+            "postings": posting_header,
+            "grid": grid_header,
+            "prices": price_header,
+        }, sections)
+        return n
+
+    @property
+    def store(self):
+        return self._state[0]
+
+    @property
+    def version(self):
+        """The listings_watermark() of the loaded rows: equal in every process that has loaded the same data."""
+        with self._lock:
+            return self._count, self._max_id, self._changes
+
+    def search_positions(self, budget=None, location=None, wanted=None, walkable=None, transit=None, car_friendly=None,
+                         near=None, ids=None):
+        """Return (store, positions) of the listings passing every given filter, in id order.
+
+        wanted is a list of normalized amenities that must ALL be present; the
+        access flags are tri-state (None means don't filter); near is an
+        optional (lat, lon, radius_km); ids optionally restricts the search to
+        those listing ids (e.g. full-text matches). Positions index into the
+        returned store (a snapshot later refreshes don't modify).
+        """
+        self.refresh()
+        store, by_location, location_bits, postings, grid, prices = self._state
+        loc = location.lower() if location else None
+
+        restrict = None
+        if near is not None:
+            # grid cells prune to the bounding box; the rest is checked exactly
+            lat, lon, radius_km = near
+            lats, lons = store.lats, store.lons
+            restrict = sorted(p for p in grid.candidates(lat, lon, radius_km)
+                              if haversine_km(lat, lon, lats[p], lons[p]) <= radius_km)
+        if ids is not None:
+            id_positions = store.positions_of(ids)
+            restrict = id_positions if restrict is None else sorted(set(restrict).intersection(id_positions))
+        if restrict is not None:
+            # small explicit candidate set: check location/amenities per row
+            return store, store.filter_positions(restrict, budget=budget, location=loc, wanted=wanted,
+                                                 walkable=walkable, transit=transit, car_friendly=car_friendly)
+        if wanted:
+            want = AMENITIES.want_mask(wanted)
+            if want is None:
+                # some wanted amenity appears on no listing
+                return store, []
+            # candidates = location posting AND every wanted amenity's posting
+            bits = location_bits.get(loc, 0) if loc else (1 << len(store)) - 1
+            while want and bits:
+                low = want & -want
+                bits &= postings.get(low.bit_length() - 1, 0)
+                want ^= low
+            positions = iter_positions(bits)
+        elif budget is not None:
+            # only the listings priced within budget, found by bisect on the price index
+            positions = sorted(prices.within(loc, budget))
+            budget = None
+        elif loc:
+            positions = by_location.get(loc, ())
+        else:
+            positions = range(len(store))
+        return store, store.filter_positions(positions, budget=budget,
+                                             walkable=walkable, transit=transit, car_friendly=car_friendly)
+
+    def price_stats(self, location=None):
+        """Count, unpriced count, min/max and percentile prices for a location (None = all listings)."""
+        self.refresh()
+        return self._state[5].stats(location.lower() if location else None)
+
+    def price_range(self, store, location=None, budget=None):
+        """(min, max) scoring price range of a location/budget-only candidate set, from the price index.
+
+        None unless `store` is still the current snapshot (positions from an
+        older search may not match the index any more).
+        """
+        state = self._state
+        if state[0] is not store:
+            return None
+        return state[5].price_range(location.lower() if location else None, budget)
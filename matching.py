@@ -0,0 +1,559 @@
+"""Pure listing helpers shared by the Flask app, the listings index and the ingest scripts."""
+
+import heapq
+import json
+import os
+import threading
+import time
+
+from geo import proximity_score
+
+try:
+    import numpy as np
+except ImportError:  # optional: score_matchability falls back to the pure-Python loop
+    np = None
+
+
+def normalize_amenities_list(amenities):
+    """Return a list of normalized amenity strings (lowercased, trimmed, mapped, spaces -> hyphens)."""
+    AMENITY_ALIASES = {
+        "internet": "wifi",
+        "wi-fi": "wifi",
+        "wi fi": "wifi",
+        "pets": "pet-friendly",
+        "pet friendly": "pet-friendly",
+        "pet-friendly": "pet-friendly",
+    }
+    normalized = []
+    for a in (amenities or []):
+        if not isinstance(a, str):
+            continue
+        a_norm = a.strip().lower()
+        # map common aliases
+        a_mapped = AMENITY_ALIASES.get(a_norm, a_norm)
+        a_mapped = a_mapped.replace(' ', '-')
+        if a_mapped:
+            normalized.append(a_mapped)
+    return normalized
+
+
+def compute_matchability(listings, wanted_norm=None, budget=None, access_filters=None, amenity_masks=None,
+                         distances=None, radius_km=None, relevance=None, price_range=None):
+    """Attach a matchability percentage to each listing in-place and return the list.
+    wanted_norm: list of normalized wanted amenities (e.g., ['wifi','gym']) or empty/None
+    budget: integer budget (or None)
+    amenity_masks: optional AMENITIES masks parallel to listings (listing amenities must already be normalized)
+    distances / radius_km: optional km from a `near` point, parallel to listings, and the search radius
+    relevance: optional 0..1 text-search relevance parallel to listings (1 = best BM25 match)
+    price_range: optional precomputed (min, max) of the listings' prices (missing = 0), e.g. from the price index
+    Algorithm:
+      - amenity_score = matched_count / len(wanted_norm) (0..1). If no wanted_norm, amenity_score = 0.
+      - price_score = normalized where lower price => higher score. If budget available, use budget-range; else use min/max in listings.
+      - combine: if wanted_norm provided, weights amenity=0.6, price=0.4; else 100% price.
+      - with distances, blend in proximity (1 at the point, 0 at the radius) at DISTANCE_WEIGHT.
+      - with relevance, blend it in at TEXT_WEIGHT.
+      - Convert to integer percent 0..100 and add as listing['matchability']
+    """
+    if not listings:
+        return listings
+
+    if price_range is not None:
+        min_price, max_price = price_range
+    else:
+        prices = [l.get('price') or 0 for l in listings]
+        min_price = min(prices)
+        max_price = max(prices)
+    # avoid zero division
+    eps = 1e-6
+
+    if wanted_norm and amenity_masks is None:
+        # interned before the counter is built, so amenities first seen here can match
+        amenity_masks = [AMENITIES.mask(l.get('amenities') or []) for l in listings]
+    count_matched = amenity_match_counter(wanted_norm) if wanted_norm else None
+
+    for i, l in enumerate(listings):
+        price = l.get('price') or 0
+
+        # price score: higher for cheaper options relative to range or budget
+        if budget:
+            denom = max(eps, (budget - min_price))
+            # if budget <= min_price then denom small; use fallback to range
+            if denom <= eps and max_price > min_price:
+                denom = max_price - min_price
+            price_score = 1.0 - max(0.0, (price - min_price) / max(denom, eps))
+        else:
+            denom = max(eps, (max_price - min_price))
+            price_score = 1.0 - ((price - min_price) / denom) if denom > eps else 1.0
+        price_score = max(0.0, min(1.0, price_score))
+
+        # amenity score
+        amenity_score = 0.0
+        matched = 0
+        if wanted_norm:
+            matched = count_matched(amenity_masks[i])
+            amenity_score = matched / len(wanted_norm) if wanted_norm else 0.0
+
+        # accessibility score: average of selected access_scores (normalized 0..1)
+        access_score = 0.0
+        if access_filters:
+            parts = []
+            for f in access_filters:
+                if f == 'walkable':
+                    parts.append((l.get('walkable_score') or 0) / 100.0)
+                elif f == 'transit':
+                    parts.append((l.get('transit_score') or 0) / 100.0)
+                elif f == 'car_friendly':
+                    parts.append((l.get('car_score') or 0) / 100.0)
+            if parts:
+                access_score = sum(parts) / len(parts)
+
+        # Weighting rules
+        # If user requested amenities, keep amenity weight high (0.6). The remaining 0.4
+        # is split between price and accessibility when accessibility filters are present.
+        if wanted_norm:
+            amenity_weight = 0.6
+            remaining = 0.4
+            if access_filters:
+                access_total = remaining * 0.5
+                price_weight = remaining - access_total
+                access_weight = access_total
+            else:
+                price_weight = remaining
+                access_weight = 0.0
+        else:
+            # No amenities requested: use price mostly; if access filters selected, include them.
+            if access_filters:
+                price_weight = 0.6
+                access_weight = 0.4
+            else:
+                price_weight = 1.0
+                access_weight = 0.0
+
+        score = (amenity_weight * amenity_score if wanted_norm else 0.0) + (price_weight * price_score) + (access_weight * access_score)
+
+        # radius search: closer listings rank higher; weights above are untouched otherwise
+        if distances is not None:
+            score = (1.0 - DISTANCE_WEIGHT) * score + DISTANCE_WEIGHT * proximity_score(distances[i], radius_km)
+        # text search: better BM25 matches rank higher
+        if relevance is not None:
+            score = (1.0 - TEXT_WEIGHT) * score + TEXT_WEIGHT * relevance[i]
+
+        pct = int(round(max(0.0, min(1.0, score)) * 100))
+        l['matchability'] = pct
+
+    return listings
+
+
+# share of the final score given to proximity when a `near` radius search is active
+DISTANCE_WEIGHT = 0.3
+
+# share of the final score given to BM25 relevance when a `q` text search is active
+TEXT_WEIGHT = 0.3
+
+# below this many candidates the per-call numpy overhead outweighs the loop
+VECTORIZE_MIN = 256
+
+
+def matchability_weights(wanted_norm, access_filters):
+    """Return (amenity_weight, price_weight, access_weight) exactly as compute_matchability picks them."""
+    if wanted_norm:
+        remaining = 0.4
+        if access_filters:
+            access_total = remaining * 0.5
+            return 0.6, remaining - access_total, access_total
+        return 0.6, remaining, 0.0
+    if access_filters:
+        return 0.0, 0.6, 0.4
+    return 0.0, 1.0, 0.0
+
+
+def matchability_scores(prices, access_columns, matched, wanted_count, budget=None, access_filters=None,
+                        distances=None, radius_km=None, relevance=None, price_range=None):
+    """Columnar compute_matchability: score a whole candidate set in one batch.
+
+    prices: int array (missing prices as 0); access_columns: dict of
+    'walkable' / 'transit' / 'car_friendly' -> 0..100 score arrays; matched:
+    wanted-amenity match counts (ignored when wanted_count is 0); distances:
+    optional km from the `near` point, scored against radius_km; relevance:
+    optional 0..1 text-search relevance; price_range: optional precomputed
+    (min, max) of prices.
+    Returns an int array of matchability percentages, identical to the
+    dict-based compute_matchability (same float operations in the same order).
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if len(prices) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if price_range is not None:
+        min_price, max_price = (float(p) for p in price_range)
+    else:
+        min_price = prices.min()
+        max_price = prices.max()
+    eps = 1e-6
+
+    if budget:
+        denom = max(eps, (budget - min_price))
+        if denom <= eps and max_price > min_price:
+            denom = max_price - min_price
+        price_score = 1.0 - np.maximum(0.0, (prices - min_price) / max(denom, eps))
+    else:
+        denom = max(eps, (max_price - min_price))
+        if denom > eps:
+            price_score = 1.0 - ((prices - min_price) / denom)
+        else:
+            price_score = np.ones_like(prices)
+    price_score = np.clip(price_score, 0.0, 1.0)
+
+    amenity_weight, price_weight, access_weight = matchability_weights(wanted_count, access_filters)
+
+    score = price_weight * price_score
+    if wanted_count:
+        amenity_score = np.asarray(matched, dtype=np.float64) / wanted_count
+        score = amenity_weight * amenity_score + score
+
+    if access_filters:
+        parts = [access_columns[f] for f in access_filters if f in access_columns]
+        if parts:
+            total = 0.0
+            for col in parts:
+                total = total + np.asarray(col, dtype=np.float64) / 100.0
+            score = score + access_weight * (total / len(parts))
+
+    if distances is not None:
+        proximity = np.clip(1.0 - np.asarray(distances, dtype=np.float64) / radius_km, 0.0, 1.0)
+        score = (1.0 - DISTANCE_WEIGHT) * score + DISTANCE_WEIGHT * proximity
+    if relevance is not None:
+        score = (1.0 - TEXT_WEIGHT) * score + TEXT_WEIGHT * np.asarray(relevance, dtype=np.float64)
+
+    return np.rint(np.clip(score, 0.0, 1.0) * 100).astype(np.int64)
+
+
+def matchability_values(listings, wanted_norm=None, budget=None, access_filters=None, amenity_masks=None,
+                        distances=None, radius_km=None, relevance=None):
+    """Return the matchability percentages for listings without modifying them.
+
+    Large inputs go through the vectorized matchability_scores; small inputs
+    (< VECTORIZE_MIN) or installs without numpy use the dict-based
+    compute_matchability (the reference implementation) on shallow copies.
+    """
+    n = len(listings)
+    if np is None or n < VECTORIZE_MIN:
+        copies = [dict(l) for l in listings]
+        compute_matchability(copies, wanted_norm=wanted_norm, budget=budget,
+                             access_filters=access_filters, amenity_masks=amenity_masks,
+                             distances=distances, radius_km=radius_km, relevance=relevance)
+        return [l['matchability'] for l in copies]
+
+    prices = np.fromiter((l.get('price') or 0 for l in listings), dtype=np.int64, count=n)
+    access_columns = {}
+    for f in set(access_filters or []):
+        key = ACCESS_SCORE_KEYS.get(f)
+        if key:
+            access_columns[f] = np.fromiter((l.get(key) or 0 for l in listings), dtype=np.int64, count=n)
+
+    matched = None
+    if wanted_norm:
+        if amenity_masks is None:
+            amenity_masks = [AMENITIES.mask(l.get('amenities') or []) for l in listings]
+        count_matched = amenity_match_counter(wanted_norm)
+        matched = np.fromiter((count_matched(m) for m in amenity_masks), dtype=np.int64, count=n)
+
+    return matchability_scores(prices, access_columns, matched, len(wanted_norm or []),
+                               budget=budget, access_filters=access_filters,
+                               distances=distances, radius_km=radius_km, relevance=relevance).tolist()
+
+
+def score_matchability(listings, wanted_norm=None, budget=None, access_filters=None, amenity_masks=None,
+                       distances=None, radius_km=None, relevance=None):
+    """Same contract as compute_matchability (annotates in-place), computed via matchability_values."""
+    scores = matchability_values(listings, wanted_norm=wanted_norm, budget=budget,
+                                 access_filters=access_filters, amenity_masks=amenity_masks,
+                                 distances=distances, radius_km=radius_km, relevance=relevance)
+    for l, pct in zip(listings, scores):
+        l['matchability'] = pct
+    return listings
+
+
+def rank_positions(ids, scores, limit=None, offset=0, after=None):
+    """Rank parallel (ids, scores) by score (desc) with ties broken by id (asc).
+
+    Returns a list of (score, index) for the requested page. `after` is a
+    (score, id) keyset cursor: only entries ranked strictly after it are
+    considered. With a limit only the top offset+limit entries are selected
+    (heap-based partial selection) instead of sorting everything.
+    """
+    keyed = ((-s, listing_id, i) for i, (listing_id, s) in enumerate(zip(ids, scores)))
+    if after is not None:
+        after_key = (-after[0], after[1])
+        keyed = (k for k in keyed if k[:2] > after_key)
+    if limit is None:
+        top = sorted(keyed)[offset:]
+    else:
+        top = heapq.nsmallest(offset + limit, keyed)[offset:]
+    return [(-neg_score, i) for neg_score, _, i in top]
+
+
+# access filter name -> listing score key
+ACCESS_SCORE_KEYS = {
+    'walkable': 'walkable_score',
+    'transit': 'transit_score',
+    'car_friendly': 'car_score',
+}
+
+
+# derived listing fields, in the order AccessRules.evaluate returns them
+ACCESS_KEYS = ("walkable", "transit", "car_friendly", "walkable_score", "transit_score", "car_score")
+
+ACCESS_RULES_PATH = os.environ.get(
+    "ACCESS_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "access_rules.json")
+)
+
+
+def _clamp_score(x):
+    return max(0, min(100, int(round(x))))
+
+
+class CompiledAccessRules:
+    """An access_rules.json table compiled for lookup.
+
+    Only two things about a listing matter to the rules: which city sets its
+    location belongs to (its city class) and which of the amenities the
+    rules mention it has (a bitmask). Results are tabulated per
+    (class, mask), filled in the first time each combination is seen.
+    """
+
+    def __init__(self, rules):
+        self.city_sets = {name: frozenset(c.strip().lower() for c in cities)
+                          for name, cities in rules["city_sets"].items()}
+        self.amenity_bits = {}
+        self.flags = [[self._condition(c) for c in rules["flags"][key]] for key in ACCESS_KEYS[:3]]
+        self.scores = []
+        for key in ACCESS_KEYS[3:]:
+            score = rules["scores"][key]
+            self.scores.append((
+                [(self._condition(rule), rule["value"]) for rule in score["base"]],
+                [(self._condition(rule), rule["add"]) for rule in score.get("adjust", [])],
+            ))
+        self.city_class = {}
+        for name, cities in self.city_sets.items():
+            for city in cities:
+                self.city_class[city] = self.city_class.get(city, frozenset()) | {name}
+        self._table = {}
+
+    def _condition(self, rule):
+        """(city set name or None, amenity mask or None); None parts always hold."""
+        city_in = rule.get("city_in")
+        if city_in is not None and city_in not in self.city_sets:
+            raise ValueError(f"unknown city set: {city_in}")
+        any_of = rule.get("amenities_any")
+        mask = None
+        if any_of is not None:
+            mask = 0
+            for amenity in any_of:
+                mask |= self.amenity_bits.setdefault(amenity, 1 << len(self.amenity_bits))
+        return city_in, mask
+
+    @staticmethod
+    def _holds(condition, city_class, mask):
+        city_in, any_mask = condition
+        return (city_in is None or city_in in city_class) and (any_mask is None or bool(mask & any_mask))
+
+    def _evaluate(self, city_class, mask):
+        holds = self._holds
+        values = [any(holds(c, city_class, mask) for c in conditions) for conditions in self.flags]
+        for base, adjust in self.scores:
+            score = next((value for c, value in base if holds(c, city_class, mask)), 0)
+            for c, add in adjust:
+                if holds(c, city_class, mask):
+                    score = max(0, min(100, score + add))
+            values.append(_clamp_score(score))
+        return tuple(values)
+
+    def lookup(self, location, amenities):
+        """ACCESS_KEYS values for a lowercased location and normalized amenities."""
+        city_class = self.city_class.get(location, frozenset())
+        bits = self.amenity_bits
+        mask = 0
+        for amenity in amenities:
+            mask |= bits.get(amenity, 0)
+        key = (city_class, mask)
+        result = self._table.get(key)
+        if result is None:
+            result = self._table[key] = self._evaluate(city_class, mask)
+        return result
+
+
+class AccessRules:
+    """The accessibility heuristics, loaded from a JSON rule table and hot-reloaded.
+
+    The file's mtime is checked at most every `reload_interval` seconds; a
+    changed file is compiled off to the side and swapped in together with a
+    fresh memo, so a bad edit keeps the previous rules in force. evaluate()
+    memoizes per (location, amenities) as given, skipping normalization too.
+    Rows already in the database keep their stored columns until
+    `python db.py backfill --all`.
+    """
+
+    MEMO_SIZE = 65536
+
+    def __init__(self, path=ACCESS_RULES_PATH, reload_interval=1.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked = None
+        # (CompiledAccessRules, memo) swapped as one
+        self._state = None
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._state is not None and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            if self._state is not None and now - self._checked < self.reload_interval:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                if self._state is None:
+                    raise
+                return
+            if mtime == self._mtime:
+                return
+            # remembered even if loading fails, so a bad edit is reported once
+            self._mtime = mtime
+            try:
+                with open(self.path) as f:
+                    compiled = CompiledAccessRules(json.load(f))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                if self._state is None:
+                    raise
+                print(f"Keeping previous access rules, could not load {self.path}: {e}")
+                return
+            self._state = (compiled, {})
+            self.generation += 1
+
+    def compiled(self):
+        self._refresh()
+        return self._state[0]
+
+    def evaluate(self, location, amenities):
+        """ACCESS_KEYS values for a listing's raw location and amenity list."""
+        self._refresh()
+        compiled, memo = self._state
+        key = (location, tuple(amenities or ()))
+        try:
+            result = memo.get(key)
+        except TypeError:  # unhashable amenity entries: skip the memo
+            return compiled.lookup((location or '').strip().lower(), normalize_amenities_list(amenities))
+        if result is None:
+            result = compiled.lookup((location or '').strip().lower(), normalize_amenities_list(amenities))
+            if len(memo) >= self.MEMO_SIZE:
+                memo.clear()
+            memo[key] = result
+        return result
+
+
+ACCESS_RULES = AccessRules()
+
+
+def compute_accessibility_flags(listing):
+    """Attach walkable/transit/car_friendly booleans and 0..100 scores to a listing dict (rules in access_rules.json)."""
+    listing.update(zip(ACCESS_KEYS, ACCESS_RULES.evaluate(listing.get('location'), listing.get('amenities'))))
+    return listing
+
+
+class AmenityVocab:
+    """Interns normalized amenity strings to bit positions.
+
+    A listing's amenities become one integer mask, so "has all wanted" is
+    `mask & want == want` and the matched count is a popcount.
+    """
+
+    def __init__(self):
+        self._bits = {}
+        self._names = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        return list(self._names)
+
+    def bit(self, amenity, intern=True):
+        """Return the bit position for amenity (None if unknown and intern is False)."""
+        bit = self._bits.get(amenity)
+        if bit is None and intern:
+            with self._lock:
+                bit = self._bits.get(amenity)
+                if bit is None:
+                    bit = len(self._names)
+                    self._names.append(amenity)
+                    self._bits[amenity] = bit
+        return bit
+
+    def mask(self, amenities):
+        """Mask for a listing's (normalized) amenities, interning new ones."""
+        m = 0
+        for a in amenities:
+            m |= 1 << self.bit(a)
+        return m
+
+    def want_mask(self, wanted):
+        """Mask for a user's wanted amenities, or None if one of them is on no listing at all."""
+        m = 0
+        for a in wanted or []:
+            bit = self.bit(a, intern=False)
+            if bit is None:
+                return None
+            m |= 1 << bit
+        return m
+
+
+# shared by the listings index and compute_matchability
+AMENITIES = AmenityVocab()
+
+
+def amenity_match_counter(wanted_norm):
+    """Return a function mask -> number of wanted_norm entries present in that mask.
+
+    Duplicate wanted entries count once per occurrence (as the list-based
+    check always did); unknown amenities can never match.
+    """
+    want = 0
+    repeated = {}
+    for w in wanted_norm or []:
+        bit = AMENITIES.bit(w, intern=False)
+        if bit is None:
+            continue
+        if want >> bit & 1:
+            repeated[bit] = repeated.get(bit, 1) + 1
+        want |= 1 << bit
+    if not repeated:
+        return lambda mask: (mask & want).bit_count()
+
+    def count(mask):
+        hits = mask & want
+        return hits.bit_count() + sum(n - 1 for bit, n in repeated.items() if hits >> bit & 1)
+    return count
+
+
+def bitset_from_positions(positions, size):
+    """Build an int bitset of `size` bits with the given positions set."""
+    if size == 0:
+        return 0
+    digits = bytearray(b"0" * size)
+    for p in positions:
+        digits[size - 1 - p] = 49  # ord("1")
+    return int(digits, 2)
+
+
+def iter_positions(bits):
+    """Yield the set bit positions of an int bitset in ascending order."""
+    s = bin(bits)[:1:-1]
+    i = s.find("1")
+    while i != -1:
+        yield i
+        i = s.find("1", i + 1)
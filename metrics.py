@@ -0,0 +1,173 @@
+"""Lightweight request instrumentation: per-stage timings, Prometheus-text aggregates, slow-request profiles."""
+from contextlib import contextmanager
+import cProfile
+import heapq
+import os
+import random
+import threading
+import time
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Timings:
+    """Per-request stage stopwatch; renders a Server-Timing header value."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.rows = {}
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t
+
+    def count(self, kind, n):
+        self.rows[kind] = n
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total=None):
+        parts = [f"{name};dur={secs * 1000:.3f}" for name, secs in self.stages.items()]
+        parts.append(f"total;dur={(self.total() if total is None else total) * 1000:.3f}")
+        return ", ".join(parts)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+def _labels(labels):
+    return ",".join(f'{k}="{str(v)}"' for k, v in labels)
+
+
+class Registry:
+    """Thread-safe aggregates rendered in the Prometheus text exposition format."""
+
+    def __init__(self, prefix="listings"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> value
+
+    def _histogram(self, name, labels, buckets):
+        key = (name, tuple(labels))
+        h = self._histograms.get(key)
+        if h is None:
+            h = self._histograms[key] = Histogram(buckets)
+        return h
+
+    def observe_request(self, endpoint, method, status, timings, total):
+        """Fold one finished request's Timings into the aggregates."""
+        labels = (("endpoint", endpoint), ("method", method))
+        with self._lock:
+            self._histogram("request_duration_seconds", labels, LATENCY_BUCKETS).observe(total)
+            key = ("requests_total", labels + (("status", status),))
+            self._counters[key] = self._counters.get(key, 0) + 1
+            for stage, secs in timings.stages.items():
+                self._histogram("stage_duration_seconds", (("endpoint", endpoint), ("stage", stage)),
+                                LATENCY_BUCKETS).observe(secs)
+            for kind, n in timings.rows.items():
+                self._histogram("rows", (("endpoint", endpoint), ("kind", kind)), ROW_BUCKETS).observe(n)
+
+    def render(self, samples=()):
+        """Prometheus text; `samples` are extra (name, type, labels, value) read at scrape time."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                full = f"{self.prefix}_{name}"
+                if full not in seen:
+                    seen.add(full)
+                    lines.append(f"# TYPE {full} counter")
+                lines.append(f"{full}{{{_labels(labels)}}} {value}")
+            for (name, labels), h in sorted(self._histograms.items(), key=lambda kv: kv[0]):
+                full = f"{self.prefix}_{name}"
+                if full not in seen:
+                    seen.add(full)
+                    lines.append(f"# TYPE {full} histogram")
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{full}_bucket{{{_labels(labels + (("le", bound),))}}} {cumulative}')
+                lines.append(f'{full}_bucket{{{_labels(labels + (("le", "+Inf"),))}}} {h.count}')
+                lines.append(f"{full}_sum{{{_labels(labels)}}} {h.sum:.6f}")
+                lines.append(f"{full}_count{{{_labels(labels)}}} {h.count}")
+        for name, kind, labels, value in samples:
+            full = f"{self.prefix}_{name}"
+            if full not in seen:
+                seen.add(full)
+                lines.append(f"# TYPE {full} {kind}")
+            lines.append(f"{full}{{{_labels(labels)}}} {value}" if labels else f"{full} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """Optional sampling profiler that keeps cProfile dumps of the slowest requests.
+
+    A `sample_rate` share of requests runs under cProfile; of those, the
+    `keep` slowest are written to `directory` as <ms>ms-<endpoint>.prof
+    (open with `python -m pstats` or snakeviz). Disabled when sample_rate is 0.
+    """
+
+    def __init__(self, sample_rate=0.0, keep=10, directory="profiles"):
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.directory = directory
+        self._slowest = []  # min-heap of (seconds, path)
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+            keep=int(os.environ.get("PROFILE_KEEP", 10)),
+            directory=os.environ.get("PROFILE_DIR", "profiles"),
+        )
+
+    def start(self):
+        """Return a running cProfile.Profile if this request is sampled, else None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            self._counter += 1
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, seconds, endpoint):
+        profile.disable()
+        with self._lock:
+            if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            name = endpoint.strip("/").replace("/", "_") or "root"
+            path = os.path.join(self.directory, f"{seconds * 1000:09.3f}ms-{name}-{self._counter}.prof")
+            profile.dump_stats(path)
+            heapq.heappush(self._slowest, (seconds, path))
+            while len(self._slowest) > self.keep:
+                _, evicted = heapq.heappop(self._slowest)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
@@ -0,0 +1,82 @@
+"""In-memory index over saved-search predicates, used to match newly inserted listings."""
+from geo import haversine_km
+
+# saved_searches columns, in SavedSearchIndex.add() argument order
+SAVED_SEARCH_COLUMNS = ["id", "budget", "location", "amenities", "walkable", "transit", "car_friendly",
+                        "lat", "lon", "radius_km"]
+
+ACCESS_KEYS = ("walkable", "transit", "car_friendly")
+
+
+class SavedSearchIndex:
+    """Saved searches bucketed by location, with amenities as bitmasks.
+
+    A new listing is only tested against the searches for its city plus the
+    ones without a location, and each test is a few integer comparisons
+    (budget, access flags, amenity subset), so matching an insert costs
+    O(relevant saved searches) regardless of how many listings exist.
+    Amenity bits are assigned over the amenities saved searches ask for;
+    amenities no search mentions never affect a match.
+    """
+
+    def __init__(self, version=None):
+        # saved_searches_meta.version when loaded; see db.load_saved_searches
+        self.version = version
+        self._bits = {}
+        # lowercased location (None = any) -> [(search id, budget, want mask, flag mask, flag want, near)]
+        self._by_location = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, search_id, budget=None, location=None, amenities=None, walkable=None, transit=None,
+            car_friendly=None, lat=None, lon=None, radius_km=None):
+        """Index one saved search; amenities is a list (or comma-separated string) of normalized names."""
+        if isinstance(amenities, str):
+            amenities = amenities.split(",")
+        want = 0
+        for amenity in amenities or []:
+            if amenity:
+                want |= self._bits.setdefault(amenity, 1 << len(self._bits))
+        flag_mask = flag_want = 0
+        for i, value in enumerate((walkable, transit, car_friendly)):
+            if value is not None:
+                flag_mask |= 1 << i
+                if value:
+                    flag_want |= 1 << i
+        near = (lat, lon, radius_km) if radius_km is not None else None
+        key = location.lower() if location else None
+        self._by_location.setdefault(key, []).append((search_id, budget, want, flag_mask, flag_want, near))
+        self._count += 1
+
+    def match(self, listing):
+        """Ids of the saved searches a listing satisfies.
+
+        `listing` is shaped like db.hydrate_row output: normalized amenities
+        and the derived walkable/transit/car_friendly flags are required.
+        """
+        location = listing.get("location")
+        candidates = self._by_location.get(location.lower() if location else None, [])
+        if location:
+            candidates = candidates + self._by_location.get(None, [])
+        if not candidates:
+            return []
+        bits = self._bits
+        mask = 0
+        for amenity in listing["amenities"]:
+            mask |= bits.get(amenity, 0)
+        flags = sum(1 << i for i, key in enumerate(ACCESS_KEYS) if listing[key])
+        price = listing.get("price")
+        lat, lon = listing.get("lat"), listing.get("lon")
+        matched = []
+        for search_id, budget, want, flag_mask, flag_want, near in candidates:
+            if want & mask != want or flags & flag_mask != flag_want:
+                continue
+            if budget is not None and (price is None or price > budget):
+                continue
+            if near is not None and (lat is None or lon is None
+                                     or haversine_km(near[0], near[1], lat, lon) > near[2]):
+                continue
+            matched.append(search_id)
+        return matched
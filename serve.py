@@ -0,0 +1,218 @@
+"""Production server: a pre-fork pool of threaded WSGI workers sharing one preloaded app.
+
+The parent imports app.py once (migrations, backfill, the listings index or
+its snapshot, POIs, access rules), binds the listening socket and forks the
+workers, so that state is shared copy-on-write instead of loaded per worker.
+Each worker serves requests on a fixed thread pool and, with
+--max-requests, exits gracefully after that many requests (plus jitter);
+the parent replaces any worker that exits.
+
+    python serve.py --workers 4 --threads 8 --max-requests 10000
+
+Signals to the parent: SIGTERM/SIGINT drain every worker and exit (workers
+still busy after --graceful-timeout are killed); SIGHUP recycles the workers.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection, so an idle keep-alive client never pins a pool thread
+    protocol_version = "HTTP/1.0"
+
+
+class PoolWSGIServer(BaseWSGIServer):
+    """Werkzeug's WSGI server on an inherited socket, handling requests on a fixed thread pool.
+
+    The accept loop reserves a free thread before it accepts a connection, so
+    a worker with every thread busy leaves new connections to its siblings
+    (or to itself once a thread frees up). After max_requests
+    (0 = no limit) it stops accepting; drain() then waits for the requests
+    in flight.
+    """
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app, fd, threads=4, max_requests=0):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        # every worker polls the shared socket; the losers of an accept race must not block
+        self.socket.setblocking(False)
+        self.max_requests = max_requests
+        self.handled = 0
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="request")
+        self._stopping = False
+        # a slot taken by the accept loop and not yet handed to a request thread
+        self._reserved = False
+
+    def _handle_request_noblock(self):
+        # waits at most a poll interval, so the loop still notices shutdown()
+        if not self._slots.acquire(timeout=0.5):
+            return
+        self._reserved = True
+        try:
+            super()._handle_request_noblock()
+        finally:
+            # accept race lost, request rejected or process_request failed
+            if self._reserved:
+                self._reserved = False
+                self._slots.release()
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        if self.max_requests and self.handled >= self.max_requests:
+            self.stop()
+        self._executor.submit(self._handle, request, client_address)
+        self._reserved = False  # released by _handle from here on
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def stop(self):
+        """Stop accepting and let serve_forever() return (safe from signal handlers and request threads)."""
+        if not self._stopping:
+            self._stopping = True
+            # shutdown() blocks until the accept loop exits, so it cannot run on that thread
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def drain(self):
+        """Wait for the requests in flight (after serve_forever() has returned)."""
+        self._executor.shutdown(wait=True)
+
+
+def run_worker(webapp, sock, args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent coordinates Ctrl-C
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    max_requests = args.max_requests
+    if max_requests and args.max_requests_jitter:
+        # so workers started together don't all recycle at once
+        max_requests += random.randint(0, args.max_requests_jitter)
+    server = PoolWSGIServer(args.host, args.port, webapp.app, sock.fileno(),
+                            threads=args.threads, max_requests=max_requests)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    server.serve_forever()  # closes the listening socket on return
+    server.drain()
+
+
+def preload():
+    """Import the app in the parent and drop what must not cross a fork."""
+    start = time.perf_counter()
+    import app as webapp
+    # SQLite connections must not be shared with children; each worker reopens its own
+    webapp.db_pool.close()
+    if webapp.listings_index is not None:
+        webapp.listings_index.close()
+    else:
+        webapp.listings_watermark.close()
+    # move everything loaded so far out of the collector's reach, so collections
+    # in the workers don't touch (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+    loaded = f"{len(webapp.listings_index.store)} listings" if webapp.listings_index is not None else "SQL backend"
+    print(f"Loaded app in {time.perf_counter() - start:.2f}s ({loaded})")
+    return webapp
+
+
+def serve(args):
+    webapp = preload()
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    print(f"Listening on {args.host}:{args.port} with {args.workers} workers x {args.threads} threads")
+
+    workers = {}  # pid -> start time
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                run_worker(webapp, sock, args)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # never return into the parent's loop (or run its atexit handlers)
+                os._exit(code)
+        workers[pid] = time.monotonic()
+
+    def signal_workers(signum):
+        for pid in list(workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def on_stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            print("Shutting down: draining workers")
+            signal_workers(signal.SIGTERM)
+            signal.alarm(max(1, int(args.graceful_timeout)))
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, lambda signum, frame: signal_workers(signal.SIGTERM))
+    signal.signal(signal.SIGALRM, lambda signum, frame: signal_workers(signal.SIGKILL))
+
+    for _ in range(args.workers):
+        spawn()
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if code != 0 and time.monotonic() - started < 1:
+            # crashed while starting: don't respawn in a tight loop
+            print(f"Worker {pid} exited with {code} during startup", file=sys.stderr)
+            time.sleep(1)
+        spawn()
+    signal.alarm(0)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with a pre-fork pool of threaded workers.")
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1)))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("WEB_THREADS", 4)),
+                        help="request threads per worker")
+    parser.add_argument("--max-requests", type=int, default=int(os.environ.get("MAX_REQUESTS", 0)),
+                        help="recycle a worker after this many requests (0 = never)")
+    parser.add_argument("--max-requests-jitter", type=int, default=int(os.environ.get("MAX_REQUESTS_JITTER", 0)),
+                        help="add up to this many requests to each worker's limit")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="seconds a stopping worker may spend finishing its requests")
+    parser.add_argument("--backlog", type=int, default=2048)
+    args = parser.parse_args()
+    if args.workers < 1 or args.threads < 1:
+        parser.error("--workers and --threads must be at least 1")
+    serve(args)
+
+
+if __name__ == "__main__":
+    main()
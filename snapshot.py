@@ -0,0 +1,90 @@
+"""Binary snapshot files: a JSON header followed by aligned typed-array sections, read via mmap.
+
+Layout: MAGIC, header length (u64 little-endian), the UTF-8 JSON header,
+then each section padded to an 8-byte boundary. The header maps section
+names to (array typecode, offset from the data start, byte length). read()
+maps the file read-only and returns memoryviews cast to each typecode, so
+nothing is copied and every process mapping the same file shares its pages.
+"""
+from array import array
+import json
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"LSNAP\x00\x00\x01"
+ALIGN = 8
+
+
+def _padding(n):
+    return -n % ALIGN
+
+
+def write(path, header, sections):
+    """Atomically write a snapshot: `sections` maps names to (typecode, buffer).
+
+    The file is written next to `path`, fsynced and renamed over it, so
+    readers only ever see a complete snapshot.
+    """
+    layout = {}
+    offset = 0
+    for name, (typecode, data) in sections.items():
+        nbytes = memoryview(data).nbytes
+        layout[name] = [typecode, offset, nbytes]
+        offset += nbytes + _padding(nbytes)
+    itemsizes = {tc: array(tc).itemsize for tc, _ in sections.values()}
+    meta = dict(header, byteorder=sys.byteorder, itemsizes=itemsizes, sections=layout)
+    encoded = json.dumps(meta, separators=(",", ":")).encode()
+
+    tmp = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(encoded)
+            f.write(b"\0" * _padding(len(MAGIC) + 8 + len(encoded)))
+            for typecode, data in sections.values():
+                view = memoryview(data).cast("B")
+                f.write(view)
+                f.write(b"\0" * _padding(view.nbytes))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read(path):
+    """Map a snapshot read-only; returns (header, {section name: memoryview}).
+
+    Raises ValueError for files that are not snapshots or were written on a
+    machine with a different byte order or item sizes.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC) + 8:
+            raise ValueError("not a listings snapshot")
+        # the mapping stays valid after the file is closed (or replaced)
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a listings snapshot")
+    (header_len,) = struct.unpack_from("<Q", view, len(MAGIC))
+    start = len(MAGIC) + 8
+    header = json.loads(str(view[start:start + header_len], "utf-8"))
+    if header.get("byteorder") != sys.byteorder:
+        raise ValueError("snapshot byte order does not match this machine")
+    for typecode, itemsize in header["itemsizes"].items():
+        if array(typecode).itemsize != itemsize:
+            raise ValueError(f"snapshot item size for {typecode!r} does not match this machine")
+    data_start = start + header_len + _padding(start + header_len)
+    sections = {}
+    for name, (typecode, offset, nbytes) in header.pop("sections").items():
+        begin = data_start + offset
+        if begin + nbytes > size:
+            raise ValueError(f"snapshot section {name} is truncated")
+        sections[name] = view[begin:begin + nbytes].cast(typecode)
+    return header, sections
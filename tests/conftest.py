@@ -0,0 +1,63 @@
+"""Test setup: the repo root on sys.path and a throwaway database for the app.
+
+DATABASE_PATH is read when db.py is imported, so it is pointed at a temporary
+file here, before any test module imports db or app.
+"""
+import os
+import random
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="listings-tests-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "database.db")
+os.environ["LISTINGS_SNAPSHOT"] = os.path.join(_tmp, "database.db.snap")
+os.environ.setdefault("LISTINGS_BACKEND", "index")
+
+CITIES = ["Toronto", "Waterloo", "Ottawa", "Halifax"]
+AMENITY_CHOICES = ["wifi", "gym", "laundry", "parking", "pool", "pet-friendly", "dishwasher"]
+
+
+def make_listings(n, seed=0, start=0):
+    """n listing dicts with distinct titles, spread over CITIES and AMENITY_CHOICES."""
+    rng = random.Random(seed)
+    return [{
+        "title": f"Room {start + i} on {rng.choice(['King', 'Queen', 'Main', 'Front'])} St {rng.randrange(10**6)}",
+        "price": rng.randrange(500, 1500) if i % 17 else None,
+        "location": CITIES[i % len(CITIES)],
+        "amenities": rng.sample(AMENITY_CHOICES, rng.randrange(0, 4)),
+    } for i in range(n)]
+
+
+@pytest.fixture
+def app_module():
+    """The app, imported once, over an emptied database."""
+    import app
+    with app.get_db() as conn:
+        for table in ("saved_search_matches", "saved_searches", "listing_lsh", "listing_amenities", "listings"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def seed(app_module):
+    """Insert listing dicts through db.insert_listings; returns the new ids."""
+    import db
+
+    def insert(listings):
+        ids = []
+        with app_module.get_db() as conn:
+            db.insert_listings(conn, listings, on_batch=lambda batch_ids, written: ids.extend(batch_ids))
+            conn.commit()
+        return ids
+    return insert
@@ -0,0 +1,156 @@
+import json
+
+from conftest import make_listings
+
+
+def ids(items):
+    return [item["id"] for item in items]
+
+
+def test_cursor_pages_follow_the_full_ranking(client, seed):
+    seed(make_listings(120))
+    full = client.get("/api/listings", query_string={"budget": 1200, "amenities": "wifi"}).get_json()
+    pages = []
+    query = {"budget": 1200, "amenities": "wifi", "limit": 7}
+    while True:
+        page = client.get("/api/listings", query_string=query).get_json()
+        pages += page["items"]
+        assert page["total"] == len(full)
+        if page["next_cursor"] is None:
+            break
+        query["cursor"] = page["next_cursor"]
+    assert ids(pages) == ids(full)
+
+
+def test_offset_and_cursor_pages_agree(client, seed):
+    seed(make_listings(60))
+    first = client.get("/api/listings", query_string={"limit": 10}).get_json()
+    by_offset = client.get("/api/listings", query_string={"limit": 10, "offset": 10}).get_json()
+    by_cursor = client.get("/api/listings", query_string={"limit": 10, "cursor": first["next_cursor"]}).get_json()
+    assert ids(by_offset["items"]) == ids(by_cursor["items"])
+
+
+def test_streamed_pages_carry_the_next_cursor(client, seed):
+    seed(make_listings(30))
+    full = client.get("/api/listings").get_json()
+    resp = client.get("/api/listings?format=ndjson&limit=5")
+    assert resp.status_code == 200
+    assert resp.headers["X-Total-Count"] == str(len(full))
+    first = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    resp = client.get("/api/listings", query_string={"format": "ndjson", "limit": 5,
+                                                     "cursor": resp.headers["X-Next-Cursor"]})
+    second = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    assert ids(first + second) == ids(full[:10])
+
+
+def test_streamed_array_matches_plain_response(client, seed):
+    seed(make_listings(25))
+    plain = client.get("/api/listings", query_string={"location": "toronto"}).get_json()
+    streamed = json.loads(client.get("/api/listings", query_string={"location": "toronto", "format": "array"}).data)
+    assert streamed == plain
+    # the whole result fits on one page: no cursor
+    assert "X-Next-Cursor" not in client.get("/api/listings?format=ndjson&limit=100").headers
+
+
+def test_bad_cursor_is_rejected(client):
+    assert client.get("/api/listings?limit=5&cursor=not-a-cursor").status_code == 400
+
+
+def expected_facets(items, bounds):
+    cities, amenities = {}, {}
+    for item in items:
+        cities[item["location"]] = cities.get(item["location"], 0) + 1
+        for amenity in set(item["amenities"]):
+            amenities[amenity] = amenities.get(amenity, 0) + 1
+    price = []
+    for i, low in enumerate(bounds):
+        high = bounds[i + 1] if i + 1 < len(bounds) else None
+        price.append(sum(1 for item in items if item["price"] is not None and item["price"] >= low
+                         and (high is None or item["price"] < high)))
+    return {
+        "total": len(items),
+        "cities": cities,
+        "amenities": amenities,
+        "access": {key: sum(1 for item in items if item[key]) for key in ("walkable", "transit", "car_friendly")},
+        "price": price,
+        "price_unknown": sum(1 for item in items if item["price"] is None),
+    }
+
+
+def test_facets_count_the_listings_the_same_filters_return(client, seed, app_module):
+    seed(make_listings(150))
+    for query in ({}, {"budget": 1000}, {"location": "Waterloo", "amenities": "wifi"}, {"transit": "true"}):
+        items = client.get("/api/listings", query_string=query).get_json()
+        facets = client.get("/api/facets", query_string=query).get_json()
+        expected = expected_facets(items, app_module.PRICE_BUCKETS)
+        assert facets["total"] == expected["total"]
+        assert {f["value"]: f["count"] for f in facets["cities"]} == expected["cities"]
+        assert {f["value"]: f["count"] for f in facets["amenities"]} == expected["amenities"]
+        assert facets["access"] == expected["access"]
+        assert [bucket["count"] for bucket in facets["price"]] == expected["price"]
+        assert facets["price_unknown"] == expected["price_unknown"]
+        counts = [f["count"] for f in facets["cities"]]
+        assert counts == sorted(counts, reverse=True)
+
+
+def test_facets_reject_bad_filters(client):
+    assert client.get("/api/facets?near=no-such-campus").status_code == 400
+
+
+def test_batch_results_match_single_queries(client, seed):
+    seed(make_listings(400))
+    profiles = [
+        {"id": "a", "budget": 900, "location": "Toronto", "amenities": ["wifi"]},
+        {"id": "b", "location": "Ottawa", "walkable": True},
+        {"id": "c", "budget": 1400, "amenities": "gym,laundry", "transit": "false"},
+        {"id": "d", "budget": 900, "location": "toronto", "amenities": ["wifi"]},
+    ]
+    resp = client.post("/api/match/batch", json={"profiles": profiles, "top_k": 5})
+    assert resp.status_code == 200
+    results = resp.get_json()["results"]
+    assert [r["id"] for r in results] == ["a", "b", "c", "d"]
+    for profile, result in zip(profiles, results):
+        query = {key: value for key, value in profile.items() if key != "id"}
+        if isinstance(query.get("amenities"), list):
+            query["amenities"] = ",".join(query["amenities"])
+        single = client.get("/api/listings", query_string=dict(query, limit=5)).get_json()
+        assert result["total"] == single["total"]
+        assert result["items"] == single["items"]
+
+
+def test_batch_rejects_bad_profiles(client):
+    assert client.post("/api/match/batch", json={"profiles": "nope"}).status_code == 400
+    resp = client.post("/api/match/batch", json={"profiles": [{}, {"budget": "cheap"}]})
+    assert resp.status_code == 400
+    assert resp.get_json()["error"].startswith("profile 1:")
+
+
+def test_etag_revalidates_until_the_listings_change(client, seed):
+    seed(make_listings(80))
+    resp = client.get("/api/listings?limit=5")
+    etag = resp.headers["ETag"]
+    assert client.get("/api/listings?limit=5", headers={"If-None-Match": etag}).status_code == 304
+    # the gzip variant's tag names the same response
+    gzipped = client.get("/api/listings", headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert client.get("/api/listings", headers={"If-None-Match": gzipped.headers["ETag"]}).status_code == 304
+    seed([{"title": "Freshly listed attic room", "price": 650, "location": "Ottawa", "amenities": ["wifi"]}])
+    resp = client.get("/api/listings?limit=5", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_etag_is_the_same_in_every_process(client, seed, app_module):
+    """Tags come from the database state, so another worker (here: a second connection) agrees on them."""
+    from werkzeug.datastructures import MultiDict
+    import db
+    seed(make_listings(40))
+    etag = client.get("/api/facets?location=Halifax").headers["ETag"].strip('"')
+    other = db.connect(app_module.DATABASE)
+    version = db.listings_watermark(other.cursor())
+    other.close()
+    # the same with either backend: the index's version or the SQL watermark
+    with app_module.app.test_request_context():
+        assert app_module.refresh_listings() == version
+    key = ("facets",) + app_module.filters_key(app_module.parse_listing_filters(MultiDict({"location": "Halifax"})))
+    assert app_module.response_etag(version, key) == etag
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+import db
+from conftest import make_listings
+
+INDEX_TRIGGERS = sorted(db.BULK_INDEX_TRIGGERS)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = db.connect(str(tmp_path / "listings.db"))
+    db.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def with_coords(listings, seed=4):
+    rng = random.Random(seed)
+    for i, listing in enumerate(listings):
+        if i % 5:
+            listing["lat"], listing["lon"] = rng.uniform(42, 46), rng.uniform(-81, -63)
+    return listings
+
+
+def index_triggers(conn):
+    return sorted(name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?)", INDEX_TRIGGERS))
+
+
+def assert_indexes_match_listings(conn):
+    rtree = conn.execute("SELECT id, min_lat, min_lon FROM listings_rtree ORDER BY id").fetchall()
+    stored = conn.execute("SELECT id, lat, lon FROM listings WHERE lat IS NOT NULL ORDER BY id").fetchall()
+    assert [row[0] for row in rtree] == [row[0] for row in stored]
+    # the R*Tree keeps 32-bit floats
+    assert all(abs(a[1] - b[1]) < 1e-4 and abs(a[2] - b[2]) < 1e-4 for a, b in zip(rtree, stored))
+    conn.execute("INSERT INTO listings_fts (listings_fts) VALUES ('integrity-check')")
+    for word in ("room", "king", "queen"):
+        expected = {i for (i,) in conn.execute("SELECT id FROM listings WHERE title LIKE ?", (f"%{word}%",))}
+        assert set(db.text_search(conn, word)) == expected
+
+
+@pytest.mark.parametrize("batch_size", [1, db.BULK_INDEX_MIN - 1, db.BULK_INDEX_MIN, 5000])
+def test_spatial_and_text_indexes_cover_every_insert(conn, batch_size):
+    if not (db.has_rtree(conn) and db.has_fts(conn)):
+        pytest.skip("SQLite without R*Tree or FTS5")
+    db.insert_listings(conn, with_coords(make_listings(600)), batch_size=batch_size)
+    db.insert_listings(conn, with_coords(make_listings(3, seed=9, start=600)))
+    conn.commit()
+    assert index_triggers(conn) == INDEX_TRIGGERS
+    assert_indexes_match_listings(conn)
+
+
+def test_committing_between_batches_keeps_the_triggers(conn):
+    if not (db.has_rtree(conn) and db.has_fts(conn)):
+        pytest.skip("SQLite without R*Tree or FTS5")
+    seen = []
+
+    def on_batch(ids, batch):
+        seen.append(index_triggers(conn))
+        conn.commit()
+    db.insert_listings(conn, with_coords(make_listings(1000)), batch_size=db.BULK_INDEX_MIN, on_batch=on_batch)
+    assert seen and all(triggers == INDEX_TRIGGERS for triggers in seen)
+    assert_indexes_match_listings(conn)
+
+
+def test_a_failed_batch_rolls_back_with_its_triggers(conn):
+    listings = make_listings(db.BULK_INDEX_MIN)
+    listings[-1]["price"] = {"amount": 900}  # cannot be bound: fails half-way through the executemany
+    with pytest.raises(Exception):
+        db.insert_listings(conn, listings)
+    conn.rollback()
+    assert conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0] == 0
+    assert index_triggers(conn) == INDEX_TRIGGERS
+
+
+def test_a_reused_id_does_not_inherit_amenities(conn):
+    db.insert_listings(conn, [
+        {"title": "Sunny room by the lake", "price": 800, "location": "Toronto", "amenities": ["wifi"]},
+        {"title": "Loft with a pool", "price": 1200, "location": "Toronto", "amenities": ["wifi", "pool"]},
+    ])
+    conn.commit()
+    conn.execute("DELETE FROM listings WHERE id = 2")
+    db.insert_listings(conn, [{"title": "Plain basement room", "price": 600, "location": "Toronto",
+                               "amenities": ["wifi"]}])
+    conn.commit()
+    assert conn.execute("SELECT MAX(id) FROM listings").fetchone()[0] == 2
+    assert db.query_listings(conn, wanted=["pool"]) == []
+    assert [l["id"] for l in db.query_listings(conn, wanted=["wifi"])] == [1, 2]
+
+
+def test_migrate_drops_rows_orphaned_before_foreign_keys(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = db.connect(path)
+    db.migrate(conn)
+    db.insert_listings(conn, [dict(listing, amenities=["wifi"]) for listing in make_listings(3)])
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("DELETE FROM listings WHERE id = 3")
+    conn.execute("PRAGMA user_version = 7")
+    conn.commit()
+    db.migrate(conn)
+    assert [i for (i,) in conn.execute("SELECT listing_id FROM listing_amenities ORDER BY listing_id")] == [1, 2]
+    conn.close()
+
+
+def test_migrate_indexes_rows_written_before_the_indexes_existed(conn):
+    if not (db.has_rtree(conn) and db.has_fts(conn)):
+        pytest.skip("SQLite without R*Tree or FTS5")
+    db.insert_listings(conn, with_coords(make_listings(300)))
+    conn.commit()
+    for table in ("listings_rtree", "listings_fts"):
+        conn.execute(f"DROP TABLE {table}")
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'"
+                                " AND (name LIKE 'listings_rtree_%' OR name LIKE 'listings_fts_%')").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.commit()
+    db.migrate(conn)
+    assert_indexes_match_listings(conn)
+    # a second migrate() leaves the (already complete) indexes alone
+    db.migrate(conn)
+    assert_indexes_match_listings(conn)
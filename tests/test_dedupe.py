@@ -0,0 +1,93 @@
+import pytest
+
+import db
+from dedupe import DedupeReport
+
+STUDIO = {"title": "Cozy studio near campus", "price": 900, "location": "Waterloo", "amenities": ["wifi", "laundry"]}
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = db.connect(str(tmp_path / "listings.db"))
+    db.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def insert(conn, listings, batch_size=1000):
+    report = DedupeReport()
+    db.insert_listings(conn, listings, batch_size=batch_size, report=report)
+    conn.commit()
+    return report
+
+
+def variant(**changes):
+    return dict(STUDIO, **changes)
+
+
+@pytest.mark.parametrize("batch_size", [1, 1000])
+def test_exact_and_near_duplicates_are_merged(conn, batch_size):
+    report = insert(conn, [
+        STUDIO,
+        variant(title="Cozy studio near campus"),
+        variant(title="Cozy Studio, near campus!", price=950, amenities=["wifi", "laundry", "gym"]),
+    ], batch_size)
+    assert (report.inserted, report.exact, report.near) == (1, 1, 1)
+    assert [kind for kind, _, _ in report.examples] == ["exact", "near"]
+    assert {duplicate_of for _, _, duplicate_of in report.examples} == {1}
+
+
+@pytest.mark.parametrize("other", [
+    variant(title="Cozy studio near campus!", price=700),  # price too far off
+    variant(title="Cozy studio near campus!", amenities=["gym", "pool"]),  # no amenities in common
+    variant(title="Cozy studio near campus!", price=None),  # unknown price
+    variant(title="Cozy studio near campus!", location="Toronto"),  # other city
+    variant(title="Cozy studio near campus 2"),  # other numbers in the title
+    variant(title="Bright loft by the park"),  # other title
+])
+def test_similar_titles_alone_are_not_duplicates(conn, other):
+    # stored in an earlier call, so it is found through listing_lsh as well as in memory
+    insert(conn, [STUDIO])
+    report = insert(conn, [other])
+    assert (report.inserted, report.merged) == (1, 0)
+
+
+def test_same_title_with_another_price_and_amenities_is_kept(conn):
+    report = insert(conn, [
+        {"title": "Cozy studio", "price": 999, "location": "Toronto", "amenities": ["gym"]},
+        {"title": "Cozy studio!", "price": 700, "location": "Toronto", "amenities": ["wifi"]},
+    ])
+    assert (report.inserted, report.merged) == (2, 0)
+
+
+def test_dedupe_command_uses_the_same_rules(conn):
+    rows = [STUDIO, variant(title="Cozy studio near campus!", price=910), variant(title="Cozy studio near campus!!", price=500)]
+    for i, l in enumerate(rows, 1):
+        conn.execute("INSERT INTO listings (id, title, price, location, amenities) VALUES (?, ?, ?, ?, ?)",
+                     (i, l["title"], l["price"], l["location"], ",".join(l["amenities"])))
+    conn.commit()
+    report = db.dedupe_listings(conn)
+    assert (report.inserted, report.near) == (2, 1)
+    assert [i for (i,) in conn.execute("SELECT id FROM listings ORDER BY id")] == [1, 3]
+
+
+def test_post_answers_with_the_listing_kept(client):
+    created = client.post("/api/listings", json=STUDIO)
+    assert created.status_code == 201
+    listing_id = created.get_json()["id"]
+    assert client.post("/api/listings", json=STUDIO).get_json() == {"id": listing_id, "duplicate": "exact"}
+    near = client.post("/api/listings", json=variant(title="Cozy studio, near campus", price=920))
+    assert near.status_code == 200
+    assert near.get_json() == {"id": listing_id, "duplicate": "near"}
+    other = client.post("/api/listings", json=variant(title="Cozy studio, near campus", price=600))
+    assert other.status_code == 201
+
+
+@pytest.mark.parametrize("near_duplicates, counts", [(True, (1, 1, 1)), (False, (2, 1, 0))])
+def test_exact_only_loads_skip_the_near_duplicate_check(conn, near_duplicates, counts):
+    report = DedupeReport()
+    db.insert_listings(conn, [STUDIO, STUDIO, variant(title="A cozy studio near campus")], report=report,
+                       near_duplicates=near_duplicates)
+    assert (report.inserted, report.exact, report.near) == counts
+    has_buckets = conn.execute("SELECT COUNT(*) FROM listing_lsh").fetchone()[0] > 0
+    assert has_buckets == near_duplicates
@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+import listing_store
+import matching
+from conftest import make_listings
+from listing_store import CandidateSet, ListingStore
+from matching import VECTORIZE_MIN, compute_matchability, matchability_values
+
+N = VECTORIZE_MIN * 3
+
+CASES = [
+    {},
+    {"budget": 900},
+    {"budget": 400},
+    {"wanted_norm": ["wifi"]},
+    {"wanted_norm": ["wifi", "gym"], "budget": 1200},
+    {"access_filters": ["walkable"]},
+    {"wanted_norm": ["laundry"], "access_filters": ["transit", "car_friendly"], "budget": 1000},
+    {"budget": 800, "relevance": True},
+    {"wanted_norm": ["pool"], "distances": True, "radius_km": 5.0},
+]
+
+
+def hydrated(n, seed=1):
+    rng = random.Random(seed)
+    rows = []
+    for i, listing in enumerate(make_listings(n, seed=seed)):
+        row = dict(listing, id=i + 1, lat=None, lon=None)
+        for flag, score in (("walkable", "walkable_score"), ("transit", "transit_score"), ("car_friendly", "car_score")):
+            row[score] = rng.randrange(0, 101)
+            row[flag] = int(row[score] >= 50)
+        rows.append(row)
+    return rows
+
+
+def expand(case, n, seed=2):
+    """A CASES entry with its per-listing inputs filled in."""
+    rng = random.Random(seed)
+    kwargs = dict(case)
+    if kwargs.pop("relevance", False):
+        kwargs["relevance"] = [rng.random() for _ in range(n)]
+    if kwargs.get("distances"):
+        kwargs["distances"] = [rng.uniform(0, 6) for _ in range(n)]
+    return kwargs
+
+
+def reference(listings, kwargs):
+    copies = [dict(l) for l in listings]
+    compute_matchability(copies, **kwargs)
+    return [l["matchability"] for l in copies]
+
+
+@pytest.fixture(params=["numpy", "no numpy"])
+def numpy_mode(request, monkeypatch):
+    if request.param == "numpy":
+        if matching.np is None:
+            pytest.skip("numpy is not installed")
+    else:
+        monkeypatch.setattr(matching, "np", None)
+        monkeypatch.setattr(listing_store, "np", None)
+    return request.param
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_matchability_values_match_reference(case, numpy_mode):
+    listings = hydrated(N)
+    kwargs = expand(case, N)
+    assert matchability_values(listings, **kwargs) == reference(listings, kwargs)
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_store_matchability_matches_reference(case, numpy_mode):
+    listings = hydrated(N)
+    store = ListingStore.from_listings(listings)
+    positions = list(range(0, N, 2))
+    kwargs = expand(case, len(positions))
+    expected = reference([listings[p] for p in positions], kwargs)
+    assert store.matchability(positions, **kwargs) == expected
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"budget": 900},
+    {"wanted": ["wifi"]},
+    {"wanted": ["wifi", "gym"], "walkable": True},
+    {"transit": False, "car_friendly": True, "budget": 1300},
+    {"wanted": ["no-such-amenity"]},
+])
+def test_candidate_set_filter_matches_store(filters, numpy_mode):
+    store = ListingStore.from_listings(hydrated(N))
+    positions = list(range(N))
+    assert CandidateSet(store, positions).filter(**filters) == store.filter_positions(positions, **filters)
+
+
+def test_rank_positions_cursor_continues_ranking():
+    rng = random.Random(3)
+    ids = list(range(1, 201))
+    scores = [rng.randrange(0, 5) for _ in ids]
+    full = matching.rank_positions(ids, scores)
+    page = matching.rank_positions(ids, scores, limit=30)
+    assert page == full[:30]
+    score, i = page[-1]
+    assert matching.rank_positions(ids, scores, limit=30, after=(score, ids[i])) == full[30:60]
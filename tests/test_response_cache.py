@@ -0,0 +1,44 @@
+import json
+
+
+def body(app_module, size):
+    return app_module.CachedBody(json.dumps(["x" * (size - 4)]).encode())
+
+
+def test_entries_are_evicted_to_stay_within_the_byte_budget(app_module):
+    cache = app_module.ResponseCache(max_entries=100, max_bytes=10_000, max_entry_bytes=5000)
+    for key in range(5):
+        cache.put(1, key, body(app_module, 3000))
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["bytes"] == 9000 and stats["evictions"] == 2
+    assert cache.get(1, 0) is None and cache.get(1, 4) is not None
+
+
+def test_oversized_bodies_are_not_cached(app_module):
+    cache = app_module.ResponseCache(max_entries=100, max_bytes=10_000, max_entry_bytes=4000)
+    cache.put(1, "small", body(app_module, 3000))
+    cache.put(1, "huge", body(app_module, 5000))
+    assert cache.get(1, "huge") is None and cache.get(1, "small") is not None
+    assert cache.stats()["oversized"] == 1 and cache.stats()["bytes"] == 3000
+
+
+def test_compressed_variants_count_towards_the_budget(app_module):
+    cache = app_module.ResponseCache(max_entries=100, max_bytes=10_000, max_entry_bytes=5000)
+    entry = body(app_module, 3000)
+    cache.put(1, "key", entry)
+    entry.encoded("gzip")
+    cache.put(1, "key", entry)
+    assert cache.stats()["bytes"] == entry.nbytes > 3000
+    assert cache.stats()["entries"] == 1
+    # a new version drops everything, bytes included
+    assert cache.get(2, "key") is None and cache.stats()["bytes"] == 0
+
+
+def test_hits_charge_the_variants_they_compress(client, seed, app_module):
+    from conftest import make_listings
+    seed(make_listings(200))
+    client.get("/api/listings")
+    before = app_module.response_cache.stats()["bytes"]
+    resp = client.get("/api/listings", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["X-Cache"] == "HIT" and resp.headers["Content-Encoding"] == "gzip"
+    assert app_module.response_cache.stats()["bytes"] == before + len(resp.get_data())
@@ -0,0 +1,78 @@
+from conftest import make_listings
+
+
+def matches(client, search_id, since=0):
+    resp = client.get(f"/api/saved-searches/{search_id}/matches", query_string={"since": since})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_new_listings_are_matched_against_saved_searches(client, seed):
+    seed(make_listings(20))
+    search_id = client.post("/api/saved-searches", json={"name": "cheap wifi", "location": "Toronto",
+                                                         "budget": 1000, "amenities": ["wifi"]}).get_json()["id"]
+    assert matches(client, search_id)["items"] == []
+    new = [
+        {"title": "Sunny room near campus", "price": 900, "location": "Toronto", "amenities": ["WiFi", "gym"]},
+        {"title": "Basement suite with parking", "price": 1200, "location": "Toronto", "amenities": ["wifi"]},
+        {"title": "Quiet loft by the market", "price": 800, "location": "Ottawa", "amenities": ["wifi"]},
+        {"title": "Bright studio off Queen St", "price": 950, "location": "toronto", "amenities": ["internet"]},
+    ]
+    ids = seed(new)
+    feed = matches(client, search_id)
+    assert [item["id"] for item in feed["items"]] == [ids[0], ids[3]]
+    assert feed["has_more"] is False
+    # polling from next_since only returns what arrived afterwards
+    later = seed([{"title": "Corner unit with balcony", "price": 700, "location": "Toronto", "amenities": ["wifi"]}])
+    feed = matches(client, search_id, since=feed["next_since"])
+    assert [item["id"] for item in feed["items"]] == later
+
+
+def test_replacing_the_newest_search_rebuilds_the_match_index(client, seed):
+    toronto = client.post("/api/saved-searches", json={"location": "Toronto"}).get_json()["id"]
+    seed([{"title": "Warm-up room on King St", "price": 900, "location": "Toronto", "amenities": []}])
+    assert client.delete(f"/api/saved-searches/{toronto}").status_code == 204
+    # SQLite hands out the freed id again, so the saved-search count and max id are unchanged
+    halifax = client.post("/api/saved-searches", json={"location": "Halifax"}).get_json()["id"]
+    assert halifax == toronto
+    ids = seed([
+        {"title": "Harbour view bedroom", "price": 800, "location": "Halifax", "amenities": []},
+        {"title": "Room by the lake shore", "price": 850, "location": "Toronto", "amenities": []},
+    ])
+    assert [item["id"] for item in matches(client, halifax)["items"]] == [ids[0]]
+
+
+def test_saved_search_round_trip_and_delete(client):
+    resp = client.post("/api/saved-searches", json={"name": "walk", "walkable": True, "amenities": "gym, pool"})
+    assert resp.status_code == 201
+    search_id = resp.get_json()["id"]
+    search = client.get(f"/api/saved-searches/{search_id}").get_json()
+    assert search["wanted"] == ["gym", "pool"] and search["walkable"] is True and search["location"] is None
+    assert client.delete(f"/api/saved-searches/{search_id}").status_code == 204
+    assert client.get(f"/api/saved-searches/{search_id}").status_code == 404
+    assert client.get(f"/api/saved-searches/{search_id}/matches").status_code == 404
+    assert client.post("/api/saved-searches", json={"q": "loft"}).status_code == 400
+
+
+def test_saved_search_names_must_be_short_strings(client):
+    for name in (["walk"], {"a": 1}, 42, "x" * 201):
+        resp = client.post("/api/saved-searches", json={"name": name, "location": "Toronto"})
+        assert resp.status_code == 400
+        assert resp.get_json()["error"].startswith("name must be a string")
+    assert client.get("/api/saved-searches/1").status_code == 404
+    resp = client.post("/api/saved-searches", json={"name": "x" * 200, "location": "Toronto"})
+    assert resp.status_code == 201
+    assert client.get(f"/api/saved-searches/{resp.get_json()['id']}").get_json()["name"] == "x" * 200
+
+
+def test_a_reused_listing_id_does_not_inherit_matches(client, seed, app_module):
+    search_id = client.post("/api/saved-searches", json={"location": "Toronto"}).get_json()["id"]
+    [deleted] = seed([{"title": "Room on Front St", "price": 900, "location": "Toronto", "amenities": []}])
+    with app_module.get_db() as conn:
+        conn.execute("DELETE FROM listings WHERE id = ?", (deleted,))
+        conn.commit()
+    assert matches(client, search_id)["items"] == []
+    # MAX(id) + 1 hands the deleted id out again
+    reused = seed([{"title": "Harbour view bedroom", "price": 800, "location": "Halifax", "amenities": []}])
+    assert reused == [deleted]
+    assert matches(client, search_id)["items"] == []